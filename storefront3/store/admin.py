@@ -4,6 +4,7 @@ from django.db.models.query import QuerySet
 from django.utils.html import format_html, urlencode
 from django.urls import reverse
 from . import models
+from .caching import bump_version
 
 
 class InventoryFilter(admin.SimpleListFilter):
@@ -47,6 +48,8 @@ class ProductAdmin(admin.ModelAdmin):
     @admin.action(description='Clear inventory')
     def clear_inventory(self, request, queryset):
         updated_count = queryset.update(inventory=0)
+        # queryset.update() bypasses the signals that invalidate the cached responses
+        bump_version('catalog')
         self.message_user(
             request,
             f'{updated_count} products were successfully updated.',
@@ -70,10 +73,13 @@ class CollectionAdmin(admin.ModelAdmin):
             }))
         return format_html('<a href="{}">{} Products</a>', url, collection.products_count)
 
-    def get_queryset(self, request):
-        return super().get_queryset(request).annotate(
-            products_count=Count('products')
-        )
+
+@admin.register(models.TaxRate)
+class TaxRateAdmin(admin.ModelAdmin):
+    autocomplete_fields = ['collection']
+    list_display = ['region', 'collection', 'rate']
+    list_editable = ['rate']
+    list_select_related = ['collection']
 
 
 @admin.register(models.Customer)
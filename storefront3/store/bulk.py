@@ -0,0 +1,143 @@
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from .caching import bump_version
+from .counters import reconcile_products_count
+from .models import Collection, Product, Promotion
+from .pricing import invalidate_promotions
+from .search import get_search_backend
+from .serializers import BulkProductSerializer
+
+#########################################################################################
+# Bulk product import
+# - rows with an id update that product (only the given fields), the others are
+#   created
+# - the rows are processed in batches, every batch :
+#   - validates its rows without touching the database, then checks the ids of the
+#     products / collections / promotions with one query per model
+#   - writes the valid rows in one transaction with bulk_create / bulk_update and
+#     replaces the promotions of the rows which have them in bulk
+# - invalid rows are reported by index and skipped, they don't stop the import
+# - bulk writes don't send signals, the search index, the cache tags and the
+#   products_count of the collections are updated per batch instead
+#########################################################################################
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def import_products(rows, batch_size=DEFAULT_BATCH_SIZE):
+    result = {'created': 0, 'updated': 0, 'errors': []}
+    for start in range(0, len(rows), batch_size):
+        import_batch(rows[start:start + batch_size], start, result)
+    return result
+
+
+def validate_batch(rows, offset, errors):
+    create_serializer = BulkProductSerializer()
+    update_serializer = BulkProductSerializer(partial=True)
+
+    valid = []
+    for index, row in enumerate(rows, start=offset):
+        if not isinstance(row, dict):
+            errors.append({'index': index, 'errors': {'non_field_errors': ['Expected an object.']}})
+            continue
+        serializer = update_serializer if row.get('id') is not None else create_serializer
+        try:
+            valid.append((index, serializer.run_validation(row)))
+        except ValidationError as exc:
+            errors.append({'index': index, 'errors': exc.detail})
+    return valid
+
+
+def check_ids(valid, errors):
+    # one query per model for the whole batch
+    product_ids = {data['id'] for _, data in valid if 'id' in data}
+    collection_ids = {data['collection_id'] for _, data in valid if 'collection_id' in data}
+    promotion_ids = {pk for _, data in valid for pk in data.get('promotions', [])}
+
+    products = Product.objects.in_bulk(product_ids)
+    collections = set(Collection.objects.filter(id__in=collection_ids).values_list('id', flat=True))
+    promotions = set(Promotion.objects.filter(id__in=promotion_ids).values_list('id', flat=True))
+
+    checked = []
+    for index, data in valid:
+        row_errors = {}
+        if 'id' in data and data['id'] not in products:
+            row_errors['id'] = ['No product with the given ID was found.']
+        if 'collection_id' in data and data['collection_id'] not in collections:
+            row_errors['collection'] = ['No collection with the given ID was found.']
+        missing = set(data.get('promotions', [])) - promotions
+        if missing:
+            row_errors['promotions'] = [f'No promotion with the ID {pk} was found.' for pk in sorted(missing)]
+
+        if row_errors:
+            errors.append({'index': index, 'errors': row_errors})
+        else:
+            checked.append(data)
+    return checked, products
+
+
+def import_batch(rows, offset, result):
+    valid = validate_batch(rows, offset, result['errors'])
+    checked, products = check_ids(valid, result['errors'])
+    if not checked:
+        return
+
+    # collections whose products_count may change
+    collection_ids = {product.collection_id for product in products.values()}
+    collection_ids |= {data['collection_id'] for data in checked if 'collection_id' in data}
+
+    now = timezone.now()
+    created, updated, update_fields, promotions = [], [], {'last_update'}, []
+    for data in checked:
+        promotion_ids = data.pop('promotions', None)
+        if 'id' in data:
+            product = products[data.pop('id')]
+            for field, value in data.items():
+                setattr(product, field, value)
+            update_fields.update(data)
+            product.last_update = now
+            updated.append(product)
+        else:
+            product = Product(**data)
+            created.append(product)
+        if promotion_ids is not None:
+            promotions.append((product, promotion_ids))
+
+    with transaction.atomic():
+        if connection.features.can_return_rows_from_bulk_insert:
+            Product.objects.bulk_create(created)
+        else:
+            # the ids of the new rows are only needed for their promotions
+            with_promotions = {id(product) for product, _ in promotions}
+            Product.objects.bulk_create(
+                [product for product in created if id(product) not in with_promotions])
+            for product in created:
+                if id(product) in with_promotions:
+                    product.save()
+        if updated:
+            Product.objects.bulk_update(updated, fields=sorted(update_fields))
+        replace_promotions(promotions)
+        reconcile_products_count(collection_ids)
+
+        backend = get_search_backend()
+        if backend:
+            backend.index_many(product for product in created + updated if product.id)
+        bump_version('catalog')
+
+    result['created'] += len(created)
+    result['updated'] += len(updated)
+
+
+def replace_promotions(promotions):
+    if not promotions:
+        return
+    Through = Product.promotions.through
+    Through.objects.filter(product_id__in=[product.id for product, _ in promotions]).delete()
+    Through.objects.bulk_create([
+        Through(product_id=product.id, promotion_id=promotion_id)
+        for product, promotion_ids in promotions
+        for promotion_id in set(promotion_ids)
+    ])
+    # bulk_create doesn't send m2m_changed
+    invalidate_promotions()
@@ -0,0 +1,41 @@
+from uuid import uuid4
+from django.core.cache import cache
+from django.db import connection, transaction
+
+#########################################################################################
+# Version tokens
+# - every tag (e.g. 'catalog', 'tax_rates') has a random version token stored in the
+#   shared cache without expiry
+# - anything derived from the tagged rows (in-memory copies, ETags, ...) embeds the
+#   token, writes to the rows bump it which invalidates all of them at once
+# - a missing token (evicted, cache flushed) is replaced by a new random one, so it
+#   invalidates as well instead of going back to an old value
+#########################################################################################
+
+VERSION_KEY = 'store:version:{}'
+
+
+def get_versions(*tags):
+    keys = {VERSION_KEY.format(tag): tag for tag in tags}
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    for key in missing:
+        cache.add(key, uuid4().hex, timeout=None)
+    if missing:
+        versions.update(cache.get_many(missing))
+    return {tag: versions[key] for key, tag in keys.items()}
+
+
+def get_version(tag):
+    return get_versions(tag)[tag]
+
+
+def bump_version(*tags):
+    def bump():
+        cache.set_many({VERSION_KEY.format(tag): uuid4().hex for tag in tags}, timeout=None)
+
+    bump()
+    # bump again once the transaction commits, readers may have picked up the
+    # new token while the old rows were still the committed ones
+    if connection.in_atomic_block:
+        transaction.on_commit(bump)
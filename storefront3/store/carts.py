@@ -0,0 +1,764 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
+from uuid import uuid4
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from django_redis import get_redis_connection
+from rest_framework.serializers import BaseSerializer
+from .caching import get_versions
+from .mixins import project_queryset
+from .models import Cart, CartItem, Product
+from .pricing import with_cart_item_prices, with_cart_totals, with_effective_prices
+
+#########################################################################################
+# Adding to a cart in one statement
+# - INSERT ... SELECT ... upsert : the row is inserted, or its quantity incremented
+#   when the (cart, product) pair already exists, atomically in the database
+#   - MySQL (>= 8.0.19) : ON DUPLICATE KEY UPDATE quantity = quantity + <new row>,
+#     the new row is named by an alias instead of the deprecated VALUES(quantity)
+#   - SQLite / Postgres : ON CONFLICT (cart_id, product_id) DO UPDATE
+# - the SELECT joins the cart and the product, nothing is inserted when either is
+#   missing : no separate existence checks, no race on unique_together
+# - the incremented quantities are capped at MAX_QUANTITY (LEAST, MIN on SQLite), the
+#   bound of the smallint columns of CartItem / OrderItem
+# - every change of the items also sets Cart.updated_at (touch_cart), which the
+#   purge of the abandoned carts reads
+#########################################################################################
+
+
+MAX_QUANTITY = 32767
+
+
+def prepare_cart_id(cart_id):
+    # the uuid as stored by the database, None when it isn't a valid uuid
+    field = Cart._meta.pk
+    try:
+        return field.get_db_prep_value(field.to_python(cart_id), connection)
+    except ValidationError:
+        return None
+
+
+def get_capped_sum_sql(quantity, added):
+    # quantity + added, at most MAX_QUANTITY, computed as an integer : the sum of two
+    # smallints overflows on Postgres
+    least = 'MIN' if connection.vendor == 'sqlite' else 'LEAST'
+    if connection.vendor == 'mysql':
+        return f'{least}({quantity} + {added}, {MAX_QUANTITY})'
+    return f'{least}(CAST({quantity} AS integer) + {added}, {MAX_QUANTITY})'
+
+
+def get_upsert_sql():
+    item, cart, product = (connection.ops.quote_name(model._meta.db_table)
+                           for model in (CartItem, Cart, Product))
+    select = (f'SELECT {cart}.id AS cart_ref, {product}.id AS product_ref, %s AS added '
+              f'FROM {cart}, {product} WHERE {cart}.id = %s AND {product}.id = %s')
+    insert = f'INSERT INTO {item} (cart_id, product_id, quantity) '
+    if connection.vendor == 'mysql':
+        # the columns of an INSERT ... SELECT are named through a derived table
+        update = get_capped_sum_sql('quantity', 'added')
+        return insert + f'SELECT * FROM ({select}) AS new ON DUPLICATE KEY UPDATE quantity = {update}'
+    update = get_capped_sum_sql(f'{item}.quantity', 'excluded.quantity')
+    return insert + select + f' ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = {update}'
+
+
+def get_batch_upsert_sql(rows, increment=True):
+    # one multi-row upsert, for carts and products which are known to exist
+    item = connection.ops.quote_name(CartItem._meta.db_table)
+    values = ', '.join(['(%s, %s, %s)'] * rows)
+    insert = f'INSERT INTO {item} (cart_id, product_id, quantity) VALUES {values} '
+    new = 'new' if connection.vendor == 'mysql' else 'excluded'
+    update = get_capped_sum_sql(f'{item}.quantity', f'{new}.quantity') if increment else f'{new}.quantity'
+    if connection.vendor == 'mysql':
+        return insert + f'AS new ON DUPLICATE KEY UPDATE quantity = {update}'
+    return insert + f'ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = {update}'
+
+
+def touch_cart(cart_id):
+    # gives the cart a new version, returns it, None when the cart doesn't exist
+    version = timezone.now()
+    return version if Cart.objects.filter(pk=cart_id).update(updated_at=version) else None
+
+
+def add_cart_item(cart_id, product_id, quantity):
+    # returns the cart item, None when the cart or the product doesn't exist
+    cart_id = prepare_cart_id(cart_id)
+    if cart_id is None:
+        return None
+
+    sql = get_upsert_sql()
+    returning = connection.features.can_return_columns_from_insert
+    if returning:
+        sql += ' RETURNING id, quantity'
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [quantity, cart_id, product_id])
+        if returning:
+            row = cursor.fetchone()
+        elif cursor.rowcount:
+            row = CartItem.objects \
+                .filter(cart_id=cart_id, product_id=product_id) \
+                .values_list('id', 'quantity') \
+                .first()
+        else:
+            row = None
+
+    if row is None:
+        return None
+    item_id, quantity = row
+    return CartItem(id=item_id, cart_id=cart_id, product_id=product_id, quantity=quantity)
+
+
+#########################################################################################
+# Cached cart subtotals (STORE_CART_SUBTOTAL_CACHE)
+# - every change gives the cart a new version (updated_at of the row, version field
+#   of the redis hash), the total is cached, in cents, per version of the cart
+# - the total of a version is computed by the statement which reads the version, a
+#   read racing with a change can only cache the total of the version it read
+# - a change made from a known version carries the cached total over to the new
+#   version, adding the difference, when it is cached : item adds, updates and
+#   removals never recompute it
+# - the key also embeds the 'products' and 'promotions' versions (store.caching), a
+#   price change invalidates every cached total
+# - the subtotal action reads the total without the items : one lookup of the version
+#   when the total is cached
+#########################################################################################
+
+SUBTOTAL_KEY = 'store:cart-subtotal:{}:{}:{}:{}'
+PRICE_TAGS = ('products', 'promotions')
+
+
+def use_cached_subtotals():
+    return getattr(settings, 'STORE_CART_SUBTOTAL_CACHE', False)
+
+
+def get_subtotal_key(cart_id, version, prices):
+    return SUBTOTAL_KEY.format(Cart._meta.pk.to_python(cart_id).hex, version,
+                               *(prices[tag] for tag in PRICE_TAGS))
+
+
+def to_cents(amount):
+    return int((amount * 100).to_integral_value())
+
+
+def get_cached_subtotal(cart_id, version):
+    if not use_cached_subtotals() or version is None:
+        return None
+    cents = cache.get(get_subtotal_key(cart_id, version, get_versions(*PRICE_TAGS)))
+    return None if cents is None else Decimal(cents).scaleb(-2)
+
+
+def cache_subtotal(cart_id, version, subtotal):
+    # subtotal must be the total of this version of the cart
+    if use_cached_subtotals() and version is not None:
+        cache.set(get_subtotal_key(cart_id, version, get_versions(*PRICE_TAGS)), to_cents(subtotal))
+
+
+def carry_cached_subtotal(cart_id, previous, version, delta):
+    # the cart went from previous to version by a change of delta (None when unknown)
+    if not use_cached_subtotals() or previous is None or delta is None:
+        return
+    prices = get_versions(*PRICE_TAGS)
+    cents = cache.get(get_subtotal_key(cart_id, previous, prices))
+    if cents is not None:
+        cache.set(get_subtotal_key(cart_id, version, prices), cents + to_cents(delta))
+
+
+#########################################################################################
+# Cart storage backends (STORE_CART_STORAGE)
+# - CartViewSet / CartItemViewSet / CreateOrderSerializer only talk to the storage,
+#   the API is the same whatever the backend
+# - the line totals and the cart total are computed by the database, the items and
+#   their products are loaded as far as the items serializer renders them
+# - DatabaseCartStorage : store_cart / store_cartitem (default)
+# - RedisCartStorage    : one redis hash per cart, expiring STORE_CART_TTL seconds
+#   after the last change, nothing is written to SQL before the checkout
+# - the storage returns Cart / CartItem instances (unsaved for redis) whose items
+#   carry their effective price (store.pricing)
+#########################################################################################
+
+DEFAULT_CART_TTL = 7*24*60*60
+
+
+def collapse_operations(operations):
+    # the add / set / remove operations of a batch, applied in order, as the final
+    # change of every product : ({product_id: added}, {product_id: quantity}, {removed})
+    changes = {}
+    for operation in operations:
+        product_id = operation['product_id']
+        if operation['op'] == 'add':
+            op, quantity = changes.get(product_id, ('add', 0))
+            changes[product_id] = (op, quantity + operation['quantity'])
+        elif operation['op'] == 'set':
+            changes[product_id] = ('set', operation['quantity'])
+        else:
+            changes[product_id] = ('set', 0)
+
+    added = {pid: quantity for pid, (op, quantity) in changes.items() if op == 'add'}
+    quantities = {pid: quantity for pid, (op, quantity) in changes.items() if op == 'set' and quantity}
+    removed = {pid for pid, (op, quantity) in changes.items() if op == 'set' and not quantity}
+    return added, quantities, removed
+
+
+def get_cart_storage(items_serializer=None):
+    # the queries of the items load what items_serializer renders (store.mixins)
+    path = getattr(settings, 'STORE_CART_STORAGE', 'store.carts.DatabaseCartStorage')
+    return import_string(path)(items_serializer)
+
+
+def get_cart_items(cart):
+    # the prefetched items of a database cart, the list of a redis cart
+    items = cart.items
+    return items.all() if hasattr(items, 'all') else items
+
+
+class CartStorage:
+
+    def __init__(self, items_serializer=None):
+        self.items_serializer = items_serializer
+
+    def create_cart(self):
+        raise NotImplementedError
+
+    def get_cart(self, cart_id):
+        # the cart with its items, None when it doesn't exist
+        raise NotImplementedError
+
+    def get_subtotal(self, cart_id):
+        # the total of the cart without its items, None when it doesn't exist
+        raise NotImplementedError
+
+    def delete_cart(self, cart_id):
+        # returns False when the cart doesn't exist
+        raise NotImplementedError
+
+    def get_items(self, cart_id):
+        raise NotImplementedError
+
+    def get_item(self, cart_id, item_id):
+        raise NotImplementedError
+
+    def add_item(self, cart_id, product_id, quantity):
+        # None when the cart or the product doesn't exist
+        raise NotImplementedError
+
+    def set_quantity(self, cart_id, item_id, quantity):
+        # None when the item doesn't exist
+        raise NotImplementedError
+
+    def remove_item(self, cart_id, item_id):
+        # returns False when the item doesn't exist
+        raise NotImplementedError
+
+    def apply_changes(self, cart_id, added, quantities, removed):
+        # all at once, returns False when the cart doesn't exist
+        raise NotImplementedError
+
+    def apply_operations(self, cart_id, operations):
+        # the products of the operations must exist
+        return self.apply_changes(cart_id, *collapse_operations(operations))
+
+    def get_lines(self, cart_id):
+        # {product_id: quantity}, None when the cart doesn't exist
+        raise NotImplementedError
+
+    def claim_lines(self, cart_id):
+        # the lines for the checkout, in the order transaction : the cart is deleted at
+        # once so that a concurrent checkout of the same cart gets None
+        raise NotImplementedError
+
+    def release_lines(self, cart_id, lines):
+        # gives the claimed lines back when the order failed, the database storage
+        # relies on the rollback
+        pass
+
+    def cart_exists(self, cart_id):
+        raise NotImplementedError
+
+    def get_price(self, product_id):
+        return with_effective_prices(Product.objects.filter(pk=product_id)) \
+            .values_list('effective_price', flat=True) \
+            .first()
+
+
+class DatabaseCartStorage(CartStorage):
+
+    def get_items_queryset(self):
+        items = CartItem.objects.select_related('product')
+        if self.items_serializer is not None:
+            items = project_queryset(items, self.items_serializer, keep=['cart'])
+        return with_cart_item_prices(items)
+
+    def get_version(self, updated_at):
+        return updated_at.isoformat() if updated_at is not None else None
+
+    def create_cart(self):
+        return Cart.objects.create()
+
+    def get_cart(self, cart_id):
+        cart_id = prepare_cart_id(cart_id)
+        if cart_id is None:
+            return None
+        carts = Cart.objects \
+            .prefetch_related(Prefetch('items', queryset=self.get_items_queryset())) \
+            .filter(pk=cart_id)
+        if not use_cached_subtotals():
+            carts = with_cart_totals(carts)
+        cart = carts.first()
+        if cart is not None and use_cached_subtotals():
+            cart.total_price = get_cached_subtotal(cart_id, self.get_version(cart.updated_at))
+            if cart.total_price is None:
+                cart.total_price = self.compute_subtotal(cart_id)
+        return cart
+
+    def get_subtotal(self, cart_id):
+        cart_id = prepare_cart_id(cart_id)
+        if cart_id is None:
+            return None
+        if use_cached_subtotals():
+            updated_at = Cart.objects.filter(pk=cart_id).values_list('updated_at', flat=True).first()
+            if updated_at is None:
+                return None
+            subtotal = get_cached_subtotal(cart_id, self.get_version(updated_at))
+            if subtotal is not None:
+                return subtotal
+        return self.compute_subtotal(cart_id)
+
+    def compute_subtotal(self, cart_id):
+        # the total and the version it belongs to are read by the same statement
+        row = with_cart_totals(Cart.objects.filter(pk=cart_id)) \
+            .values_list('updated_at', 'total_price') \
+            .first()
+        if row is None:
+            return None
+        updated_at, subtotal = row
+        cache_subtotal(cart_id, self.get_version(updated_at), subtotal)
+        return subtotal
+
+    def delete_cart(self, cart_id):
+        deleted, _ = Cart.objects.filter(pk=prepare_cart_id(cart_id)).delete()
+        return bool(deleted)
+
+    def get_items(self, cart_id):
+        return list(self.get_items_queryset().filter(cart_id=prepare_cart_id(cart_id)))
+
+    def get_item(self, cart_id, item_id):
+        try:
+            return self.get_items_queryset() \
+                .filter(cart_id=prepare_cart_id(cart_id), pk=item_id) \
+                .first()
+        except (ValueError, TypeError):
+            return None
+
+    def update(self, cart_id, change):
+        # runs change() in a transaction when the cart exists and gives the cart a new
+        # version, the row lock of the update keeps the cart from being changed or
+        # deleted (ordered) meanwhile
+        # change() returns its result, None when nothing changed, and the difference of
+        # the total, which carries the cached total over to the new version
+        cart_id = prepare_cart_id(cart_id)
+        if cart_id is None:
+            return None
+        with transaction.atomic():
+            previous = None
+            if use_cached_subtotals():
+                previous = Cart.objects.select_for_update() \
+                    .filter(pk=cart_id) \
+                    .values_list('updated_at', flat=True) \
+                    .first()
+            version = touch_cart(cart_id)
+            if version is None:
+                return None
+            result, delta = change(cart_id)
+        if result is not None:
+            carry_cached_subtotal(cart_id, self.get_version(previous), self.get_version(version), delta)
+        return result
+
+    def add_item(self, cart_id, product_id, quantity):
+        def change(cart_id):
+            if not use_cached_subtotals():
+                return add_cart_item(cart_id, product_id, quantity), None
+            # the added quantity may be capped
+            previous = CartItem.objects \
+                .filter(cart_id=cart_id, product_id=product_id) \
+                .values_list('quantity', flat=True) \
+                .first()
+            item = add_cart_item(cart_id, product_id, quantity)
+            if item is None:
+                return None, None
+            return item, (item.quantity - (previous or 0)) * self.get_price(product_id)
+
+        return self.update(cart_id, change)
+
+    def set_quantity(self, cart_id, item_id, quantity):
+        def change(cart_id):
+            previous = self.get_item(cart_id, item_id) if use_cached_subtotals() else None
+            try:
+                updated = CartItem.objects \
+                    .filter(cart_id=cart_id, pk=item_id) \
+                    .update(quantity=quantity)
+            except (ValueError, TypeError):
+                return None, None
+            if not updated:
+                return None, None
+            item = self.get_item(cart_id, item_id)
+            return item, item.total_price - previous.total_price if previous is not None else None
+
+        return self.update(cart_id, change)
+
+    def remove_item(self, cart_id, item_id):
+        def change(cart_id):
+            previous = self.get_item(cart_id, item_id) if use_cached_subtotals() else None
+            try:
+                deleted, _ = CartItem.objects \
+                    .filter(cart_id=cart_id, pk=item_id) \
+                    .delete()
+            except (ValueError, TypeError):
+                return None, None
+            if not deleted:
+                return None, None
+            return True, -previous.total_price if previous is not None else None
+
+        return bool(self.update(cart_id, change))
+
+    def apply_changes(self, cart_id, added, quantities, removed):
+        def change(cart_id):
+            if removed:
+                CartItem.objects.filter(cart_id=cart_id, product_id__in=removed).delete()
+            with connection.cursor() as cursor:
+                for lines, increment in ((added, True), (quantities, False)):
+                    if lines:
+                        params = [value for product_id, quantity in lines.items()
+                                  for value in (cart_id, product_id, quantity)]
+                        cursor.execute(get_batch_upsert_sql(len(lines), increment), params)
+            # the new version isn't cached, the next read computes its total
+            return True, None
+
+        return bool(self.update(cart_id, change))
+
+    def get_lines(self, cart_id):
+        cart_id = prepare_cart_id(cart_id)
+        if not self.cart_exists(cart_id):
+            return None
+        return dict(CartItem.objects.filter(cart_id=cart_id).values_list('product_id', 'quantity'))
+
+    def claim_lines(self, cart_id):
+        cart_id = prepare_cart_id(cart_id)
+        # the lock makes a concurrent checkout wait, then find no cart
+        if cart_id is None or not Cart.objects.select_for_update().filter(pk=cart_id).exists():
+            return None
+        lines = dict(CartItem.objects.filter(cart_id=cart_id).values_list('product_id', 'quantity'))
+        self.delete_cart(cart_id)
+        return lines
+
+    def cart_exists(self, cart_id):
+        return Cart.objects.filter(pk=prepare_cart_id(cart_id)).exists()
+
+
+class StoredCart:
+    # a cart which isn't a row (RedisCartStorage), read like a Cart by the serializers
+    def __init__(self, id, items):
+        self.id = id
+        self.items = items
+
+
+class RedisCartStorage(CartStorage):
+    # hash fields : created_at, version, then product id -> quantity, the product id
+    # is also the id of the item
+    key_prefix = 'store:cart:'
+    created_field = 'created_at'
+    version_field = 'version'
+
+    def get_client(self):
+        return get_redis_connection('default')
+
+    def get_ttl(self):
+        return getattr(settings, 'STORE_CART_TTL', DEFAULT_CART_TTL)
+
+    def get_key(self, cart_id):
+        return self.key_prefix + cart_id.hex
+
+    def get_products(self):
+        # loads what the product field of the items serializer renders
+        fields = self.items_serializer.fields if self.items_serializer is not None else {}
+        product = fields.get('product')
+        if isinstance(product, BaseSerializer):
+            return project_queryset(Product.objects.all(), product)
+        return Product.objects.all()
+
+    def parse(self, cart_id):
+        # (uuid, key), None for ids which aren't uuids
+        try:
+            cart_id = Cart._meta.pk.to_python(cart_id)
+        except ValidationError:
+            return None
+        return cart_id, self.get_key(cart_id)
+
+    def build_items(self, cart_id, quantities):
+        products = with_effective_prices(self.get_products().filter(pk__in=quantities))
+        items = []
+        # products deleted since they were added are dropped
+        for product in products.order_by('id'):
+            item = CartItem(id=product.id, cart_id=cart_id, product=product,
+                            quantity=quantities[product.id])
+            item.effective_price = product.effective_price
+            item.total_price = item.quantity * product.effective_price
+            items.append(item)
+        return items
+
+    def read_quantities(self, fields):
+        return {
+            int(field): int(quantity)
+            for field, quantity in fields.items()
+            if field.decode() not in (self.created_field, self.version_field)
+        }
+
+    def read_version(self, fields):
+        version = fields.get(self.version_field.encode())
+        return version.decode() if version is not None else None
+
+    def create_cart(self):
+        cart = StoredCart(uuid4(), [])
+        key = self.get_key(cart.id)
+        self.get_client().pipeline() \
+            .hset(key, mapping={self.created_field: int(time.time()), self.version_field: uuid4().hex}) \
+            .expire(key, self.get_ttl()) \
+            .execute()
+        return cart
+
+    def get_cart(self, cart_id):
+        parsed = self.parse(cart_id)
+        if parsed is None:
+            return None
+        cart_id, key = parsed
+        fields = self.get_client().hgetall(key)
+        if not fields:
+            return None
+        cart = StoredCart(cart_id, self.build_items(cart_id, self.read_quantities(fields)))
+        version = self.read_version(fields)
+        cart.total_price = get_cached_subtotal(cart_id, version)
+        if cart.total_price is None:
+            cart.total_price = sum((item.total_price for item in cart.items), Decimal('0'))
+            cache_subtotal(cart_id, version, cart.total_price)
+        return cart
+
+    def get_subtotal(self, cart_id):
+        parsed = self.parse(cart_id)
+        if parsed is None:
+            return None
+        version = self.get_client().hget(parsed[1], self.version_field)
+        subtotal = get_cached_subtotal(parsed[0], version.decode()) if version is not None else None
+        if subtotal is not None:
+            return subtotal
+        cart = self.get_cart(cart_id)
+        return cart.total_price if cart is not None else None
+
+    def delete_cart(self, cart_id):
+        parsed = self.parse(cart_id)
+        return parsed is not None and bool(self.get_client().delete(parsed[1]))
+
+    def get_items(self, cart_id):
+        cart = self.get_cart(cart_id)
+        return cart.items if cart is not None else []
+
+    def get_item(self, cart_id, item_id):
+        parsed = self.parse(cart_id)
+        try:
+            item_id = int(item_id)
+        except (ValueError, TypeError):
+            return None
+        if parsed is None:
+            return None
+        quantity = self.get_client().hget(parsed[1], item_id)
+        if quantity is None:
+            return None
+        items = self.build_items(parsed[0], {item_id: int(quantity)})
+        return items[0] if items else None
+
+    def update(self, key, change, fields=(), required=False):
+        # runs change(pipeline, quantities) in a MULTI when the cart (and the fields when
+        # required) exists and gives the cart a new version, quantities are the current
+        # ones of fields (0 when missing), WATCH makes the transaction fail (and retry)
+        # when the cart changes meanwhile
+        # returns the previous version, the new one and quantities, None when nothing
+        # changed
+        version = uuid4().hex
+
+        def update(pipeline):
+            if not pipeline.exists(key):
+                return None
+            previous = pipeline.hget(key, self.version_field)
+            values = pipeline.hmget(key, fields) if fields else []
+            if required and None in values:
+                return None
+            quantities = {field: int(value or 0) for field, value in zip(fields, values)}
+            pipeline.multi()
+            change(pipeline, quantities)
+            pipeline.hset(key, self.version_field, version)
+            pipeline.expire(key, self.get_ttl())
+            return previous.decode() if previous is not None else None, version, quantities
+
+        return self.get_client().transaction(update, key, value_from_callable=True)
+
+    def add(self, pipeline, key, current, added):
+        # HINCRBY, capped at MAX_QUANTITY like the database upserts
+        pipeline.hset(key, mapping={
+            product_id: min(current[product_id] + quantity, MAX_QUANTITY)
+            for product_id, quantity in added.items()
+        })
+
+    def add_item(self, cart_id, product_id, quantity):
+        parsed = self.parse(cart_id)
+        if parsed is None or not Product.objects.filter(pk=product_id).exists():
+            return None
+        cart_id, key = parsed
+        changed = self.update(
+            key, lambda pipeline, current: self.add(pipeline, key, current, {product_id: quantity}),
+            fields=[product_id])
+        if changed is None:
+            return None
+        previous, version, current = changed
+        item = CartItem(id=product_id, cart_id=cart_id, product_id=product_id,
+                        quantity=min(current[product_id] + quantity, MAX_QUANTITY))
+        if use_cached_subtotals():
+            carry_cached_subtotal(cart_id, previous, version,
+                                  (item.quantity - current[product_id]) * self.get_price(product_id))
+        return item
+
+    def set_quantity(self, cart_id, item_id, quantity):
+        parsed = self.parse(cart_id)
+        if parsed is None or self.get_item(cart_id, item_id) is None:
+            return None
+        key, item_id = parsed[1], int(item_id)
+        # an item removed meanwhile isn't recreated
+        changed = self.update(key, lambda pipeline, current: pipeline.hset(key, item_id, quantity),
+                              fields=[item_id], required=True)
+        if changed is None:
+            return None
+        previous, version, current = changed
+        item = self.get_item(cart_id, item_id)
+        if item is not None:
+            carry_cached_subtotal(parsed[0], previous, version,
+                                  (quantity - current[item_id]) * item.effective_price)
+        return item
+
+    def remove_item(self, cart_id, item_id):
+        parsed = self.parse(cart_id)
+        try:
+            item_id = int(item_id)
+        except (ValueError, TypeError):
+            return False
+        if parsed is None:
+            return False
+        key = parsed[1]
+        changed = self.update(key, lambda pipeline, current: pipeline.hdel(key, item_id),
+                              fields=[item_id], required=True)
+        if changed is None:
+            return False
+        previous, version, current = changed
+        if use_cached_subtotals():
+            price = self.get_price(item_id)
+            # the items of deleted products aren't part of the total
+            carry_cached_subtotal(parsed[0], previous, version,
+                                  -current[item_id] * price if price is not None else 0)
+        return True
+
+    def apply_changes(self, cart_id, added, quantities, removed):
+        parsed = self.parse(cart_id)
+        if parsed is None:
+            return False
+        key = parsed[1]
+
+        def change(pipeline, current):
+            if added:
+                self.add(pipeline, key, current, added)
+            if quantities:
+                pipeline.hset(key, mapping=quantities)
+            if removed:
+                pipeline.hdel(key, *removed)
+
+        # the new version isn't cached, the next read computes its total
+        return self.update(key, change, fields=list(added)) is not None
+
+    def get_lines(self, cart_id):
+        parsed = self.parse(cart_id)
+        if parsed is None:
+            return None
+        fields = self.get_client().hgetall(parsed[1])
+        return self.read_quantities(fields) if fields else None
+
+    def claim_lines(self, cart_id):
+        parsed = self.parse(cart_id)
+        if parsed is None:
+            return None
+        cart_id, key = parsed
+
+        # read and delete in one transaction : a single checkout gets the lines
+        def claim(pipeline):
+            fields = pipeline.hgetall(key)
+            if fields:
+                pipeline.multi()
+                pipeline.delete(key)
+            return fields
+
+        fields = self.get_client().transaction(claim, key, value_from_callable=True)
+        if not fields:
+            return None
+        return self.read_quantities(fields)
+
+    def release_lines(self, cart_id, lines):
+        key = self.get_key(self.parse(cart_id)[0])
+        self.get_client().pipeline() \
+            .hset(key, mapping={self.created_field: int(time.time()),
+                                self.version_field: uuid4().hex, **lines}) \
+            .expire(key, self.get_ttl()) \
+            .execute()
+
+    def cart_exists(self, cart_id):
+        parsed = self.parse(cart_id)
+        return parsed is not None and bool(self.get_client().exists(parsed[1]))
+
+
+#########################################################################################
+# Purging abandoned carts (store.tasks.purge_carts, on celery beat)
+# - database carts are deleted STORE_CART_TTL seconds after their last change
+#   (updated_at), like redis carts which expire on their own
+# - the expired carts are found on the updated_at index and deleted by primary key,
+#   STORE_CART_PURGE_BATCH_SIZE carts (and their items) per transaction, so no lock
+#   is held for long, a cart changed in between is kept
+#########################################################################################
+
+DEFAULT_CART_PURGE_BATCH_SIZE = 500
+
+
+def purge_expired_carts(ttl=None, batch_size=None):
+    # returns the metrics of the run : carts / items deleted, batches, seconds
+    if ttl is None:
+        ttl = getattr(settings, 'STORE_CART_TTL', DEFAULT_CART_TTL)
+    if batch_size is None:
+        batch_size = getattr(settings, 'STORE_CART_PURGE_BATCH_SIZE', DEFAULT_CART_PURGE_BATCH_SIZE)
+
+    started = time.monotonic()
+    cutoff = timezone.now() - timedelta(seconds=ttl)
+    expired = Cart.objects.filter(updated_at__lt=cutoff)
+    metrics = {'carts': 0, 'items': 0, 'batches': 0}
+
+    while True:
+        ids = list(expired.order_by('updated_at').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        with transaction.atomic():
+            _, deleted = expired.filter(pk__in=ids).delete()
+        metrics['carts'] += deleted.get(Cart._meta.label, 0)
+        metrics['items'] += deleted.get(CartItem._meta.label, 0)
+        metrics['batches'] += 1
+        if len(ids) < batch_size:
+            break
+
+    metrics['seconds'] = round(time.monotonic() - started, 3)
+    return metrics
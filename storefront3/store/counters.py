@@ -0,0 +1,126 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, FloatField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce, NullIf, Round
+from .models import Collection, Product, ProductRating, Review
+
+#########################################################################################
+# Denormalized Collection.products_count
+# - the signals of Product (store.signals.handlers) apply +1 / -1 with F()
+#   expressions : UPDATE ... SET products_count = products_count + 1, which is
+#   atomic in the database and doesn't race with other writers
+# - bulk writes (store.bulk) and drift (raw SQL, seed_db) are repaired with
+#   reconcile_products_count(), one set based UPDATE
+#########################################################################################
+
+
+def add_to_products_count(collection_id, delta):
+    if collection_id is not None:
+        Collection.objects.filter(pk=collection_id) \
+            .update(products_count=F('products_count') + delta)
+
+
+def get_actual_products_count():
+    return Coalesce(
+        Subquery(
+            Product.objects
+            .filter(collection_id=OuterRef('pk'))
+            .order_by()
+            .values('collection_id')
+            .annotate(count=Count('id'))
+            .values('count')),
+        Value(0))
+
+
+def reconcile_products_count(collection_ids=None):
+    # returns the number of collections which had drifted
+    collections = Collection.objects.all()
+    if collection_ids is not None:
+        collections = collections.filter(pk__in=collection_ids)
+    return collections \
+        .annotate(actual_count=get_actual_products_count()) \
+        .exclude(products_count=F('actual_count')) \
+        .update(products_count=get_actual_products_count())
+
+
+#########################################################################################
+# Rating aggregates of the products (ProductRating)
+# - the signals of Review apply the changes of one review with a single UPDATE of F()
+#   expressions : count, sum, histogram bucket and the average
+# - a product gets its row with its first review, computed from store_review
+# - with_ratings() exposes avg_rating / review_count on product querysets through a
+#   join on the primary key, no GROUP BY
+#########################################################################################
+
+RATINGS = range(1, 6)
+RATING_FIELDS = ['review_count', 'rating_count', 'rating_sum', 'avg_rating',
+                 *(f'rating_{rating}' for rating in RATINGS)]
+
+
+def add_to_product_rating(product_id, rating, delta):
+    changes = {}
+    if rating is not None:
+        # the average goes first : MySQL evaluates the assignments of an UPDATE in
+        # order and would otherwise see the new sum / count
+        rating_sum = F('rating_sum') + delta * rating
+        rating_count = F('rating_count') + delta
+        changes['avg_rating'] = Coalesce(
+            Round(Cast(rating_sum, FloatField()) / NullIf(rating_count, 0), 2), Value(0.0))
+        changes['rating_sum'] = rating_sum
+        changes['rating_count'] = rating_count
+        changes[f'rating_{rating}'] = F(f'rating_{rating}') + delta
+    changes['review_count'] = F('review_count') + delta
+
+    updated = ProductRating.objects.filter(pk=product_id).update(**changes)
+    # a deleted review of a product without a row has nothing to take away
+    if not updated and delta > 0:
+        try:
+            with transaction.atomic():
+                reconcile_product_ratings([product_id])
+        except IntegrityError:
+            # another review created the row meanwhile
+            ProductRating.objects.filter(pk=product_id).update(**changes)
+
+
+def get_actual_product_ratings(product_ids=None):
+    reviews = Review.objects.all()
+    if product_ids is not None:
+        reviews = reviews.filter(product_id__in=product_ids)
+    return reviews \
+        .order_by() \
+        .values('product_id') \
+        .annotate(
+            review_count=Count('id'),
+            rating_count=Count('rating'),
+            rating_sum=Coalesce(Sum('rating'), 0),
+            **{f'rating_{rating}': Count('id', filter=Q(rating=rating)) for rating in RATINGS})
+
+
+def reconcile_product_ratings(product_ids=None):
+    # returns the number of products which had drifted
+    actual = {}
+    for row in get_actual_product_ratings(product_ids):
+        row['avg_rating'] = round(row['rating_sum'] / row['rating_count'], 2) \
+            if row['rating_count'] else 0.0
+        actual[row.pop('product_id')] = row
+
+    stored = ProductRating.objects.all()
+    if product_ids is not None:
+        stored = stored.filter(pk__in=product_ids)
+    drifted = []
+    for rating in stored:
+        # products whose reviews are all gone go back to zero
+        values = actual.pop(rating.pk, None) or vars(ProductRating(pk=rating.pk))
+        if any(getattr(rating, field) != values[field] for field in RATING_FIELDS):
+            drifted.append(ProductRating(pk=rating.pk, **{
+                field: values[field] for field in RATING_FIELDS}))
+
+    ProductRating.objects.bulk_update(drifted, RATING_FIELDS)
+    ProductRating.objects.bulk_create(
+        ProductRating(product_id=product_id, **values) for product_id, values in actual.items())
+    return len(drifted) + len(actual)
+
+
+def with_ratings(queryset):
+    return queryset.annotate(
+        avg_rating=Coalesce(F('rating__avg_rating'), Value(0.0)),
+        review_count=Coalesce(F('rating__review_count'), Value(0)))
@@ -0,0 +1,89 @@
+import csv
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from .models import Product
+
+#########################################################################################
+# Streaming catalog export
+# - products with their collection title and image urls, as ndjson or csv
+# - the rows are read in chunks and written as soon as a chunk arrives : memory
+#   stays constant whatever the size of the catalog, the first byte goes out
+#   after the first chunk
+# - PostgreSQL / Oracle stream with server side cursors (QuerySet.iterator), the
+#   MySQL and SQLite drivers buffer the whole result of a query, so there the
+#   chunks are read with keyset queries on the primary key instead
+#   (WHERE id > :last ORDER BY id LIMIT :chunk_size)
+#########################################################################################
+
+DEFAULT_CHUNK_SIZE = 2000
+CSV_COLUMNS = ['id', 'title', 'slug', 'description', 'unit_price', 'inventory',
+               'last_update', 'collection_id', 'collection_title', 'images']
+SERVER_SIDE_CURSOR_VENDORS = ['postgresql', 'oracle']
+
+
+def get_export_queryset():
+    return Product.objects \
+        .select_related('collection') \
+        .prefetch_related('images') \
+        .order_by('id')
+
+
+def iterate_products(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    if connection.vendor in SERVER_SIDE_CURSOR_VENDORS:
+        yield from queryset.iterator(chunk_size=chunk_size)
+        return
+
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1].id
+
+
+def export_rows(request=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    for product in iterate_products(get_export_queryset(), chunk_size):
+        images = [image.image.url for image in product.images.all() if image.image]
+        if request is not None:
+            images = [request.build_absolute_uri(url) for url in images]
+        yield {
+            'id': product.id,
+            'title': product.title,
+            'slug': product.slug,
+            'description': product.description,
+            'unit_price': product.unit_price,
+            'inventory': product.inventory,
+            'last_update': product.last_update,
+            'collection_id': product.collection_id,
+            'collection_title': product.collection.title,
+            'images': images,
+        }
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+class Echo:
+    # csv.writer writes into a file like object, hand the lines over instead
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for row in rows:
+        yield writer.writerow([
+            ' '.join(row[column]) if column == 'images' else row[column]
+            for column in CSV_COLUMNS
+        ])
+
+
+FORMATS = {
+    'ndjson': ('application/x-ndjson', ndjson_lines),
+    'csv': ('text/csv', csv_lines),
+}
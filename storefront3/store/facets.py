@@ -0,0 +1,110 @@
+import json
+from decimal import Decimal
+from hashlib import md5
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from .caching import get_versions
+
+#########################################################################################
+# Faceted counts : ?facets=collection,price on the product list
+# - counted over the filtered queryset (same filters and search as the list) in one
+#   query : GROUP BY collection with one conditional COUNT per price bucket,
+#   the price buckets are then summed over the collections
+# - the counts don't depend on the page or the ordering, they are cached
+#   (STORE_FACETS_CACHE) under the normalized filters and the catalog versions
+#########################################################################################
+
+FACETS_QUERY_PARAM = 'facets'
+FACETS = ['collection', 'price']
+# upper bounds of the price buckets, the last bucket has none
+DEFAULT_PRICE_FACETS = [10, 25, 50, 100]
+
+
+def get_price_buckets():
+    bounds = [Decimal(str(bound)) for bound in getattr(settings, 'STORE_PRICE_FACETS', DEFAULT_PRICE_FACETS)]
+    return list(zip([None, *bounds], [*bounds, None]))
+
+
+def get_bucket_filter(low, high):
+    bucket = Q()
+    if low is not None:
+        bucket &= Q(unit_price__gte=low)
+    if high is not None:
+        bucket &= Q(unit_price__lt=high)
+    return bucket
+
+
+def count_facets(queryset, names):
+    buckets = get_price_buckets()
+    rows = queryset \
+        .order_by() \
+        .values('collection_id', 'collection__title') \
+        .annotate(
+            count=Count('id'),
+            **{f'price_{index}': Count('id', filter=get_bucket_filter(*bucket))
+               for index, bucket in enumerate(buckets)})
+
+    rows = list(rows)
+    facets = {}
+    if 'collection' in names:
+        facets['collection'] = [
+            {'id': row['collection_id'], 'title': row['collection__title'], 'count': row['count']}
+            for row in sorted(rows, key=lambda row: (-row['count'], row['collection_id']))
+        ]
+    if 'price' in names:
+        facets['price'] = [
+            {'min': low, 'max': high, 'count': sum(row[f'price_{index}'] for row in rows)}
+            for index, (low, high) in enumerate(buckets)
+        ]
+    return facets
+
+
+class FacetsMixin:
+    # query params which select the rows, the others (page, ordering, ...) don't
+    # change the counts
+    facet_filter_params = []
+    facet_cache_tags = []
+
+    def get_requested_facets(self):
+        value = self.request.query_params.get(FACETS_QUERY_PARAM, '')
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = [name for name in names if name not in FACETS]
+        if unknown:
+            raise ValidationError({FACETS_QUERY_PARAM: f'Unknown facets : {", ".join(unknown)}.'})
+        return names
+
+    def get_facets_cache_key(self, names):
+        params = sorted(
+            (param, sorted(value for value in values if value))
+            for param, values in self.request.query_params.lists()
+            if param in self.facet_filter_params)
+        versions = get_versions(*self.facet_cache_tags)
+        key = json.dumps([versions, [param for param in params if param[1]], sorted(names)])
+        return 'store:facets:' + md5(key.encode()).hexdigest()
+
+    def get_facets(self, names):
+        use_cache = getattr(settings, 'STORE_FACETS_CACHE', False)
+        if use_cache:
+            key = self.get_facets_cache_key(names)
+            facets = cache.get(key)
+            if facets is not None:
+                return facets
+
+        facets = count_facets(self.filter_queryset(self.get_facets_queryset()), names)
+        if use_cache:
+            timeout = getattr(settings, 'STORE_RESPONSE_CACHE_TIMEOUT', 24*60*60)
+            cache.set(key, facets, timeout=timeout)
+        return facets
+
+    def get_facets_queryset(self):
+        return self.queryset.model.objects.all()
+
+    def list(self, request, *args, **kwargs):
+        names = self.get_requested_facets()
+        response = super().list(request, *args, **kwargs)
+        if names and response.status_code == status.HTTP_200_OK:
+            response.data['facets'] = self.get_facets(names)
+        return response
@@ -0,0 +1,83 @@
+from collections import defaultdict
+from rest_framework import serializers
+from .models import ProductImage
+from .serializers import get_sparse_fieldset
+
+#########################################################################################
+# Fast read-only serializers
+# - the ModelSerializer field machinery dominates the CPU time of list endpoints
+# - these serializers build the response dicts straight from .values() rows, the
+#   output is identical to the ModelSerializer they mirror :
+#   - FastProductSerializer     -> ProductSerializer
+#   - FastCollectionSerializer  -> CollectionSerializer
+# - ?fields= / ?omit= are honoured the same way (serializers.get_sparse_fieldset)
+# - used by FastReadMixin (store.mixins) when STORE_FAST_SERIALIZATION is enabled
+#########################################################################################
+
+class FastSerializer:
+    # output fields, in the order of the output
+    fields = []
+    # output fields which are not columns / annotations of the rows
+    related_fields = []
+    # fetched but not rendered (e.g. ordering fields needed by keyset cursors)
+    extra_fields = ['id']
+
+    def __init__(self, context=None):
+        self.context = context or {}
+        self.fields = get_sparse_fieldset(self.context.get('request'), type(self).fields)
+
+    def get_queryset(self, queryset, keep=()):
+        # keep : more fields to fetch, the ordering fields of the list
+        columns = [field for field in self.fields if field not in self.related_fields]
+        return queryset.values(*dict.fromkeys([*columns, *self.extra_fields, *keep]))
+
+    def to_representation(self, row):
+        return self.serialize([row])[0]
+
+    def serialize(self, rows):
+        return [{field: row[field] for field in self.fields} for row in rows]
+
+
+class FastCollectionSerializer(FastSerializer):
+    fields = ['id', 'title', 'products_count']
+
+
+class FastProductSerializer(FastSerializer):
+    fields = ['id', 'title', 'description', 'slug', 'inventory',
+              'unit_price', 'effective_price', 'price_with_tax', 'collection', 'images',
+              'avg_rating', 'review_count']
+    related_fields = ['images']
+    extra_fields = ['id', 'last_update']
+
+    # same representation of decimals as ProductSerializer
+    unit_price = serializers.DecimalField(max_digits=6, decimal_places=2)
+
+    def serialize(self, rows):
+        rows = list(rows)
+        images = self.get_images([row['id'] for row in rows]) if 'images' in self.fields else {}
+        if 'unit_price' in self.fields:
+            for row in rows:
+                row['unit_price'] = self.unit_price.to_representation(row['unit_price'])
+        # the prices and the ratings are annotated by the database
+        return [
+            {
+                field: images[row['id']] if field == 'images' else row[field]
+                for field in self.fields
+            }
+            for row in rows
+        ]
+
+    def get_images(self, product_ids):
+        # one query for the images of the whole page, like prefetch_related('images')
+        request = self.context.get('request')
+        storage = ProductImage._meta.get_field('image').storage
+        images = defaultdict(list)
+        rows = ProductImage.objects \
+            .filter(product_id__in=product_ids) \
+            .values_list('id', 'product_id', 'image')
+        for image_id, product_id, name in rows:
+            url = storage.url(name) if name else None
+            if url and request is not None:
+                url = request.build_absolute_uri(url)
+            images[product_id].append({'id': image_id, 'image': url})
+        return images
@@ -0,0 +1,82 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+from rest_framework.request import Request
+from time import perf_counter
+from urllib.parse import parse_qs, urlparse
+from store.models import Collection, Product
+from store.pagination import DefaultPagination, KeysetPagination
+from store.views import ProductViewSet
+
+
+class Command(BaseCommand):
+    help = 'Compares page 1 and page N latency of the page number and keyset paginators'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page', type=int, default=10000)
+        parser.add_argument('--ordering', default='title')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--products', type=int, default=0,
+                            help='temporary products to add (rolled back at the end)')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['products']:
+                self.create_products(options['products'])
+
+            page = options['page']
+            ordering = options['ordering']
+            offset = (page - 1) * DefaultPagination.page_size
+            if Product.objects.count() <= offset:
+                self.stdout.write(self.style.ERROR(
+                    f'Page {page} does not exist, use --products to add rows.'))
+                transaction.set_rollback(True)
+                return
+
+            for label, page_number in [('page 1', 1), (f'page {page}', page)]:
+                number_ms = self.measure(
+                    DefaultPagination, {'page': page_number, 'ordering': ordering}, options['repeat'])
+                cursor = self.cursor_for(ordering, (page_number - 1) * DefaultPagination.page_size)
+                keyset_ms = self.measure(
+                    KeysetPagination, {'cursor': cursor, 'ordering': ordering}, options['repeat'])
+                self.stdout.write(
+                    f'{label:>12} | page number {number_ms:8.2f} ms | keyset {keyset_ms:8.2f} ms')
+
+            transaction.set_rollback(True)
+
+    def create_products(self, count):
+        collection = Collection.objects.create(title='Benchmark')
+        Product.objects.bulk_create([
+            Product(title=f'Product {i:08}', slug=f'product-{i}', unit_price=1 + i % 500,
+                    inventory=10, collection=collection)
+            for i in range(count)
+        ], batch_size=5000)
+
+    def build_view(self, params):
+        request = Request(RequestFactory().get('/store/products/', params, HTTP_HOST='localhost'))
+        view = ProductViewSet(request=request, format_kwarg=None, action='list')
+        return request, view
+
+    def cursor_for(self, ordering, offset):
+        # cursors point after the last row of the previous page, find that row
+        # once (untimed) the same way a client would have been handed it
+        if offset == 0:
+            return ''
+        request, view = self.build_view({'cursor': '', 'ordering': ordering})
+        paginator = KeysetPagination()
+        paginator.paginate_queryset(Product.objects.all(), request, view)
+        queryset = Product.objects.order_by(*paginator.ordering)
+        paginator.page = [queryset[offset - 1]]
+        paginator.has_next = True
+        query = parse_qs(urlparse(paginator.get_next_link()).query)
+        return query[KeysetPagination.cursor_query_param][0]
+
+    def measure(self, pagination_class, params, repeat):
+        request, view = self.build_view(params)
+        queryset = view.filter_queryset(Product.objects.all())
+        timings = []
+        for _ in range(repeat):
+            start = perf_counter()
+            pagination_class().paginate_queryset(queryset, request, view)
+            timings.append((perf_counter() - start) * 1000)
+        return min(timings)
@@ -0,0 +1,49 @@
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from time import perf_counter
+from store.models import Collection, Product
+from store.pricing import with_prices
+from store.serializers import ProductSerializer
+
+
+class LegacyProductSerializer(ProductSerializer):
+    # price_with_tax as it was computed before the pricing engine
+    def calculate_tax(self, product: Product):
+        return product.unit_price * Decimal(1.1)
+
+
+class Command(BaseCommand):
+    help = 'Compares the serialization cost of price_with_tax in Python and in SQL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        with transaction.atomic():
+            # temporary products, rolled back at the end
+            collection = Collection.objects.create(title='Benchmark')
+            Product.objects.bulk_create([
+                Product(title=f'Product {i}', slug=f'product-{i}', unit_price=1 + i % 500,
+                        inventory=10, collection=collection)
+                for i in range(rows)
+            ])
+            queryset = Product.objects.prefetch_related('images').filter(collection=collection)
+
+            python_ms = self.measure(LegacyProductSerializer, queryset, options['repeat'])
+            sql_ms = self.measure(ProductSerializer, with_prices(queryset), options['repeat'])
+            self.stdout.write(f'{rows} rows | python {python_ms:8.2f} ms | sql {sql_ms:8.2f} ms')
+
+            transaction.set_rollback(True)
+
+    def measure(self, serializer_class, queryset, repeat):
+        timings = []
+        for _ in range(repeat):
+            # only the serialization is timed, the rows are fetched beforehand
+            products = list(queryset)
+            start = perf_counter()
+            serializer_class(products, many=True).data
+            timings.append((perf_counter() - start) * 1000)
+        return min(timings)
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory
+from time import perf_counter
+from store.models import Collection, Product, ProductImage
+from store.views import CollectionViewSet, ProductViewSet
+
+
+class Command(BaseCommand):
+    help = 'Compares the throughput of the regular and the fast read-only serializers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--seconds', type=float, default=3)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            # temporary products with two images each, rolled back at the end
+            collection = Collection.objects.create(title='Benchmark')
+            products = Product.objects.bulk_create([
+                Product(title=f'Product {i}', slug=f'product-{i}', unit_price=1 + i % 500,
+                        inventory=10, collection=collection, description='Lorem ipsum ' * 20)
+                for i in range(options['products'])
+            ])
+            ProductImage.objects.bulk_create([
+                ProductImage(product=product, image=f'store/images/{product.id}-{i}.jpg')
+                for product in products
+                for i in range(2)
+            ])
+
+            endpoints = [
+                ('/store/products/', ProductViewSet.as_view({'get': 'list'}), {}),
+                ('/store/products/:id/', ProductViewSet.as_view({'get': 'retrieve'}),
+                 {'pk': products[0].id}),
+                ('/store/collections/', CollectionViewSet.as_view({'get': 'list'}), {}),
+            ]
+            for url, view, kwargs in endpoints:
+                regular = self.measure(view, kwargs, options['seconds'], fast=False)
+                fast = self.measure(view, kwargs, options['seconds'], fast=True)
+                self.stdout.write(
+                    f'{url:<22} | regular {regular:8.1f} req/s | fast {fast:8.1f} req/s '
+                    f'| x{fast / regular:.2f}')
+
+            transaction.set_rollback(True)
+
+    def measure(self, view, kwargs, seconds, fast):
+        # requests per second served by a single worker, rendering included, every
+        # response is built : the response cache would serve all but the first one
+        factory = APIRequestFactory()
+        with override_settings(STORE_RESPONSE_CACHE=False, STORE_FAST_SERIALIZATION=fast):
+            count = 0
+            start = perf_counter()
+            while perf_counter() - start < seconds:
+                request = factory.get('/', HTTP_HOST='localhost')
+                view(request, **kwargs).render()
+                count += 1
+        return count / (perf_counter() - start)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from store.export import DEFAULT_CHUNK_SIZE, FORMATS, export_rows
+
+
+class Command(BaseCommand):
+    help = 'Exports the product catalog as ndjson or csv'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(FORMATS), default='ndjson')
+        parser.add_argument('--output', help='file to write to, stdout by default')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        _, lines = FORMATS[options['format']]
+        rows = export_rows(chunk_size=options['chunk_size'])
+
+        if not options['output']:
+            for line in lines(rows):
+                self.stdout.write(line, ending='')
+            return
+
+        with open(options['output'], 'w', newline='', encoding='utf-8') as file:
+            for line in lines(rows):
+                file.write(line)
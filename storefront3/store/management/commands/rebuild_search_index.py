@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from store.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the product full-text search index'
+
+    def handle(self, *args, **options):
+        # signals keep the index current for single rows, bulk operations
+        # (queryset.update, bulk_create, seed_db) bypass them
+        backend = get_search_backend()
+        if backend is None:
+            print('No search backend for this database, nothing to rebuild.')
+            return
+
+        print('Rebuilding the search index...')
+        with transaction.atomic():
+            backend.rebuild()
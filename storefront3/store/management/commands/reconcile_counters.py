@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from store.caching import bump_version
+from store.counters import reconcile_product_ratings, reconcile_products_count
+
+
+class Command(BaseCommand):
+    help = 'Repairs the products_count of the collections and the product ratings which have drifted'
+
+    def handle(self, *args, **options):
+        repaired = reconcile_products_count()
+        if repaired:
+            bump_version('collections')
+        print(f'{repaired} collections were repaired.')
+
+        repaired = reconcile_product_ratings()
+        if repaired:
+            bump_version('products')
+        print(f'{repaired} product ratings were repaired.')
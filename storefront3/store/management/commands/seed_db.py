@@ -1,6 +1,8 @@
 from django.core.management.base import BaseCommand
 from django.db import connection
 from pathlib import Path
+from store.caching import bump_version
+from store.counters import reconcile_products_count
 import os
 
 
@@ -15,3 +17,8 @@ class Command(BaseCommand):
 
         with connection.cursor() as cursor:
             cursor.execute(sql)
+
+        # raw SQL bypasses the signals that maintain the counters and invalidate
+        # the cached responses
+        reconcile_products_count()
+        bump_version('catalog')
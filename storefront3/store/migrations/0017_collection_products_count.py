@@ -0,0 +1,39 @@
+# Generated by Django 4.2.4 on 2026-10-18 16:34
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_products(apps, schema_editor):
+    Collection = apps.get_model('store', 'Collection')
+    Product = apps.get_model('store', 'Product')
+    Collection.objects.update(products_count=Coalesce(
+        Subquery(
+            Product.objects
+            .filter(collection_id=OuterRef('pk'))
+            .order_by()
+            .values('collection_id')
+            .annotate(count=Count('id'))
+            .values('count')),
+        Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_taxrate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='products_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_products, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='collection',
+            index=models.Index(fields=['title'], name='store_colle_title_ddb562_idx'),
+        ),
+    ]
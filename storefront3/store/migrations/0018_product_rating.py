@@ -0,0 +1,50 @@
+# Generated by Django 4.2.4 on 2026-10-18 16:37
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count
+
+
+def count_reviews(apps, schema_editor):
+    # the existing reviews have no rating yet
+    ProductRating = apps.get_model('store', 'ProductRating')
+    Review = apps.get_model('store', 'Review')
+    rows = Review.objects.order_by().values('product_id').annotate(count=Count('id'))
+    ProductRating.objects.bulk_create(
+        ProductRating(product_id=row['product_id'], review_count=row['count'])
+        for row in rows.iterator())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0017_collection_products_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='review',
+            name='rating',
+            field=models.PositiveSmallIntegerField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(5)]),
+        ),
+        migrations.CreateModel(
+            name='ProductRating',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating', serialize=False, to='store.product')),
+                ('review_count', models.PositiveIntegerField(default=0)),
+                ('rating_count', models.PositiveIntegerField(default=0)),
+                ('rating_sum', models.PositiveIntegerField(default=0)),
+                ('avg_rating', models.FloatField(default=0)),
+                ('rating_1', models.PositiveIntegerField(default=0)),
+                ('rating_2', models.PositiveIntegerField(default=0)),
+                ('rating_3', models.PositiveIntegerField(default=0)),
+                ('rating_4', models.PositiveIntegerField(default=0)),
+                ('rating_5', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['avg_rating'], name='store_produ_avg_rat_575578_idx'), models.Index(fields=['review_count'], name='store_produ_review__b01621_idx')],
+            },
+        ),
+        migrations.RunPython(count_reviews, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.4 on 2026-10-18 17:07
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0023_productimage_image_validator'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='review',
+            name='date',
+            field=models.DateField(default=datetime.date.today, editable=False),
+        ),
+    ]
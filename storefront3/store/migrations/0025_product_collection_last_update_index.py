@@ -0,0 +1,17 @@
+# Generated by Django 4.2.4 on 2026-10-18 17:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0024_review_date_default'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['collection', 'last_update'], name='store_produ_collect_24d164_idx'),
+        ),
+    ]
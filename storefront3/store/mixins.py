@@ -0,0 +1,261 @@
+import json
+from hashlib import md5
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from django.http import Http404
+from django.utils.cache import get_conditional_response
+from rest_framework import status
+from rest_framework.filters import OrderingFilter
+from rest_framework.response import Response
+from rest_framework.serializers import BaseSerializer
+from .caching import get_versions
+
+#########################################################################################
+# Viewset mixins for the read-only actions (list / retrieve)
+# - cache_tags / get_cache_tags() name the version tokens (store.caching) whose
+#   rows the responses are built from, signals bump them on writes
+#########################################################################################
+
+class CacheTagsMixin:
+    cache_tags = []
+
+    def get_cache_tags(self):
+        return self.cache_tags
+
+    def get_request_fingerprint(self, *extra):
+        # version tokens of the tags + host and path (pagination links are absolute)
+        # + query params (filters, search, ordering, pagination, region, ...)
+        query = sorted(self.request.query_params.lists())
+        versions = get_versions(*self.get_cache_tags())
+        fingerprint = json.dumps(
+            [versions, self.request.get_host(), self.request.path, query, *extra], default=str)
+        return md5(fingerprint.encode()).hexdigest()
+
+
+#########################################################################################
+# Fast read-only path
+# - when STORE_FAST_SERIALIZATION is enabled, list and retrieve build the response
+#   from .values() rows with fast_serializer_class instead of serializer_class
+# - the output is identical, writes always go through serializer_class
+#########################################################################################
+
+def get_ordering_fields(view, queryset):
+    # the fields the list is ordered by (?ordering= or the model's ordering), loaded
+    # even when not rendered : keyset cursors are built from them
+    ordering = OrderingFilter().get_ordering(view.request, queryset, view) \
+        or queryset.model._meta.ordering
+    return [field.lstrip('-') for field in ordering or []]
+
+
+class FastReadMixin:
+    fast_serializer_class = None
+
+    def use_fast_serializer(self):
+        return self.fast_serializer_class is not None \
+            and getattr(settings, 'STORE_FAST_SERIALIZATION', False)
+
+    def get_fast_serializer(self):
+        return self.fast_serializer_class(context=self.get_serializer_context())
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_fast_serializer():
+            return super().list(request, *args, **kwargs)
+
+        serializer = self.get_fast_serializer()
+        queryset = self.filter_queryset(self.get_queryset())
+        queryset = serializer.get_queryset(queryset, keep=get_ordering_fields(self, queryset))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serializer.serialize(page))
+        return Response(serializer.serialize(queryset))
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.use_fast_serializer():
+            return super().retrieve(request, *args, **kwargs)
+
+        serializer = self.get_fast_serializer()
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = serializer.get_queryset(self.filter_queryset(self.get_queryset()))
+        try:
+            row = queryset.get(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (queryset.model.DoesNotExist, ValueError, TypeError):
+            raise Http404
+        return Response(serializer.to_representation(row))
+
+
+#########################################################################################
+# Conditional GET
+# - list and retrieve answer with an ETag, If-None-Match then gets a 304 without
+#   running the main query or serializing anything
+# - the ETag covers the request fingerprint (the version tokens of the cache tags,
+#   path, query params) and get_validator_state(), a cheap aggregate of the rows
+#   behind the response
+# - no Last-Modified : a timestamp of the rows doesn't move when a row is deleted or
+#   leaves a filtered set, nor when related rows (images, reviews, promotions, tax
+#   rates) change, If-Modified-Since alone never gets a 304
+#########################################################################################
+
+class ConditionalGetMixin(CacheTagsMixin):
+
+    def get_validator_state(self):
+        return None
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        etag = '"{}"'.format(self.get_request_fingerprint(self.get_validator_state()))
+
+        response = get_conditional_response(request, etag=etag)
+        if response is not None:
+            return response
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            response['ETag'] = etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
+
+
+#########################################################################################
+# Response cache
+# - list and retrieve responses are cached (STORE_RESPONSE_CACHE) under the request
+#   fingerprint, which embeds the version tokens of the cache tags
+# - a write bumps the tokens of the rows it touched, the entries built from them are
+#   never read again : no TTL based staleness
+# - the timeout (STORE_RESPONSE_CACHE_TIMEOUT) only frees the unreachable entries
+#########################################################################################
+
+class ResponseCacheMixin(CacheTagsMixin):
+
+    def use_response_cache(self):
+        return getattr(settings, 'STORE_RESPONSE_CACHE', False)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if not self.use_response_cache():
+            return handler(request, *args, **kwargs)
+
+        key = 'store:response:' + self.get_request_fingerprint()
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            timeout = getattr(settings, 'STORE_RESPONSE_CACHE_TIMEOUT', 24*60*60)
+            cache.set(key, response.data, timeout=timeout)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+
+#########################################################################################
+# Query pruning for sparse fieldsets (?fields= / ?omit=, serializers.SparseFieldsetMixin)
+# - the columns of the fields which are not rendered are deferred
+# - prefetches of relations which are not rendered are skipped
+# - the primary key and the ordering fields (keyset cursors) are always loaded
+#########################################################################################
+
+def prune_queryset(queryset, fields, keep=()):
+    model = queryset.model
+    columns = {model._meta.pk.name}
+    # annotations (e.g. ordering by avg_rating) are selected anyway
+    sources = [*keep, *(field.source.split('.')[0] for field in fields.values())]
+    for source in sources:
+        try:
+            model_field = model._meta.get_field(source)
+        except FieldDoesNotExist:
+            continue
+        if model_field.concrete:
+            columns.add(source)
+
+    lookups = [
+        lookup for lookup in queryset._prefetch_related_lookups
+        if getattr(lookup, 'prefetch_through', lookup).split('__')[0] in fields
+    ]
+    return queryset.only(*columns).prefetch_related(None).prefetch_related(*lookups)
+
+
+class SparseQuerysetMixin:
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request is None or self.action not in ('list', 'retrieve'):
+            return queryset
+
+        keep = get_ordering_fields(self, queryset)
+        return prune_queryset(queryset, self.get_serializer().fields, keep)
+
+
+#########################################################################################
+# Query projection from the serializer tree
+# - only the columns of the rendered fields are loaded (only())
+# - nested serializers of a foreign key / one-to-one are joined (select_related),
+#   many=True ones are prefetched with a queryset projected the same way
+# - the foreign key back to the parent is kept in prefetched rows, other fields the
+#   serializer reads without rendering them (method fields) are passed as keep
+# - prefetches the queryset already has are left as they are
+#########################################################################################
+
+def get_projection(model, serializer, prefix=''):
+    # (columns, select_related lookups, prefetches) of the fields of the serializer
+    columns, select, prefetches = [prefix + model._meta.pk.name], [], []
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*':
+            continue
+        try:
+            model_field = model._meta.get_field(field.source.split('.')[0])
+        except FieldDoesNotExist:
+            continue
+        lookup = prefix + model_field.name
+        nested = getattr(field, 'child', field)
+
+        if not model_field.is_relation:
+            if model_field.concrete:
+                columns.append(lookup)
+        elif model_field.one_to_many or model_field.many_to_many:
+            related = model_field.related_model
+            keep = [model_field.field.name] if model_field.one_to_many else []
+            if isinstance(nested, BaseSerializer):
+                queryset = project_queryset(related.objects.all(), nested, keep)
+            else:
+                queryset = related.objects.only(related._meta.pk.name, *keep)
+            prefetches.append(Prefetch(lookup, queryset=queryset))
+        else:
+            if model_field.concrete:
+                columns.append(lookup)
+            if isinstance(nested, BaseSerializer):
+                nested_columns, nested_select, nested_prefetches = \
+                    get_projection(model_field.related_model, nested, lookup + '__')
+                columns += nested_columns
+                select += [lookup, *nested_select]
+                prefetches += nested_prefetches
+    return columns, select, prefetches
+
+
+def project_queryset(queryset, serializer, keep=()):
+    columns, select, prefetches = get_projection(queryset.model, serializer)
+    seen = {getattr(lookup, 'prefetch_to', lookup) for lookup in queryset._prefetch_related_lookups}
+    return queryset \
+        .only(*columns, *keep) \
+        .select_related(*select) \
+        .prefetch_related(*[prefetch for prefetch in prefetches if prefetch.prefetch_to not in seen])
+
+
+class ProjectedQuerysetMixin:
+    # fields read by the serializer but not rendered by it
+    projection_keep = []
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request is None or self.action not in ('list', 'retrieve'):
+            return queryset
+        return project_queryset(queryset, self.get_serializer(), self.projection_keep)
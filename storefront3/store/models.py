@@ -1,26 +1,34 @@
 from django.contrib import admin
 from django.conf import settings
-from django.core.validators import MinValueValidator, FileExtensionValidator
+from django.core.validators import MaxValueValidator, MinValueValidator, FileExtensionValidator
 from .validators import validate_file_size
 from django.db import models
 from uuid import uuid4
+from datetime import date
 
 
 class Promotion(models.Model):
     description = models.CharField(max_length=255)
-    discount = models.FloatField()
+    # a fraction of the unit price (store.pricing)
+    discount = models.FloatField(
+        validators=[MinValueValidator(0), MaxValueValidator(1)])
 
 
 class Collection(models.Model):
     title = models.CharField(max_length=255)
     featured_product = models.ForeignKey(
         'Product', on_delete=models.SET_NULL, null=True, related_name='+', blank=True)
+    # denormalized count of the products, maintained by store.counters
+    products_count = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self) -> str:
         return self.title
 
     class Meta:
         ordering = ['title']
+        indexes = [
+            models.Index(fields=['title']),
+        ]
 
 
 class Product(models.Model):
@@ -42,7 +50,39 @@ class Product(models.Model):
 
     class Meta:
         ordering = ['title']
+        # the filters / orderings of ProductViewSet (ProductFilter, ordering_fields)
+        indexes = [
+            models.Index(fields=['title']),
+            models.Index(fields=['unit_price']),
+            models.Index(fields=['last_update']),
+            models.Index(fields=['collection', 'title']),
+            models.Index(fields=['collection', 'unit_price']),
+            models.Index(fields=['collection', 'last_update']),
+        ]
+
+
+#########################################################################################
+# Tax rates used by the pricing engine (store.pricing)
+# - a rate applies to a region and/or a collection, blank means any
+# - the most specific rate wins : region + collection > region > collection > default
+#########################################################################################
+
+class TaxRate(models.Model):
+    region = models.CharField(max_length=50, blank=True)
+    collection = models.ForeignKey(
+        Collection, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    rate = models.DecimalField(
+        max_digits=5,
+        decimal_places=4,
+        validators=[MinValueValidator(0)])
+
+    def __str__(self) -> str:
+        return f'{self.region or "*"} / {self.collection_id or "*"} : {self.rate}'
 
+    class Meta:
+        unique_together = [['region', 'collection']]
+
+#########################################################################################
 
 #########################################################################################
 # Adding model for product images :
@@ -128,6 +168,27 @@ class OrderItem(models.Model):
     quantity = models.PositiveSmallIntegerField()
     unit_price = models.DecimalField(max_digits=6, decimal_places=2)
 
+    class Meta:
+        # covers the order items read by order id ranges (store.recommendations)
+        indexes = [models.Index(fields=['order', 'product'])]
+
+
+#########################################################################################
+# "Frequently bought together" recommendations (store.recommendations)
+# - the top-K products ordered together with a product, rank 1 is the most frequent
+# - recomputed offline by a celery job, read with one lookup on (product, rank)
+#########################################################################################
+
+class RelatedProduct(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    # number of orders with both products
+    score = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = [['product', 'rank']]
+
 
 class Address(models.Model):
     street = models.CharField(max_length=255)
@@ -139,6 +200,14 @@ class Address(models.Model):
 class Cart(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4)
     created_at = models.DateTimeField(auto_now_add=True)
+    # set by every change of the items (store.carts)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # carts without activity are purged (store.carts)
+            models.Index(fields=['updated_at']),
+        ]
 
 
 class CartItem(models.Model):
@@ -158,4 +227,40 @@ class Review(models.Model):
         Product, on_delete=models.CASCADE, related_name='reviews')
     name = models.CharField(max_length=255)
     description = models.TextField()
-    date = models.DateField(auto_now_add=True)
+    # set on creation like auto_now_add, but kept by bulk_create (store.write_behind)
+    date = models.DateField(default=date.today, editable=False)
+    rating = models.PositiveSmallIntegerField(
+        null=True, blank=True,
+        validators=[MinValueValidator(1), MaxValueValidator(5)])
+
+    class Meta:
+        # the reviews of a product, newest first (keyset pagination)
+        indexes = [models.Index(fields=['product', 'date', 'id'])]
+
+
+#########################################################################################
+# Rating aggregates of a product
+# - maintained incrementally by the signals of Review (store.counters), the product
+#   lists read and sort by them without scanning store_review
+# - review_count counts every review, the others only the reviews with a rating
+# - rating_1 .. rating_5 are the histogram of the ratings
+#########################################################################################
+
+class ProductRating(models.Model):
+    product = models.OneToOneField(
+        Product, on_delete=models.CASCADE, primary_key=True, related_name='rating')
+    review_count = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    avg_rating = models.FloatField(default=0)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['avg_rating']),
+            models.Index(fields=['review_count']),
+        ]
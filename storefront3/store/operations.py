@@ -0,0 +1,34 @@
+from django.db import transaction
+from django.utils import timezone
+from .caching import bump_version
+from .counters import add_to_products_count
+from .models import Collection, Product
+
+#########################################################################################
+# Reassign the products of a collection and delete it
+# - one set based UPDATE moves the products, one DELETE removes the collection,
+#   no product is loaded in Python whatever the size of the collection
+# - the source row is locked first, products can't be added to it meanwhile
+# - the target adopts the featured product of the source if it has none
+# - the counters / cache tags are maintained here as queryset.update() doesn't
+#   send signals
+#########################################################################################
+
+def reassign_and_delete_collection(source_id, target_id):
+    with transaction.atomic():
+        source = Collection.objects.select_for_update().get(pk=source_id)
+        target = Collection.objects.select_for_update().get(pk=target_id)
+
+        moved = Product.objects \
+            .filter(collection_id=source.id) \
+            .update(collection_id=target.id, last_update=timezone.now())
+        add_to_products_count(target.id, moved)
+
+        if target.featured_product_id is None and source.featured_product_id is not None:
+            Collection.objects.filter(pk=target.id) \
+                .update(featured_product_id=source.featured_product_id)
+
+        source.delete()
+        bump_version('catalog')
+
+    return moved
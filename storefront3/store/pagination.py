@@ -1,4 +1,187 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 class DefaultPagination(PageNumberPagination):
-  page_size = 10
\ No newline at end of file
+  page_size = 10
+
+
+#########################################################################################
+# Keyset (cursor) pagination
+# - PageNumberPagination runs a COUNT(*) and an OFFSET scan which grows with the
+#   page number, so deep pages get slower in a straight line
+# - keyset pagination remembers the sort key of the last row it returned and asks
+#   for the rows after it : WHERE (title, id) > (:title, :id) ORDER BY title, id LIMIT n
+# - the cost of a page is independent of how deep it is
+# - ties on the ordering fields are broken on the primary key so every row has a
+#   unique position
+# - cursors are opaque (base64 encoded json) and bound to the ordering they were
+#   created with
+# - the total count is optional : ?count=true
+#########################################################################################
+
+class KeysetPagination(BasePagination):
+  page_size = 10
+  cursor_query_param = 'cursor'
+  count_query_param = 'count'
+  invalid_cursor_message = 'Invalid cursor'
+
+  def paginate_queryset(self, queryset, request, view=None):
+    self.request = request
+    self.model = queryset.model
+    self.annotations = queryset.query.annotations
+    self.base_url = request.build_absolute_uri()
+    self.ordering = self.get_ordering(request, queryset, view)
+    self.fields = [field.lstrip('-') for field in self.ordering]
+    self.count = queryset.count() if self.include_count(request) else None
+
+    position, reverse = self.decode_cursor(request)
+    ordering = self.ordering
+    if reverse:
+      ordering = [self.invert(field) for field in ordering]
+
+    queryset = queryset.order_by(*ordering)
+    if position is not None:
+      queryset = queryset.filter(self.build_keyset_filter(ordering, position))
+
+    # fetch one extra row to find out if there is a following page
+    results = list(queryset[:self.page_size + 1])
+    has_following = len(results) > self.page_size
+    results = results[:self.page_size]
+
+    if reverse:
+      results.reverse()
+      self.has_next = position is not None
+      self.has_previous = has_following
+    else:
+      self.has_next = has_following
+      self.has_previous = position is not None
+
+    self.page = results
+    return results
+
+  def get_paginated_response(self, data):
+    response = {
+      'next': self.get_next_link(),
+      'previous': self.get_previous_link(),
+      'results': data,
+    }
+    if self.count is not None:
+      response = {'count': self.count, **response}
+    return Response(response)
+
+  def get_paginated_response_schema(self, schema):
+    return {
+      'type': 'object',
+      'properties': {
+        'count': {'type': 'integer'},
+        'next': {'type': 'string', 'nullable': True},
+        'previous': {'type': 'string', 'nullable': True},
+        'results': schema,
+      },
+    }
+
+  def include_count(self, request):
+    value = request.query_params.get(self.count_query_param, '')
+    return value.lower() in ('1', 'true', 'yes')
+
+  # -------------------------------------------------------------------------------------
+  # ordering
+  # -------------------------------------------------------------------------------------
+
+  def get_ordering(self, request, queryset, view):
+    # reuse the ordering requested through OrderingFilter (?ordering=...) so that
+    # every field in the viewset's ordering_fields is supported
+    ordering = OrderingFilter().get_ordering(request, queryset, view)
+    if not ordering:
+      ordering = queryset.model._meta.ordering or []
+    ordering = [field for field in ordering if field.lstrip('-') not in ('id', 'pk')]
+    # break ties on the primary key, in the direction of the primary sort field
+    descending = bool(ordering) and ordering[0].startswith('-')
+    return list(ordering) + ['-id' if descending else 'id']
+
+  def invert(self, field):
+    return field[1:] if field.startswith('-') else '-' + field
+
+  def build_keyset_filter(self, ordering, position):
+    # (a, b, id) > (x, y, z) expands into :
+    # a >= x AND (a > x OR (a = x AND b > y) OR (a = x AND b = y AND id > z))
+    # the redundant a >= x bounds the first column : the page is an index seek
+    # instead of a walk of the index from its start
+    keyset_filter = Q()
+    equal = Q()
+    for field, value in zip(ordering, position):
+      name = field.lstrip('-')
+      lookup = 'lt' if field.startswith('-') else 'gt'
+      keyset_filter |= equal & Q(**{f'{name}__{lookup}': value})
+      equal &= Q(**{name: value})
+    field, value = ordering[0], position[0]
+    if value is not None:
+      lookup = 'lte' if field.startswith('-') else 'gte'
+      keyset_filter &= Q(**{f'{field.lstrip("-")}__{lookup}': value})
+    return keyset_filter
+
+  # -------------------------------------------------------------------------------------
+  # cursors
+  # -------------------------------------------------------------------------------------
+
+  def get_next_link(self):
+    if not self.has_next:
+      return None
+    return self.encode_cursor(self.page[-1], reverse=False)
+
+  def get_previous_link(self):
+    if not self.has_previous:
+      return None
+    if not self.page:
+      return remove_query_param(self.base_url, self.cursor_query_param)
+    return self.encode_cursor(self.page[0], reverse=True)
+
+  def encode_cursor(self, instance, reverse):
+    # pages hold model instances, or dicts for .values() querysets
+    if isinstance(instance, dict):
+      position = [self.serialize_value(instance[field]) for field in self.fields]
+    else:
+      position = [self.serialize_value(getattr(instance, field)) for field in self.fields]
+    payload = {'o': self.ordering, 'p': position}
+    if reverse:
+      payload['r'] = 1
+    cursor = urlsafe_b64encode(json.dumps(payload).encode()).decode()
+    return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+  def decode_cursor(self, request):
+    cursor = request.query_params.get(self.cursor_query_param)
+    if not cursor:
+      return None, False
+
+    try:
+      payload = json.loads(urlsafe_b64decode(cursor.encode()))
+      # a cursor is only valid for the ordering it was created with
+      if payload['o'] != self.ordering or len(payload['p']) != len(self.fields):
+        raise ValueError
+      position = [self.deserialize_value(field, value)
+                  for field, value in zip(self.fields, payload['p'])]
+    except (TypeError, ValueError, KeyError, BinasciiError, ValidationError):
+      raise NotFound(self.invalid_cursor_message)
+
+    return position, bool(payload.get('r'))
+
+  def serialize_value(self, value):
+    if hasattr(value, 'isoformat'):
+      return value.isoformat()
+    if isinstance(value, (int, str)) or value is None:
+      return value
+    return str(value)
+
+  def deserialize_value(self, field, value):
+    # ordering fields can also be annotations (e.g. avg_rating)
+    if field in self.annotations:
+      return self.annotations[field].output_field.to_python(value)
+    return self.model._meta.get_field(field).to_python(value)
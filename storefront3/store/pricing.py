@@ -0,0 +1,160 @@
+from decimal import Decimal, ROUND_HALF_UP
+from django.conf import settings
+from django.db.models import Case, DecimalField, F, Max, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Greatest, Least, Round
+from .caching import bump_version, get_version
+from .models import CartItem, Product, TaxRate
+
+#########################################################################################
+# Pricing engine
+# - tax inclusive prices are computed by the database as a queryset annotation
+#   (price_with_tax), list pages do no per-row arithmetic in Python
+# - tax rates are configured per region and/or collection (TaxRate), the most
+#   specific rate wins : region + collection > region > collection > default
+# - the rates are cached in the memory of every process, writes bump the
+#   'tax_rates' version token (store.caching) which makes every process reload them
+# - promotions : the effective price is the unit price less the best discount of
+#   the promotions of the product (Promotion.discount is a fraction, 0.2 = 20% off,
+#   clamped to [0, 1]), taxes apply to the effective price
+# - the subquery is skipped while no product has a promotion, which is checked once
+#   per 'promotions' version
+# - carts : the line totals and the cart total are computed by the database as well
+#########################################################################################
+
+DEFAULT_TAX_RATE = Decimal('0.10')
+REGION_QUERY_PARAM = 'region'
+CENT = Decimal('0.01')
+
+price_field = DecimalField(max_digits=8, decimal_places=2)
+discount_field = DecimalField(max_digits=5, decimal_places=4)
+total_field = DecimalField(max_digits=12, decimal_places=2)
+
+_rates = {'version': None, 'rates': {}}
+_promotions = {'version': None, 'exists': False}
+
+
+def get_region(request):
+    # ?region= selects the tax region, STORE_TAX_REGION is the default one
+    default = getattr(settings, 'STORE_TAX_REGION', '')
+    if request is None:
+        return default
+    return request.query_params.get(REGION_QUERY_PARAM, default)
+
+
+def get_tax_rates():
+    version = get_version('tax_rates')
+    if _rates['version'] != version:
+        _rates['rates'] = {
+            (region, collection_id): rate
+            for region, collection_id, rate
+            in TaxRate.objects.values_list('region', 'collection_id', 'rate')
+        }
+        _rates['version'] = version
+    return _rates['rates']
+
+
+def invalidate_tax_rates():
+    bump_version('tax_rates')
+
+
+def get_tax_rate(collection_id, region=''):
+    rates = get_tax_rates()
+    for key in [(region, collection_id), (region, None), ('', collection_id), ('', None)]:
+        if key in rates:
+            return rates[key]
+    return getattr(settings, 'STORE_DEFAULT_TAX_RATE', DEFAULT_TAX_RATE)
+
+
+def price_with_tax(unit_price, collection_id, region=''):
+    # python counterpart of the annotation, for instances that were not annotated
+    rate = get_tax_rate(collection_id, region)
+    return (unit_price * (1 + rate)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def has_promotions():
+    # whether any product has a promotion, checked once per 'promotions' version
+    version = get_version('promotions')
+    if _promotions['version'] != version:
+        _promotions['exists'] = Product.promotions.through.objects.exists()
+        _promotions['version'] = version
+    return _promotions['exists']
+
+
+def get_discount(product_id):
+    # the best discount of the product, within [0, 1]
+    if not has_promotions():
+        return Decimal(0)
+    best = Product.promotions.through.objects \
+        .filter(product_id=product_id) \
+        .aggregate(best=Max('promotion__discount'))['best']
+    return min(max(Decimal(str(best or 0)), Decimal(0)), Decimal(1))
+
+
+def invalidate_promotions():
+    bump_version('promotions')
+
+
+def effective_price(unit_price, product_id):
+    # python counterpart of the annotation, for instances that were not annotated
+    discount = get_discount(product_id)
+    return (unit_price * (1 - discount)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def effective_price_expression(field='unit_price', product_field='pk'):
+    if not has_promotions():
+        # no promotion at all, skip the subquery
+        return Cast(F(field), output_field=price_field)
+    best_discount = Product.promotions.through.objects \
+        .filter(product_id=OuterRef(product_field)) \
+        .order_by() \
+        .values('product_id') \
+        .annotate(best=Max('promotion__discount')) \
+        .values('best')
+    # discounts outside [0, 1] never make a price negative or raise it
+    discount = Greatest(Value(0.0), Least(Value(1.0), Coalesce(Subquery(best_discount), Value(0.0))))
+    discount = Cast(discount, output_field=discount_field)
+    return Round(F(field) * (Value(1) - discount), 2, output_field=price_field)
+
+
+def with_effective_prices(queryset):
+    return queryset.annotate(effective_price=effective_price_expression())
+
+
+def cart_item_total_expression():
+    price = effective_price_expression('product__unit_price', 'product_id')
+    return Round(price * F('quantity'), 2, output_field=total_field)
+
+
+def with_cart_item_prices(queryset):
+    return queryset.annotate(
+        effective_price=effective_price_expression('product__unit_price', 'product_id'),
+        total_price=cart_item_total_expression())
+
+
+def with_cart_totals(queryset):
+    totals = CartItem.objects \
+        .filter(cart_id=OuterRef('pk')) \
+        .order_by() \
+        .values('cart_id') \
+        .annotate(total=Sum(cart_item_total_expression())) \
+        .values('total')
+    return queryset.annotate(
+        total_price=Coalesce(Subquery(totals), Value(Decimal('0')), output_field=total_field))
+
+
+def price_with_tax_expression(region='', field='unit_price', collection_field='collection_id'):
+    default = get_tax_rate(None, region)
+    collection_ids = {collection_id for _, collection_id in get_tax_rates() if collection_id}
+    cases = [
+        When(**{collection_field: collection_id},
+             then=Value(1 + get_tax_rate(collection_id, region)))
+        for collection_id in sorted(collection_ids)
+        if get_tax_rate(collection_id, region) != default
+    ]
+    multiplier = Case(*cases, default=Value(1 + default)) if cases else Value(1 + default)
+    return Round(F(field) * multiplier, 2, output_field=price_field)
+
+
+def with_prices(queryset, region=''):
+    return with_effective_prices(queryset) \
+        .annotate(price_with_tax=price_with_tax_expression(region, field='effective_price'))
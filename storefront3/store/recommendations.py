@@ -0,0 +1,86 @@
+import numpy as np
+from scipy import sparse
+from django.db import transaction
+from .models import Order, OrderItem, Product, RelatedProduct
+
+#########################################################################################
+# "Frequently bought together"
+# - item to item co-occurrence : C[a, b] = number of orders containing a and b
+# - the order items are read one chunk of orders at a time, every chunk becomes a
+#   binary (orders x products) sparse matrix X and C += X.T @ X
+# - only the top-K neighbours of every product are stored (RelatedProduct), ties
+#   are broken on the product id
+# - the request path reads them back with one indexed lookup on (product, rank)
+#########################################################################################
+
+DEFAULT_TOP_K = 10
+DEFAULT_CHUNK_SIZE = 5000
+
+
+def iterate_order_chunks(chunk_size=DEFAULT_CHUNK_SIZE):
+    # keyset over the orders, an order is never split between two chunks
+    last_id = 0
+    while True:
+        order_ids = list(Order.objects
+                         .filter(id__gt=last_id)
+                         .order_by('id')
+                         .values_list('id', flat=True)[:chunk_size])
+        if not order_ids:
+            return
+        yield list(OrderItem.objects
+                   .filter(order_id__gte=order_ids[0], order_id__lte=order_ids[-1])
+                   .values_list('order_id', 'product_id'))
+        last_id = order_ids[-1]
+
+
+def count_cooccurrences(chunks, size):
+    # size : upper bound of the product ids (matrix columns), products created since
+    # it was read are left to the next run
+    cooccurrences = sparse.csr_matrix((size, size), dtype=np.int64)
+    for items in chunks:
+        items = np.array(items, dtype=np.int64).reshape(-1, 2)
+        items = items[items[:, 1] < size]
+        if not len(items):
+            continue
+        order_ids, product_ids = items.T
+        _, rows = np.unique(order_ids, return_inverse=True)
+        orders = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int64), (rows, product_ids)),
+            shape=(rows.max() + 1, size))
+        # a product ordered twice in the same order counts once
+        orders.data[:] = 1
+        cooccurrences = cooccurrences + orders.T @ orders
+    cooccurrences.setdiag(0)
+    cooccurrences.eliminate_zeros()
+    return cooccurrences
+
+
+def top_neighbours(cooccurrences, k):
+    # yields (product_id, [(related_id, score), ...]) best first
+    for product_id in np.flatnonzero(np.diff(cooccurrences.indptr)):
+        start, end = cooccurrences.indptr[product_id], cooccurrences.indptr[product_id + 1]
+        related_ids = cooccurrences.indices[start:end]
+        scores = cooccurrences.data[start:end]
+        best = np.lexsort((related_ids, -scores))[:k]
+        yield int(product_id), [(int(related_ids[i]), int(scores[i])) for i in best]
+
+
+def compute_related_products(k=DEFAULT_TOP_K, chunk_size=DEFAULT_CHUNK_SIZE, batch_size=1000):
+    # returns the number of products with related products
+    size = (Product.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+    cooccurrences = count_cooccurrences(iterate_order_chunks(chunk_size), size)
+
+    products = 0
+    with transaction.atomic():
+        RelatedProduct.objects.all().delete()
+        rows = []
+        for product_id, neighbours in top_neighbours(cooccurrences, k):
+            products += 1
+            rows.extend(
+                RelatedProduct(product_id=product_id, related_id=related_id, rank=rank, score=score)
+                for rank, (related_id, score) in enumerate(neighbours, start=1))
+            if len(rows) >= batch_size:
+                RelatedProduct.objects.bulk_create(rows)
+                rows = []
+        RelatedProduct.objects.bulk_create(rows)
+    return products
@@ -0,0 +1,135 @@
+import re
+from django.conf import settings
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+from rest_framework.filters import SearchFilter
+from .models import Product
+
+#########################################################################################
+# Full-text search
+# - SearchFilter turns ?search= into ILIKE '%term%' over title and description,
+#   which cannot use an index and gets slower as the product table grows
+# - FullTextSearchFilter is a drop-in replacement which delegates to a search
+#   backend that uses an inverted index and ranks results by relevance :
+#   - MySQL   : FULLTEXT index on store_product (title, description)
+#   - SQLite  : FTS5 virtual table store_product_fts
+# - the backend is picked from the database vendor, STORE_SEARCH_BACKEND in
+#   settings overrides it (dotted path to a backend class)
+# - vendors without a backend fall back to the SearchFilter behaviour
+#########################################################################################
+
+TERM_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+class SearchBackend:
+    vendor = None
+    fields = ['title', 'description']
+
+    def terms(self, search):
+        # drop the query syntax characters of the engines, keep the words
+        return TERM_PATTERN.findall(search)
+
+    def search(self, queryset, terms):
+        # returns the matching rows annotated with search_rank (higher is better)
+        raise NotImplementedError
+
+    def get_columns(self, queryset):
+        # the indexed columns, qualified with the alias of the product table in queryset
+        alias = connection.ops.quote_name(queryset.query.get_initial_alias())
+        return [f'{alias}.{connection.ops.quote_name(Product._meta.get_field(field).column)}'
+                for field in self.fields]
+
+    def index(self, product):
+        pass
+
+    def index_many(self, products):
+        # bulk_create / bulk_update do not send the signals which call index()
+        for product in products:
+            self.index(product)
+
+    def unindex(self, product_id):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class MySQLFullTextBackend(SearchBackend):
+    vendor = 'mysql'
+
+    def search(self, queryset, terms):
+        # +term* : every term is required, matched as a prefix
+        query = ' '.join(f'+{term}*' for term in terms)
+        columns = ', '.join(self.get_columns(queryset))
+        rank = RawSQL(f'MATCH ({columns}) AGAINST (%s IN BOOLEAN MODE)', [query])
+        return queryset.annotate(search_rank=rank).filter(search_rank__gt=0)
+
+    # InnoDB keeps FULLTEXT indexes current by itself, nothing to maintain
+
+
+class SQLiteFTS5Backend(SearchBackend):
+    vendor = 'sqlite'
+    table = 'store_product_fts'
+
+    def search(self, queryset, terms):
+        # "term"* : every term is required, matched as a prefix
+        query = ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+        table = connection.ops.quote_name(self.table)
+        alias = connection.ops.quote_name(queryset.query.get_initial_alias())
+        pk = connection.ops.quote_name(Product._meta.pk.column)
+        # the index is joined once, MATCH drives the query and the products are read by
+        # rowid ; rank is the bm25 of the match (lower is better), no per row subquery
+        return queryset.extra(
+            select={'search_rank': f'-{table}.rank'},
+            tables=[self.table],
+            where=[f'{table} MATCH %s', f'{table}.rowid = {alias}.{pk}'],
+            params=[query])
+
+    def index(self, product):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [product.id])
+            cursor.execute(
+                f'INSERT INTO {self.table} (rowid, title, description) VALUES (%s, %s, %s)',
+                [product.id, product.title, product.description])
+
+    def unindex(self, product_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [product_id])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            cursor.execute(
+                f'INSERT INTO {self.table} (rowid, title, description) '
+                f'SELECT id, title, description FROM {Product._meta.db_table}')
+
+
+BACKENDS = {
+    backend.vendor: backend
+    for backend in [MySQLFullTextBackend, SQLiteFTS5Backend]
+}
+
+
+def get_search_backend():
+    path = getattr(settings, 'STORE_SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)()
+    backend = BACKENDS.get(connection.vendor)
+    return backend() if backend else None
+
+
+class FullTextSearchFilter(SearchFilter):
+
+    def filter_queryset(self, request, queryset, view):
+        backend = get_search_backend()
+        if backend is None:
+            return super().filter_queryset(request, queryset, view)
+
+        search = request.query_params.get(self.search_param, '')
+        terms = backend.terms(search)
+        if not terms:
+            return queryset
+
+        # most relevant first, ?ordering= (OrderingFilter) still takes precedence
+        return backend.search(queryset, terms).order_by('-search_rank', 'id')
@@ -1,8 +1,50 @@
-from decimal import Decimal
 from django.db import transaction
 from rest_framework import serializers
+from rest_framework.exceptions import NotFound
+from .carts import MAX_QUANTITY, collapse_operations, get_cart_items, get_cart_storage
 from .signals import order_created
-from .models import Cart, CartItem, Customer, Order, OrderItem, Product, Collection, Review, ProductImage
+from .pricing import effective_price, get_region, price_with_tax, with_effective_prices
+from .models import Cart, CartItem, Customer, Order, OrderItem, Product, Collection, ProductRating, Review, ProductImage
+
+
+#########################################################################################
+# Sparse fieldsets
+# - ?fields=id,title keeps only the listed fields, ?omit=description drops fields
+# - only applied to reads (GET), writes always validate / return every field
+# - unknown field names are ignored
+#########################################################################################
+
+FIELDS_QUERY_PARAM = 'fields'
+OMIT_QUERY_PARAM = 'omit'
+
+
+def get_sparse_fieldset(request, field_names):
+    field_names = list(field_names)
+    if request is None or request.method != 'GET':
+        return field_names
+
+    def requested(param):
+        value = request.query_params.get(param)
+        if value is None:
+            return None
+        return {name.strip() for name in value.split(',') if name.strip()}
+
+    fields, omit = requested(FIELDS_QUERY_PARAM), requested(OMIT_QUERY_PARAM)
+    return [
+        name for name in field_names
+        if (fields is None or name in fields) and (omit is None or name not in omit)
+    ]
+
+
+class SparseFieldsetMixin:
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        names = get_sparse_fieldset(self.context.get('request'), self.fields)
+        for name in set(self.fields) - set(names):
+            self.fields.pop(name)
+
+#########################################################################################
 
 
 #########################################################################################
@@ -23,7 +65,7 @@ class ProductImageSerializer(serializers.ModelSerializer):
 #########################################################################################
 
 
-class CollectionSerializer(serializers.ModelSerializer):
+class CollectionSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Collection
         fields = ['id', 'title', 'products_count']
@@ -31,24 +73,116 @@ class CollectionSerializer(serializers.ModelSerializer):
     products_count = serializers.IntegerField(read_only=True)
 
 
-class ProductSerializer(serializers.ModelSerializer):
+#########################################################################################
+# Home screen (/store/home/) : the collections with their featured product and its
+# first image, built from one query + one image prefetch (views.HomeViewSet)
+#########################################################################################
+
+class HomeProductSerializer(serializers.ModelSerializer):
+    image = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Product
+        fields = ['id', 'title', 'slug', 'unit_price', 'image']
+
+    def get_image(self, product: Product):
+        # the images are prefetched in id order
+        images = product.images.all()
+        if not images:
+            return None
+        return ProductImageSerializer(images[0], context=self.context).data
+
+
+class HomeCollectionSerializer(serializers.ModelSerializer):
+    featured_product = HomeProductSerializer(read_only=True)
+
+    class Meta:
+        model = Collection
+        fields = ['id', 'title', 'products_count', 'featured_product']
+
+
+class ReassignCollectionSerializer(serializers.Serializer):
+    target = serializers.IntegerField()
+
+    def validate_target(self, value):
+        if value == self.context['collection_id']:
+            raise serializers.ValidationError(
+                'The target must be another collection.')
+        if not Collection.objects.filter(pk=value).exists():
+            raise serializers.ValidationError(
+                'No collection with the given ID was found.')
+        return value
+
+
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
     class Meta:
         model = Product
         fields = ['id', 'title', 'description', 'slug', 'inventory',
-                  'unit_price', 'price_with_tax', 'collection','images']
+                  'unit_price', 'effective_price', 'price_with_tax', 'collection','images',
+                  'avg_rating', 'review_count']
 
+    effective_price = serializers.SerializerMethodField()
     price_with_tax = serializers.SerializerMethodField(
         method_name='calculate_tax')
+    avg_rating = serializers.SerializerMethodField()
+    review_count = serializers.SerializerMethodField()
+
+    # annotated by the database on list / retrieve (pricing.with_prices)
+    def get_effective_price(self, product: Product):
+        if hasattr(product, 'effective_price'):
+            return product.effective_price
+        return effective_price(product.unit_price, product.id)
 
     def calculate_tax(self, product: Product):
-        return product.unit_price * Decimal(1.1)
+        if hasattr(product, 'price_with_tax'):
+            return product.price_with_tax
+        return price_with_tax(self.get_effective_price(product), product.collection_id,
+                              get_region(self.context.get('request')))
+
+    # annotated by the database on list / retrieve (counters.with_ratings)
+    def get_avg_rating(self, product: Product):
+        if hasattr(product, 'avg_rating'):
+            return product.avg_rating
+        return self.get_stored_rating(product).avg_rating
+
+    def get_review_count(self, product: Product):
+        if hasattr(product, 'review_count'):
+            return product.review_count
+        return self.get_stored_rating(product).review_count
+
+    def get_stored_rating(self, product: Product):
+        try:
+            return product.rating
+        except ProductRating.DoesNotExist:
+            return ProductRating()
+
+    def update(self, instance, validated_data):
+        product = super().update(instance, validated_data)
+        # the annotated prices were computed before the update
+        vars(product).pop('effective_price', None)
+        vars(product).pop('price_with_tax', None)
+        return product
+
+
+class BulkProductSerializer(serializers.ModelSerializer):
+    # validates one row of a bulk import (store.bulk), the relations are plain ids
+    # which are checked for the whole batch at once instead of one query per row
+    id = serializers.IntegerField(required=False)
+    collection = serializers.IntegerField(source='collection_id')
+    promotions = serializers.ListField(
+        child=serializers.IntegerField(), required=False)
+
+    class Meta:
+        model = Product
+        fields = ['id', 'title', 'description', 'slug', 'inventory',
+                  'unit_price', 'collection', 'promotions']
 
 
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Review
-        fields = ['id', 'date', 'name', 'description']
+        fields = ['id', 'date', 'name', 'description', 'rating']
 
     def create(self, validated_data):
         product_id = self.context['product_id']
@@ -61,12 +195,26 @@ class SimpleProductSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'unit_price']
 
 
+def get_item_price(cart_item: CartItem):
+    # cart items are annotated with the effective price (pricing.with_cart_item_prices)
+    if hasattr(cart_item, 'effective_price'):
+        return cart_item.effective_price
+    return effective_price(cart_item.product.unit_price, cart_item.product_id)
+
+
+def get_item_total(cart_item: CartItem):
+    # ... and with the line total
+    if hasattr(cart_item, 'total_price'):
+        return cart_item.total_price
+    return cart_item.quantity * get_item_price(cart_item)
+
+
 class CartItemSerializer(serializers.ModelSerializer):
     product = SimpleProductSerializer()
     total_price = serializers.SerializerMethodField()
 
     def get_total_price(self, cart_item: CartItem):
-        return cart_item.quantity * cart_item.product.unit_price
+        return get_item_total(cart_item)
 
     class Meta:
         model = CartItem
@@ -79,7 +227,10 @@ class CartSerializer(serializers.ModelSerializer):
     total_price = serializers.SerializerMethodField()
 
     def get_total_price(self, cart):
-        return sum([item.quantity * item.product.unit_price for item in cart.items.all()])
+        # computed by the storage (store.carts), or cached
+        if hasattr(cart, 'total_price'):
+            return cart.total_price
+        return sum([get_item_total(item) for item in get_cart_items(cart)])
 
     class Meta:
         model = Cart
@@ -89,38 +240,76 @@ class CartSerializer(serializers.ModelSerializer):
 class AddCartItemSerializer(serializers.ModelSerializer):
     product_id = serializers.IntegerField()
 
-    def validate_product_id(self, value):
-        if not Product.objects.filter(pk=value).exists():
-            raise serializers.ValidationError(
-                'No product with the given ID was found.')
-        return value
-
     def save(self, **kwargs):
         cart_id = self.context['cart_id']
         product_id = self.validated_data['product_id']
         quantity = self.validated_data['quantity']
 
-        try:
-            cart_item = CartItem.objects.get(
-                cart_id=cart_id, product_id=product_id)
-            cart_item.quantity += quantity
-            cart_item.save()
-            self.instance = cart_item
-        except CartItem.DoesNotExist:
-            self.instance = CartItem.objects.create(
-                cart_id=cart_id, **self.validated_data)
+        # one upsert, which also checks that the cart and the product exist (store.carts),
+        # when nothing was added one more query tells a missing cart (404) from a missing
+        # product (400)
+        storage = get_cart_storage()
+        self.instance = storage.add_item(cart_id, product_id, quantity)
+        if self.instance is None:
+            if not storage.cart_exists(cart_id):
+                raise NotFound('No cart with the given ID was found.')
+            raise serializers.ValidationError(
+                {'product_id': ['No product with the given ID was found.']})
 
         return self.instance
 
     class Meta:
         model = CartItem
         fields = ['id', 'product_id', 'quantity']
+        extra_kwargs = {'quantity': {'max_value': MAX_QUANTITY}}
 
 
 class UpdateCartItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = CartItem
         fields = ['quantity']
+        extra_kwargs = {'quantity': {'max_value': MAX_QUANTITY}}
+
+
+class CartItemOperationSerializer(serializers.Serializer):
+    # the items of a batch are identified by their product
+    op = serializers.ChoiceField(choices=['add', 'set', 'remove'])
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, max_value=MAX_QUANTITY, required=False)
+
+    def validate(self, data):
+        if data['op'] != 'remove' and 'quantity' not in data:
+            raise serializers.ValidationError({'quantity': ['This field is required.']})
+        return data
+
+
+class BatchCartItemSerializer(serializers.Serializer):
+    operations = CartItemOperationSerializer(many=True, allow_empty=False, max_length=500)
+
+    def validate_operations(self, operations):
+        # every product of the batch is checked with one query
+        product_ids = {operation['product_id'] for operation in operations}
+        found = Product.objects.only('id').in_bulk(product_ids)
+        missing = sorted(product_ids - set(found))
+        if missing:
+            raise serializers.ValidationError(
+                f'No product was found for the IDs {missing}.')
+        # the quantities of a product add up, the adds to the quantities already in the
+        # cart are capped (store.carts)
+        added, quantities, _ = collapse_operations(operations)
+        too_large = sorted(product_id for lines in (added, quantities)
+                           for product_id, quantity in lines.items() if quantity > MAX_QUANTITY)
+        if too_large:
+            raise serializers.ValidationError(
+                f'The quantity of the products {too_large} is over {MAX_QUANTITY}.')
+        return operations
+
+    def save(self, **kwargs):
+        cart_id = self.context['cart_id']
+        storage = get_cart_storage(CartItemSerializer())
+        if not storage.apply_operations(cart_id, self.validated_data['operations']):
+            raise NotFound('No cart with the given ID was found.')
+        return storage.get_cart(cart_id)
 
 
 class CustomerSerializer(serializers.ModelSerializer):
@@ -157,36 +346,49 @@ class CreateOrderSerializer(serializers.Serializer):
     cart_id = serializers.UUIDField()
 
     def validate_cart_id(self, cart_id):
-        if not Cart.objects.filter(pk=cart_id).exists():
+        lines = get_cart_storage().get_lines(cart_id)
+        if lines is None:
             raise serializers.ValidationError(
                 'No cart with the given ID was found.')
-        if CartItem.objects.filter(cart_id=cart_id).count() == 0:
+        if not lines:
             raise serializers.ValidationError('The cart is empty.')
         return cart_id
 
     def save(self, **kwargs):
-        with transaction.atomic():
-            cart_id = self.validated_data['cart_id']
-
-            customer = Customer.objects.get(
-                user_id=self.context['user_id'])
-            order = Order.objects.create(customer=customer)
-
-            cart_items = CartItem.objects \
-                .select_related('product') \
-                .filter(cart_id=cart_id)
-            order_items = [
-                OrderItem(
-                    order=order,
-                    product=item.product,
-                    unit_price=item.product.unit_price,
-                    quantity=item.quantity
-                ) for item in cart_items
-            ]
-            OrderItem.objects.bulk_create(order_items)
-
-            Cart.objects.filter(pk=cart_id).delete()
-
-            order_created.send_robust(self.__class__, order=order)
-
-            return order
+        # the only place where a cart becomes rows (store.carts), whatever the storage
+        storage = get_cart_storage()
+        cart_id = self.validated_data['cart_id']
+        lines = None
+        try:
+            with transaction.atomic():
+                # deletes the cart, a concurrent checkout of the same cart gets None
+                lines = storage.claim_lines(cart_id)
+                if lines is None:
+                    raise serializers.ValidationError(
+                        {'cart_id': ['No cart with the given ID was found.']})
+
+                customer = Customer.objects.get(
+                    user_id=self.context['user_id'])
+                order = Order.objects.create(customer=customer)
+
+                # products deleted since they were added are dropped
+                products = with_effective_prices(Product.objects.filter(pk__in=lines))
+                order_items = [
+                    OrderItem(
+                        order=order,
+                        product=product,
+                        unit_price=product.effective_price,
+                        quantity=lines[product.id]
+                    ) for product in products
+                ]
+                if not order_items:
+                    raise serializers.ValidationError({'cart_id': ['The cart is empty.']})
+                OrderItem.objects.bulk_create(order_items)
+
+                order_created.send_robust(self.__class__, order=order)
+
+                return order
+        except Exception:
+            if lines is not None:
+                storage.release_lines(cart_id, lines)
+            raise
@@ -1,9 +1,113 @@
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_save
 from django.dispatch import receiver
-from store.models import Customer
+from store.caching import bump_version
+from store.counters import add_to_product_rating, add_to_products_count
+from store.models import Collection, Customer, Product, ProductImage, Promotion, Review, TaxRate
+from store.pricing import invalidate_promotions, invalidate_tax_rates
+from store.search import get_search_backend
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_customer_for_new_user(sender, **kwargs):
   if kwargs['created']:
-    Customer.objects.create(user=kwargs['instance'])
\ No newline at end of file
+    Customer.objects.create(user=kwargs['instance'])
+
+
+# keep the full-text search index current
+@receiver(post_save, sender=Product)
+def index_product(sender, **kwargs):
+  backend = get_search_backend()
+  if backend:
+    backend.index(kwargs['instance'])
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, **kwargs):
+  backend = get_search_backend()
+  if backend:
+    backend.unindex(kwargs['instance'].id)
+
+
+# maintain Collection.products_count when products are created, moved or deleted
+@receiver(pre_save, sender=Product)
+def remember_previous_collection(sender, **kwargs):
+  product = kwargs['instance']
+  product._previous_collection_id = None
+  if product.pk is not None and not kwargs['raw']:
+    product._previous_collection_id = Product.objects \
+      .filter(pk=product.pk).values_list('collection_id', flat=True).first()
+
+@receiver(post_save, sender=Product)
+def update_products_count_on_save(sender, **kwargs):
+  product = kwargs['instance']
+  previous = getattr(product, '_previous_collection_id', None)
+  if kwargs['raw'] or previous == product.collection_id:
+    return
+  add_to_products_count(previous, -1)
+  add_to_products_count(product.collection_id, +1)
+
+@receiver(post_delete, sender=Product)
+def update_products_count_on_delete(sender, **kwargs):
+  add_to_products_count(kwargs['instance'].collection_id, -1)
+
+
+# maintain the rating aggregates (ProductRating) when reviews are created, changed or deleted
+@receiver(pre_save, sender=Review)
+def remember_previous_rating(sender, **kwargs):
+  review = kwargs['instance']
+  review._previous_rating = None
+  if review.pk is not None and not kwargs['raw']:
+    review._previous_rating = Review.objects \
+      .filter(pk=review.pk).values_list('product_id', 'rating').first()
+
+@receiver(post_save, sender=Review)
+def update_product_rating_on_save(sender, **kwargs):
+  review = kwargs['instance']
+  previous = getattr(review, '_previous_rating', None)
+  if kwargs['raw'] or previous == (review.product_id, review.rating):
+    return
+  if previous is not None:
+    add_to_product_rating(*previous, -1)
+  add_to_product_rating(review.product_id, review.rating, +1)
+
+@receiver(post_delete, sender=Review)
+def update_product_rating_on_delete(sender, **kwargs):
+  review = kwargs['instance']
+  add_to_product_rating(review.product_id, review.rating, -1)
+
+
+# reload the tax rates cached by the pricing engine
+@receiver([post_save, post_delete], sender=TaxRate)
+def invalidate_tax_rate_cache(sender, **kwargs):
+  invalidate_tax_rates()
+
+
+# reload the discounts cached by the pricing engine
+@receiver([post_save, post_delete], sender=Promotion)
+def invalidate_promotion_cache(sender, **kwargs):
+  invalidate_promotions()
+
+@receiver(m2m_changed, sender=Product.promotions.through)
+def invalidate_product_promotion_cache(sender, **kwargs):
+  if kwargs['action'] in ('post_add', 'post_remove', 'post_clear'):
+    invalidate_promotions()
+
+
+# cache tags of the catalog endpoints (store.views), a product also changes the
+# products_count of the collections
+@receiver([post_save, post_delete], sender=Product)
+def bump_product_versions(sender, **kwargs):
+  bump_version('products', f'product:{kwargs["instance"].id}', 'collections')
+
+@receiver([post_save, post_delete], sender=ProductImage)
+def bump_product_image_versions(sender, **kwargs):
+  bump_version('products', f'product:{kwargs["instance"].product_id}')
+
+@receiver([post_save, post_delete], sender=Collection)
+def bump_collection_versions(sender, **kwargs):
+  bump_version('collections')
+
+# a review also changes the rating of its product
+@receiver([post_save, post_delete], sender=Review)
+def bump_review_versions(sender, **kwargs):
+  product_id = kwargs['instance'].product_id
+  bump_version(f'reviews:{product_id}', 'products', f'product:{product_id}')
@@ -0,0 +1,43 @@
+from celery import shared_task
+from django.conf import settings
+from .carts import purge_expired_carts
+from .operations import reassign_and_delete_collection
+from .recommendations import compute_related_products
+from .write_behind import flush_pending_reviews
+
+###########################################################################
+# Background jobs of the store app
+# START WORKER : celery -A storefront worker --loglevel=info
+###########################################################################
+
+@shared_task
+def reassign_collection(source_id, target_id):
+    moved = reassign_and_delete_collection(source_id, target_id)
+    print(f'{moved} products were moved from collection {source_id} to {target_id}.')
+
+
+@shared_task
+def flush_reviews():
+    written, pending = flush_pending_reviews()
+    if pending:
+        flush_reviews.apply_async(countdown=get_review_flush_delay())
+    print(f'{written} reviews were written.')
+
+
+def get_review_flush_delay():
+    return getattr(settings, 'STORE_REVIEW_FLUSH_DELAY', 5)
+
+
+@shared_task
+def refresh_related_products():
+    k = getattr(settings, 'STORE_RELATED_PRODUCTS', 10)
+    products = compute_related_products(k)
+    print(f'Related products were computed for {products} products.')
+
+
+@shared_task
+def purge_carts():
+    metrics = purge_expired_carts()
+    print(f"{metrics['carts']} expired carts ({metrics['items']} items) were deleted "
+          f"in {metrics['batches']} batches and {metrics['seconds']}s.")
+    return metrics
@@ -1,3 +1,4 @@
+from django.core.cache import cache
 from rest_framework.test import APIClient
 from django.contrib.auth.models import User
 import pytest
@@ -14,4 +15,9 @@ def api_client():
 def authenticate(api_client):
     def do_authenticate(is_staff=False):
         return api_client.force_authenticate(user=User(is_staff=is_staff))
-    return do_authenticate
\ No newline at end of file
+    return do_authenticate
+
+# cached values (tax rates, ...) must not leak from one test to the next
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
@@ -0,0 +1,99 @@
+import json
+import pytest
+from store.models import Collection, Product, Promotion
+from rest_framework import status
+from model_bakery import baker
+
+#################################################################################
+#  Fixtures specific to this test module
+#################################################################################
+
+@pytest.fixture
+def bulk_products(api_client):
+    def do_bulk_products(rows, ndjson=False):
+        if ndjson:
+            body = '\n'.join(json.dumps(row) for row in rows)
+            return api_client.post('/store/products/bulk/', body, content_type='application/x-ndjson')
+        return api_client.post('/store/products/bulk/', rows, format='json')
+    return do_bulk_products
+
+@pytest.fixture
+def collection():
+    return baker.make(Collection)
+
+def product_row(collection, **kwargs):
+    return {'title': 'a', 'slug': 'a', 'unit_price': 10, 'inventory': 1,
+            'collection': collection.id} | kwargs
+
+#################################################################################
+
+
+@pytest.mark.django_db
+class TestBulkProducts:
+
+    def test_if_user_is_not_admin_return_403(self, authenticate, bulk_products, collection):
+        authenticate()
+
+        response = bulk_products([product_row(collection)])
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    @pytest.mark.parametrize('ndjson', [False, True])
+    def test_if_rows_are_valid_return_created_count(self, authenticate, bulk_products, collection, ndjson):
+        authenticate(is_staff=True)
+
+        response = bulk_products([product_row(collection, title=str(i)) for i in range(3)], ndjson)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data == {'created': 3, 'updated': 0, 'errors': []}
+        assert Product.objects.filter(collection=collection).count() == 3
+        collection.refresh_from_db()
+        assert collection.products_count == 3
+
+    def test_if_rows_have_ids_return_updated_count(self, authenticate, bulk_products, collection):
+        authenticate(is_staff=True)
+        product = baker.make(Product, title='old', unit_price=5)
+
+        response = bulk_products([{'id': product.id, 'title': 'new', 'collection': collection.id}])
+
+        product.refresh_from_db()
+        assert response.data['updated'] == 1
+        assert (product.title, product.unit_price, product.collection_id) == ('new', 5, collection.id)
+
+    def test_if_some_rows_are_invalid_return_their_errors(self, authenticate, bulk_products, collection):
+        authenticate(is_staff=True)
+
+        response = bulk_products([
+            product_row(collection),
+            product_row(collection, unit_price=0),
+            product_row(collection) | {'collection': 0},
+            {'id': 0, 'title': 'missing'},
+        ])
+
+        assert response.data['created'] == 1
+        assert [error['index'] for error in response.data['errors']] == [1, 2, 3]
+        assert 'unit_price' in response.data['errors'][0]['errors']
+        assert 'collection' in response.data['errors'][1]['errors']
+        assert 'id' in response.data['errors'][2]['errors']
+
+    def test_if_every_row_is_invalid_return_400(self, authenticate, bulk_products):
+        authenticate(is_staff=True)
+
+        response = bulk_products([{'title': ''}])
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_if_rows_have_promotions_return_products_with_promotions(
+            self, authenticate, bulk_products, collection):
+        authenticate(is_staff=True)
+        first, second = baker.make(Promotion, _quantity=2)
+        product = baker.make(Product, promotions=[first])
+
+        bulk_products([
+            product_row(collection, slug='created', promotions=[first.id, second.id]),
+            {'id': product.id, 'promotions': [second.id]},
+        ])
+
+        created = Product.objects.get(slug='created')
+        assert set(created.promotions.values_list('id', flat=True)) == {first.id, second.id}
+        assert list(product.promotions.values_list('id', flat=True)) == [second.id]
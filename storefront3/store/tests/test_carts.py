@@ -0,0 +1,542 @@
+import pytest
+from datetime import timedelta
+from decimal import Decimal
+from threading import Thread
+from django.db import DatabaseError, OperationalError, connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from core.models import User
+from store import carts
+from store.carts import RedisCartStorage, add_cart_item, get_cart_storage, purge_expired_carts
+from store.models import Cart, CartItem, Order, OrderItem, Product, Promotion
+from rest_framework import status
+from model_bakery import baker
+
+#################################################################################
+#  Fixtures specific to this test module
+#################################################################################
+
+@pytest.fixture
+def cart():
+    return baker.make(Cart)
+
+@pytest.fixture
+def discounted_product():
+    product = baker.make(Product, unit_price=10)
+    product.promotions.add(baker.make(Promotion, discount=0.2))
+    return product
+
+@pytest.fixture
+def get_cart(api_client, cart):
+    def do_get_cart():
+        return api_client.get(f'/store/carts/{cart.id}/')
+    return do_get_cart
+
+#################################################################################
+
+
+@pytest.mark.django_db
+class TestCartPrices:
+
+    def test_if_product_has_promotion_return_discounted_totals(self, cart, discounted_product, get_cart):
+        baker.make(CartItem, cart=cart, product=discounted_product, quantity=3)
+        baker.make(CartItem, cart=cart, product=baker.make(Product, unit_price=5), quantity=1)
+
+        response = get_cart()
+
+        totals = sorted(item['total_price'] for item in response.data['items'])
+        assert totals == [Decimal('5.00'), Decimal('24.00')]
+        assert response.data['total_price'] == Decimal('29.00')
+
+    def test_if_cart_is_read_use_constant_number_of_queries(
+            self, cart, discounted_product, get_cart, django_assert_num_queries):
+        for product in baker.make(Product, _quantity=5):
+            baker.make(CartItem, cart=cart, product=product, quantity=1)
+        get_cart()
+
+        with django_assert_num_queries(2):
+            get_cart()
+
+    def test_if_cart_is_read_load_only_rendered_product_fields(
+            self, cart, discounted_product, get_cart, django_assert_num_queries):
+        baker.make(CartItem, cart=cart, product=discounted_product, quantity=1)
+        get_cart()
+
+        with django_assert_num_queries(2) as captured:
+            get_cart()
+
+        assert not any('description' in query['sql'] for query in captured.captured_queries)
+
+
+@pytest.mark.django_db
+class TestCreateOrder:
+
+    def test_if_product_has_promotion_order_it_at_effective_price(self, api_client, cart, discounted_product):
+        api_client.force_authenticate(user=baker.make(User))
+        baker.make(CartItem, cart=cart, product=discounted_product, quantity=2)
+
+        response = api_client.post('/store/orders/', {'cart_id': str(cart.id)})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert OrderItem.objects.get().unit_price == Decimal('8.00')
+
+
+@pytest.mark.django_db
+class TestAddCartItem:
+
+    @pytest.fixture
+    def add_item(self, api_client, cart):
+        def do_add_item(product_id, quantity=1, cart_id=None):
+            return api_client.post(f'/store/carts/{cart_id or cart.id}/items/',
+                                   {'product_id': product_id, 'quantity': quantity})
+        return do_add_item
+
+    def test_if_product_is_new_return_created_item(self, add_item, cart):
+        product = baker.make(Product)
+
+        response = add_item(product.id, 2)
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data == {'id': CartItem.objects.get().id, 'product_id': product.id, 'quantity': 2}
+
+    def test_if_product_is_in_cart_return_incremented_item(self, add_item, cart):
+        product = baker.make(Product)
+        item = baker.make(CartItem, cart=cart, product=product, quantity=2)
+
+        response = add_item(product.id, 3)
+
+        assert response.data == {'id': item.id, 'product_id': product.id, 'quantity': 5}
+        assert CartItem.objects.get().quantity == 5
+
+    def test_if_item_is_added_touch_cart_and_upsert_item(self, add_item):
+        product = baker.make(Product)
+
+        with CaptureQueriesContext(connection) as context:
+            add_item(product.id)
+
+        # the savepoints of the transaction aside
+        statements = [query['sql'] for query in context.captured_queries if 'SAVEPOINT' not in query['sql']]
+        assert len(statements) == 2
+
+    def test_if_quantity_is_over_the_maximum_return_400(self, add_item):
+        response = add_item(baker.make(Product).id, 32768)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_if_product_is_added_over_the_maximum_cap_quantity(self, add_item, cart):
+        product = baker.make(Product)
+        baker.make(CartItem, cart=cart, product=product, quantity=32000)
+
+        response = add_item(product.id, 1000)
+
+        assert response.data['quantity'] == 32767
+        assert CartItem.objects.get().quantity == 32767
+
+    def test_if_product_does_not_exist_return_400(self, add_item):
+        response = add_item(0)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert not CartItem.objects.exists()
+
+    def test_if_cart_does_not_exist_return_404(self, add_item):
+        response = add_item(baker.make(Product).id, cart_id='8cdf7f86-5b2a-4f3e-9c3a-bb1e2f0d4a11')
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+class TestPurgeExpiredCarts:
+
+    @pytest.fixture
+    def make_cart(self):
+        def do_make_cart(age, items=0):
+            cart = baker.make(Cart)
+            for _ in range(items):
+                baker.make(CartItem, cart=cart, quantity=1)
+            Cart.objects.filter(pk=cart.pk).update(updated_at=timezone.now() - age)
+            return cart
+        return do_make_cart
+
+    def test_if_cart_is_expired_delete_it_with_its_items(self, make_cart):
+        make_cart(timedelta(days=8), items=2)
+        recent = make_cart(timedelta(days=1), items=1)
+
+        metrics = purge_expired_carts(ttl=7*24*60*60)
+
+        assert metrics['carts'] == 1
+        assert metrics['items'] == 2
+        assert list(Cart.objects.all()) == [recent]
+        assert CartItem.objects.get().cart == recent
+
+    def test_if_many_carts_are_expired_delete_them_in_batches(self, make_cart):
+        for _ in range(5):
+            make_cart(timedelta(hours=2))
+
+        metrics = purge_expired_carts(ttl=60*60, batch_size=2)
+
+        assert metrics['carts'] == 5
+        assert metrics['batches'] == 3
+        assert not Cart.objects.exists()
+
+    def test_if_old_cart_is_still_used_keep_it(self, api_client, make_cart):
+        cart = make_cart(timedelta(days=8))
+        Cart.objects.filter(pk=cart.pk).update(created_at=timezone.now() - timedelta(days=30))
+
+        api_client.post(f'/store/carts/{cart.pk}/items/',
+                        {'product_id': baker.make(Product).id, 'quantity': 1})
+        metrics = purge_expired_carts(ttl=7*24*60*60)
+
+        assert metrics['carts'] == 0
+        assert CartItem.objects.get().cart == cart
+
+    def test_if_no_cart_is_expired_delete_nothing(self, make_cart):
+        make_cart(timedelta(minutes=5), items=1)
+
+        metrics = purge_expired_carts(ttl=60*60)
+
+        assert metrics == {'carts': 0, 'items': 0, 'batches': 0, 'seconds': metrics['seconds']}
+        assert Cart.objects.count() == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_if_same_product_is_added_concurrently_no_update_is_lost():
+    cart = baker.make(Cart)
+    product = baker.make(Product)
+    threads, adds = 8, 10
+    errors = []
+
+    def add_once():
+        while True:
+            try:
+                return add_cart_item(cart.id, product.id, 1)
+            except OperationalError as error:
+                # the in-memory SQLite test database doesn't wait for table locks,
+                # the statement is simply run again
+                if connection.vendor != 'sqlite' or 'locked' not in str(error):
+                    raise
+
+    def add():
+        try:
+            for _ in range(adds):
+                add_once()
+        except Exception as error:
+            errors.append(error)
+        finally:
+            connection.close()
+
+    workers = [Thread(target=add) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert errors == []
+    assert CartItem.objects.get(cart=cart, product=product).quantity == threads * adds
+
+
+@pytest.fixture(params=['database', 'redis'])
+def cart_storage(request, settings, monkeypatch):
+    if request.param == 'redis':
+        fakeredis = pytest.importorskip('fakeredis')
+        client = fakeredis.FakeRedis()
+        settings.STORE_CART_STORAGE = 'store.carts.RedisCartStorage'
+        monkeypatch.setattr(RedisCartStorage, 'get_client', lambda self: client)
+    return request.param
+
+
+@pytest.mark.django_db
+class TestCartStorage:
+
+    def test_if_cart_is_created_return_empty_cart(self, api_client, cart_storage):
+        response = api_client.post('/store/carts/')
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert set(response.data) == {'id', 'items', 'total_price'}
+        assert (response.data['items'], response.data['total_price']) == ([], 0)
+
+    def test_if_items_are_added_return_cart_with_totals(self, api_client, cart_storage):
+        product = baker.make(Product, unit_price=10)
+        cart_id = api_client.post('/store/carts/').data['id']
+
+        api_client.post(f'/store/carts/{cart_id}/items/', {'product_id': product.id, 'quantity': 2})
+        added = api_client.post(f'/store/carts/{cart_id}/items/', {'product_id': product.id, 'quantity': 1})
+        response = api_client.get(f'/store/carts/{cart_id}/')
+
+        assert added.data['quantity'] == 3
+        [item] = response.data['items']
+        assert item['id'] == added.data['id']
+        assert item['product'] == {'id': product.id, 'title': product.title, 'unit_price': Decimal('10.00')}
+        assert (item['quantity'], item['total_price'], response.data['total_price']) == (3, 30, 30)
+
+    def test_if_item_is_updated_and_removed_return_new_items(self, api_client, cart_storage):
+        product = baker.make(Product)
+        cart_id = api_client.post('/store/carts/').data['id']
+        item_id = api_client.post(f'/store/carts/{cart_id}/items/',
+                                  {'product_id': product.id, 'quantity': 2}).data['id']
+
+        updated = api_client.patch(f'/store/carts/{cart_id}/items/{item_id}/', {'quantity': 5})
+        retrieved = api_client.get(f'/store/carts/{cart_id}/items/{item_id}/')
+        removed = api_client.delete(f'/store/carts/{cart_id}/items/{item_id}/')
+
+        assert updated.data == {'quantity': 5}
+        assert retrieved.data['quantity'] == 5
+        assert removed.status_code == status.HTTP_204_NO_CONTENT
+        assert api_client.get(f'/store/carts/{cart_id}/items/').data == []
+
+    def test_if_cart_does_not_exist_return_404(self, api_client, cart_storage):
+        cart_id = '8cdf7f86-5b2a-4f3e-9c3a-bb1e2f0d4a11'
+
+        assert api_client.get(f'/store/carts/{cart_id}/').status_code == status.HTTP_404_NOT_FOUND
+        assert api_client.get('/store/carts/not-a-uuid/').status_code == status.HTTP_404_NOT_FOUND
+        assert api_client.delete(f'/store/carts/{cart_id}/').status_code == status.HTTP_404_NOT_FOUND
+
+    def test_if_cart_is_ordered_write_order_and_discard_cart(
+            self, api_client, cart_storage, discounted_product, django_capture_on_commit_callbacks):
+        api_client.force_authenticate(user=baker.make(User))
+        cart_id = api_client.post('/store/carts/').data['id']
+        api_client.post(f'/store/carts/{cart_id}/items/', {'product_id': discounted_product.id, 'quantity': 2})
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = api_client.post('/store/orders/', {'cart_id': cart_id})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [(item.quantity, item.unit_price) for item in OrderItem.objects.all()] == [(2, Decimal('8.00'))]
+        assert api_client.get(f'/store/carts/{cart_id}/').status_code == status.HTTP_404_NOT_FOUND
+
+    def test_if_every_product_was_deleted_return_400_without_order(self, api_client, cart_storage):
+        api_client.force_authenticate(user=baker.make(User))
+        product = baker.make(Product)
+        cart_id = api_client.post('/store/carts/').data['id']
+        api_client.post(f'/store/carts/{cart_id}/items/', {'product_id': product.id, 'quantity': 1})
+        product.delete()
+
+        response = api_client.post('/store/orders/', {'cart_id': cart_id})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert not Order.objects.exists()
+
+    def test_if_cart_is_claimed_twice_return_lines_once(self, api_client, cart_storage):
+        product = baker.make(Product)
+        cart_id = api_client.post('/store/carts/').data['id']
+        api_client.post(f'/store/carts/{cart_id}/items/', {'product_id': product.id, 'quantity': 2})
+        storage = get_cart_storage()
+
+        assert storage.claim_lines(cart_id) == {product.id: 2}
+        assert storage.claim_lines(cart_id) is None
+
+    @pytest.mark.parametrize('cart_storage', ['redis'], indirect=True)
+    def test_if_order_fails_give_the_cart_back(self, api_client, cart_storage, monkeypatch):
+        api_client.force_authenticate(user=baker.make(User))
+        product = baker.make(Product)
+        cart_id = api_client.post('/store/carts/').data['id']
+        api_client.post(f'/store/carts/{cart_id}/items/', {'product_id': product.id, 'quantity': 2})
+
+        def fail(*args, **kwargs):
+            raise DatabaseError('bulk insert failed')
+
+        monkeypatch.setattr(OrderItem.objects, 'bulk_create', fail)
+        with pytest.raises(DatabaseError):
+            api_client.post('/store/orders/', {'cart_id': cart_id})
+
+        assert get_cart_storage().get_lines(cart_id) == {product.id: 2}
+
+    @pytest.mark.parametrize('cart_storage', ['redis'], indirect=True)
+    def test_if_item_is_removed_meanwhile_do_not_recreate_it(self, api_client, cart_storage, monkeypatch):
+        product = baker.make(Product)
+        cart_id = api_client.post('/store/carts/').data['id']
+        api_client.post(f'/store/carts/{cart_id}/items/', {'product_id': product.id, 'quantity': 2})
+        storage = get_cart_storage()
+        item = storage.get_item(cart_id, product.id)
+        storage.remove_item(cart_id, product.id)
+        # the item was read before the removal
+        monkeypatch.setattr(storage, 'get_item', lambda cart_id, item_id: item)
+
+        assert storage.set_quantity(cart_id, product.id, 5) is None
+        assert storage.get_lines(cart_id) == {}
+
+    @pytest.mark.parametrize('cart_storage', ['redis'], indirect=True)
+    def test_if_redis_storage_is_used_write_nothing_to_sql(self, api_client, cart_storage):
+        product = baker.make(Product)
+
+        cart_id = api_client.post('/store/carts/').data['id']
+        api_client.post(f'/store/carts/{cart_id}/items/', {'product_id': product.id, 'quantity': 1})
+
+        assert not Cart.objects.exists()
+        assert not CartItem.objects.exists()
+
+
+@pytest.mark.django_db
+class TestBatchCartItems:
+
+    @pytest.fixture
+    def batch(self, api_client):
+        def do_batch(cart_id, operations):
+            return api_client.patch(f'/store/carts/{cart_id}/items/batch/',
+                                    {'operations': operations}, format='json')
+        return do_batch
+
+    def test_if_operations_are_valid_apply_them_in_order(self, api_client, cart_storage, batch):
+        kept, updated, removed, added = (baker.make(Product, unit_price=1) for _ in range(4))
+        cart_id = api_client.post('/store/carts/').data['id']
+        for product in (kept, updated, removed):
+            api_client.post(f'/store/carts/{cart_id}/items/', {'product_id': product.id, 'quantity': 2})
+
+        response = batch(cart_id, [
+            {'op': 'add', 'product_id': kept.id, 'quantity': 1},
+            {'op': 'add', 'product_id': kept.id, 'quantity': 2},
+            {'op': 'set', 'product_id': updated.id, 'quantity': 7},
+            {'op': 'remove', 'product_id': removed.id},
+            {'op': 'add', 'product_id': added.id, 'quantity': 1},
+            {'op': 'remove', 'product_id': added.id},
+            {'op': 'add', 'product_id': added.id, 'quantity': 4},
+        ])
+
+        assert response.status_code == status.HTTP_200_OK
+        quantities = {item['product']['id']: item['quantity'] for item in response.data['items']}
+        assert quantities == {kept.id: 5, updated.id: 7, added.id: 4}
+        assert response.data['total_price'] == 16
+
+    def test_if_product_does_not_exist_return_400_and_change_nothing(
+            self, api_client, cart_storage, batch):
+        product = baker.make(Product)
+        cart_id = api_client.post('/store/carts/').data['id']
+
+        response = batch(cart_id, [
+            {'op': 'add', 'product_id': product.id, 'quantity': 1},
+            {'op': 'set', 'product_id': 0, 'quantity': 1},
+        ])
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert api_client.get(f'/store/carts/{cart_id}/').data['items'] == []
+
+    def test_if_added_quantities_are_over_the_maximum_return_400(self, api_client, cart_storage, batch):
+        product = baker.make(Product)
+        cart_id = api_client.post('/store/carts/').data['id']
+
+        response = batch(cart_id, [
+            {'op': 'set', 'product_id': product.id, 'quantity': 20000},
+            {'op': 'add', 'product_id': product.id, 'quantity': 20000},
+        ])
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_if_add_goes_over_the_maximum_cap_quantity(self, api_client, cart_storage, batch):
+        product = baker.make(Product)
+        cart_id = api_client.post('/store/carts/').data['id']
+        api_client.post(f'/store/carts/{cart_id}/items/', {'product_id': product.id, 'quantity': 30000})
+
+        response = batch(cart_id, [{'op': 'add', 'product_id': product.id, 'quantity': 5000}])
+
+        assert response.data['items'][0]['quantity'] == 32767
+
+    def test_if_quantity_is_missing_return_400(self, cart, batch):
+        response = batch(cart.id, [{'op': 'add', 'product_id': baker.make(Product).id}])
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_if_cart_does_not_exist_return_404(self, cart_storage, batch):
+        response = batch('8cdf7f86-5b2a-4f3e-9c3a-bb1e2f0d4a11',
+                         [{'op': 'add', 'product_id': baker.make(Product).id, 'quantity': 1}])
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_if_batch_is_large_use_constant_number_of_queries(self, cart, batch):
+        products = baker.make(Product, _quantity=50)
+        operations = [
+            {'op': op, 'product_id': product.id, 'quantity': 1}
+            for product in products for op in ('add', 'set')
+        ]
+        batch(cart.id, operations[:2])
+
+        with CaptureQueriesContext(connection) as small:
+            batch(cart.id, operations[:4])
+        with CaptureQueriesContext(connection) as large:
+            batch(cart.id, operations + [{'op': 'remove', 'product_id': products[0].id}])
+
+        assert len(large.captured_queries) <= len(small.captured_queries) + 1
+        assert CartItem.objects.filter(cart=cart).count() == 49
+
+
+@pytest.mark.django_db
+class TestCachedSubtotals:
+
+    @pytest.fixture(autouse=True)
+    def cache_subtotals(self, settings):
+        settings.STORE_CART_SUBTOTAL_CACHE = True
+
+    @pytest.fixture
+    def get_total(self, api_client):
+        def do_get_total(cart_id):
+            return api_client.get(f'/store/carts/{cart_id}/').data['total_price']
+        return do_get_total
+
+    def test_if_items_change_return_updated_total(self, api_client, cart_storage, get_total):
+        first, second = baker.make(Product, unit_price=10), baker.make(Product, unit_price=5)
+        cart_id = api_client.post('/store/carts/').data['id']
+        items = f'/store/carts/{cart_id}/items/'
+        totals = [get_total(cart_id)]
+
+        item_id = api_client.post(items, {'product_id': first.id, 'quantity': 2}).data['id']
+        totals.append(get_total(cart_id))
+        api_client.post(items, {'product_id': second.id, 'quantity': 1})
+        api_client.post(items, {'product_id': first.id, 'quantity': 1})
+        totals.append(get_total(cart_id))
+        api_client.patch(f'{items}{item_id}/', {'quantity': 1})
+        totals.append(get_total(cart_id))
+        api_client.delete(f'{items}{item_id}/')
+        totals.append(get_total(cart_id))
+        api_client.patch(f'{items}batch/', {'operations': [
+            {'op': 'add', 'product_id': second.id, 'quantity': 1}]}, format='json')
+        totals.append(get_total(cart_id))
+
+        assert totals == [0, 20, 35, 15, 5, 10]
+
+    def test_if_total_is_cached_do_not_compute_it(self, cart, get_total):
+        item = baker.make(CartItem, cart=cart, product=baker.make(Product, unit_price=10), quantity=1)
+        get_total(cart.id)
+        # bypasses the storage, the cached total isn't updated
+        CartItem.objects.filter(pk=item.pk).update(quantity=3)
+
+        assert get_total(cart.id) == 10
+
+    def test_if_price_changes_recompute_total(self, cart, get_total):
+        product = baker.make(Product, unit_price=10)
+        baker.make(CartItem, cart=cart, product=product, quantity=2)
+        get_total(cart.id)
+
+        product.unit_price = 12
+        product.save()
+
+        assert get_total(cart.id) == 24
+
+    def test_if_read_caches_its_total_after_a_change_return_new_total(
+            self, api_client, cart_storage, get_total, monkeypatch):
+        product = baker.make(Product, unit_price=10)
+        cart_id = api_client.post('/store/carts/').data['id']
+        deferred = []
+        cache_subtotal = carts.cache_subtotal
+        monkeypatch.setattr('store.carts.cache_subtotal', lambda *args: deferred.append(args))
+        get_total(cart_id)
+        monkeypatch.setattr('store.carts.cache_subtotal', cache_subtotal)
+
+        # the item is added between the read and the caching of its total
+        api_client.post(f'/store/carts/{cart_id}/items/', {'product_id': product.id, 'quantity': 2})
+        cache_subtotal(*deferred[0])
+
+        assert get_total(cart_id) == 20
+
+    def test_if_total_is_cached_return_subtotal_in_one_query(
+            self, api_client, cart, get_total, django_assert_num_queries):
+        product = baker.make(Product, unit_price=10)
+        get_total(cart.id)
+        api_client.post(f'/store/carts/{cart.id}/items/', {'product_id': product.id, 'quantity': 2})
+
+        with django_assert_num_queries(1):
+            response = api_client.get(f'/store/carts/{cart.id}/subtotal/')
+
+        assert response.data == {'id': str(cart.id), 'total_price': 20}
+
+    def test_if_cart_does_not_exist_return_subtotal_404(self, api_client, cart_storage):
+        response = api_client.get('/store/carts/8cdf7f86-5b2a-4f3e-9c3a-bb1e2f0d4a11/subtotal/')
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
@@ -1,5 +1,6 @@
 import pytest
-from store.models import Collection
+from django.core.management import call_command
+from store.models import Collection, Product
 from rest_framework import status
 from model_bakery import baker 
 
@@ -115,4 +116,94 @@ class TestRetrieveCollection:
             'title' : collection.title,
             'products_count' : 0
         }
-        
\ No newline at end of file
+        
+
+@pytest.mark.django_db
+class TestProductsCount:
+
+    def test_if_products_are_created_return_count(self, api_client):
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection, _quantity=2)
+
+        response = api_client.get(f'/store/collections/{collection.id}/')
+
+        assert response.data['products_count'] == 2
+
+    def test_if_product_moves_return_updated_counts(self):
+        source, target = baker.make(Collection, _quantity=2)
+        product = baker.make(Product, collection=source)
+
+        product.collection = target
+        product.save()
+
+        source.refresh_from_db()
+        target.refresh_from_db()
+        assert (source.products_count, target.products_count) == (0, 1)
+
+    def test_if_product_is_deleted_return_decremented_count(self):
+        collection = baker.make(Collection)
+        product = baker.make(Product, collection=collection)
+
+        product.delete()
+
+        collection.refresh_from_db()
+        assert collection.products_count == 0
+
+    def test_if_count_has_drifted_reconcile_repairs_it(self):
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection, _quantity=3)
+        Collection.objects.filter(pk=collection.pk).update(products_count=10)
+
+        call_command('reconcile_counters')
+
+        collection.refresh_from_db()
+        assert collection.products_count == 3
+
+
+@pytest.mark.django_db
+class TestReassignCollection:
+
+    def test_if_user_is_not_admin_return_403(self, api_client, authenticate):
+        authenticate()
+        source, target = baker.make(Collection, _quantity=2)
+
+        response = api_client.post(f'/store/collections/{source.id}/reassign/', {'target': target.id})
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_if_target_is_source_return_400(self, api_client, authenticate):
+        authenticate(is_staff=True)
+        source = baker.make(Collection)
+
+        response = api_client.post(f'/store/collections/{source.id}/reassign/', {'target': source.id})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_if_target_is_valid_move_products_and_delete_source(self, api_client, authenticate):
+        authenticate(is_staff=True)
+        source, target = baker.make(Collection, _quantity=2)
+        products = baker.make(Product, collection=source, _quantity=3)
+        Collection.objects.filter(pk=source.id).update(featured_product=products[0])
+
+        response = api_client.post(f'/store/collections/{source.id}/reassign/', {'target': target.id})
+
+        target.refresh_from_db()
+        assert response.data == {'moved': 3}
+        assert not Collection.objects.filter(pk=source.id).exists()
+        assert Product.objects.filter(collection=target).count() == 3
+        assert target.products_count == 3
+        assert target.featured_product_id == products[0].id
+
+    def test_if_collection_is_large_return_202(self, api_client, authenticate, settings, monkeypatch):
+        authenticate(is_staff=True)
+        settings.STORE_BACKGROUND_REASSIGN_THRESHOLD = 1
+        source, target = baker.make(Collection, _quantity=2)
+        baker.make(Product, collection=source, _quantity=2)
+        jobs = []
+        monkeypatch.setattr('store.views.reassign_collection.delay',
+                            lambda *args: jobs.append(args) or type('Job', (), {'id': 'job'}))
+
+        response = api_client.post(f'/store/collections/{source.id}/reassign/', {'target': target.id})
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert jobs == [(source.id, target.id)]
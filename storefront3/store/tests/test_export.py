@@ -0,0 +1,79 @@
+import csv
+import json
+import pytest
+from django.core.management import call_command
+from store.export import iterate_products, get_export_queryset
+from store.models import Product, ProductImage
+from rest_framework import status
+from model_bakery import baker
+
+#################################################################################
+#  Fixtures specific to this test module
+#################################################################################
+
+@pytest.fixture
+def export_products(api_client):
+    def do_export_products(output=None):
+        params = {'output': output} if output else {}
+        return api_client.get('/store/products/export/', params)
+    return do_export_products
+
+def read(response):
+    return b''.join(response.streaming_content).decode()
+
+#################################################################################
+
+
+@pytest.mark.django_db
+class TestExportCatalog:
+
+    def test_if_user_is_not_admin_return_403(self, authenticate, export_products):
+        authenticate()
+
+        response = export_products()
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_if_ndjson_is_requested_return_a_line_per_product(self, authenticate, export_products):
+        authenticate(is_staff=True)
+        product = baker.make(Product)
+        baker.make(ProductImage, product=product, image='store/images/a.jpg')
+
+        response = export_products()
+
+        rows = [json.loads(line) for line in read(response).splitlines()]
+        assert response['Content-Type'] == 'application/x-ndjson'
+        assert rows[0]['collection_title'] == product.collection.title
+        assert rows[0]['images'] == ['http://testserver/media/store/images/a.jpg']
+
+    def test_if_csv_is_requested_return_header_and_rows(self, authenticate, export_products):
+        authenticate(is_staff=True)
+        baker.make(Product, _quantity=2)
+
+        response = export_products('csv')
+
+        rows = list(csv.reader(read(response).splitlines()))
+        assert rows[0][0] == 'id'
+        assert len(rows) == 3
+
+    def test_if_output_is_unknown_return_400(self, authenticate, export_products):
+        authenticate(is_staff=True)
+
+        response = export_products('xml')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_if_products_span_chunks_return_each_product_once(self):
+        products = baker.make(Product, _quantity=7)
+
+        exported = [product.id for product in iterate_products(get_export_queryset(), chunk_size=3)]
+
+        assert exported == sorted(product.id for product in products)
+
+    def test_if_command_writes_a_file_return_every_product(self, tmp_path):
+        baker.make(Product, _quantity=3)
+        output = tmp_path / 'catalog.ndjson'
+
+        call_command('export_catalog', output=str(output))
+
+        assert len(output.read_text().splitlines()) == 3
@@ -0,0 +1,69 @@
+import pytest
+from store.models import Collection, Product, ProductImage
+from rest_framework import status
+from model_bakery import baker
+
+#################################################################################
+#  Fixtures specific to this test module
+#################################################################################
+
+@pytest.fixture
+def get_home(api_client):
+    def do_get_home():
+        return api_client.get('/store/home/')
+    return do_get_home
+
+@pytest.fixture
+def featured_collections():
+    collections = []
+    for index in range(3):
+        collection = baker.make(Collection, title=f'collection {index}')
+        product = baker.make(Product, collection=collection)
+        baker.make(ProductImage, product=product, image=f'store/images/{index}-a.jpg')
+        baker.make(ProductImage, product=product, image=f'store/images/{index}-b.jpg')
+        collection.featured_product = product
+        collection.save()
+        collections.append(collection)
+    return collections
+
+#################################################################################
+
+
+@pytest.mark.django_db
+class TestHome:
+
+    def test_if_collections_are_featured_return_product_and_first_image(
+            self, get_home, featured_collections):
+        response = get_home()
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [collection['id'] for collection in response.data] == \
+            [collection.id for collection in featured_collections]
+        featured = response.data[0]['featured_product']
+        assert featured['id'] == featured_collections[0].featured_product_id
+        assert featured['image']['image'].endswith('0-a.jpg')
+
+    def test_if_collection_has_no_featured_product_return_null(self, get_home):
+        baker.make(Collection)
+
+        response = get_home()
+
+        assert response.data[0]['featured_product'] is None
+
+    def test_if_home_is_built_use_constant_number_of_queries(
+            self, get_home, featured_collections, settings, django_assert_num_queries):
+        settings.STORE_RESPONSE_CACHE = False
+
+        with django_assert_num_queries(2):
+            get_home()
+
+    def test_if_home_is_cached_return_snapshot_until_image_changes(
+            self, get_home, featured_collections, django_assert_num_queries):
+        get_home()
+
+        with django_assert_num_queries(0):
+            get_home()
+        ProductImage.objects.filter(product_id=featured_collections[0].featured_product_id).first().delete()
+        response = get_home()
+
+        assert response.data[0]['featured_product']['image']['image'].endswith('0-b.jpg')
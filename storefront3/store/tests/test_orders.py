@@ -0,0 +1,67 @@
+import pytest
+from core.models import User
+from store.models import Customer, Order, OrderItem, Product
+from rest_framework import status
+from model_bakery import baker
+
+#################################################################################
+#  Fixtures specific to this test module
+#################################################################################
+
+@pytest.fixture
+def customer(api_client):
+    user = baker.make(User)
+    api_client.force_authenticate(user=user)
+    return Customer.objects.get(user=user)
+
+@pytest.fixture
+def make_order(customer):
+    def do_make_order(items=1):
+        order = baker.make(Order, customer=customer)
+        for _ in range(items):
+            baker.make(OrderItem, order=order, product=baker.make(Product), quantity=1, unit_price=5)
+        return order
+    return do_make_order
+
+#################################################################################
+
+
+@pytest.mark.django_db
+class TestRetrieveOrders:
+
+    def test_if_order_exists_return_its_items(self, api_client, make_order):
+        order = make_order()
+        item = order.items.get()
+
+        response = api_client.get(f'/store/orders/{order.id}/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['items'] == [{
+            'id': item.id,
+            'product': {'id': item.product.id, 'title': item.product.title,
+                        'unit_price': item.product.unit_price},
+            'unit_price': 5,
+            'quantity': 1,
+        }]
+
+    def test_if_orders_are_listed_use_constant_number_of_queries(
+            self, api_client, make_order, django_assert_num_queries):
+        for _ in range(3):
+            make_order(items=3)
+
+        # the customer, the orders, their items with their products
+        with django_assert_num_queries(3) as captured:
+            response = api_client.get('/store/orders/')
+
+        assert len(response.data) == 3
+        assert not any('description' in query['sql'] for query in captured.captured_queries)
+
+    def test_if_order_is_created_return_it_with_its_items(self, api_client, customer):
+        cart_id = api_client.post('/store/carts/').data['id']
+        for product in baker.make(Product, _quantity=2):
+            api_client.post(f'/store/carts/{cart_id}/items/', {'product_id': product.id, 'quantity': 1})
+
+        response = api_client.post('/store/orders/', {'cart_id': cart_id})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data['items']) == 2
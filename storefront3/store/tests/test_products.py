@@ -0,0 +1,499 @@
+import pytest
+from decimal import Decimal
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from store.models import Collection, Product, Promotion, TaxRate
+from store.pricing import effective_price
+from rest_framework import status
+from model_bakery import baker
+
+#################################################################################
+#  Fixtures specific to this test module
+#################################################################################
+
+@pytest.fixture
+def list_products(api_client):
+    def do_list_products(params=None, url='/store/products/'):
+        return api_client.get(path=url, data=params)
+    return do_list_products
+
+#################################################################################
+
+
+@pytest.mark.django_db
+class TestKeysetPagination:
+
+    def test_if_cursor_is_empty_return_first_page_without_count(self, list_products):
+        baker.make(Product, _quantity=15)
+
+        response = list_products({'cursor': ''})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data['results']) == 10
+        assert 'count' not in response.data
+        assert response.data['previous'] is None
+        assert response.data['next'] is not None
+
+    def test_if_count_is_requested_return_count(self, list_products):
+        baker.make(Product, _quantity=3)
+
+        response = list_products({'cursor': '', 'count': 'true'})
+
+        assert response.data['count'] == 3
+
+    @pytest.mark.parametrize('ordering', ['title', '-unit_price', 'last_update'])
+    def test_if_pages_are_followed_return_every_product_once(self, list_products, ordering):
+        # identical sort values so the pages depend on the id tie breaker
+        products = baker.make(Product, title='Same', unit_price=5, _quantity=25)
+
+        ids = []
+        response = list_products({'cursor': '', 'ordering': ordering})
+        while True:
+            ids += [product['id'] for product in response.data['results']]
+            if response.data['next'] is None:
+                break
+            response = list_products(url=response.data['next'])
+
+        assert sorted(ids) == sorted(product.id for product in products)
+        assert len(ids) == len(set(ids))
+
+    def test_if_previous_is_followed_return_previous_page(self, list_products):
+        baker.make(Product, _quantity=25)
+        first = list_products({'cursor': ''})
+        second = list_products(url=first.data['next'])
+
+        response = list_products(url=second.data['previous'])
+
+        assert response.data['results'] == first.data['results']
+        assert response.data['previous'] is None
+
+    def test_if_cursor_is_invalid_return_404(self, list_products):
+        response = list_products({'cursor': 'invalid'})
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+class TestSearchProducts:
+
+    def test_if_term_matches_return_matching_products(self, list_products):
+        match = baker.make(Product, title='Espresso Machine', description='Steel')
+        baker.make(Product, title='Tea Kettle', description='Copper')
+
+        response = list_products({'search': 'espress'})
+
+        assert [product['id'] for product in response.data['results']] == [match.id]
+
+    def test_if_all_terms_must_match_return_products_matching_every_term(self, list_products):
+        match = baker.make(Product, title='Espresso Machine', description='Brushed steel')
+        baker.make(Product, title='Espresso Cups', description='Porcelain')
+
+        response = list_products({'search': 'espresso steel'})
+
+        assert [product['id'] for product in response.data['results']] == [match.id]
+
+    def test_if_product_is_updated_return_new_title_only(self, list_products):
+        product = baker.make(Product, title='Old Name')
+        product.title = 'New Name'
+        product.save()
+
+        assert list_products({'search': 'old'}).data['count'] == 0
+        assert list_products({'search': 'new'}).data['count'] == 1
+
+    def test_if_product_is_deleted_return_nothing(self, list_products):
+        product = baker.make(Product, title='Gone')
+        product.delete()
+
+        response = list_products({'search': 'gone'})
+
+        assert response.data['count'] == 0
+
+    def test_if_terms_match_more_often_rank_product_first(self, list_products):
+        weak = baker.make(Product, title='Kettle', description='Fits an espresso cup')
+        strong = baker.make(Product, title='Espresso Espresso', description='Espresso blend')
+
+        response = list_products({'search': 'espresso'})
+
+        assert [product['id'] for product in response.data['results']] == [strong.id, weak.id]
+
+    @pytest.mark.skipif(connection.vendor != 'sqlite', reason='FTS5 backend')
+    def test_if_results_are_ranked_read_the_index_once(self, list_products):
+        baker.make(Product, title='Espresso', _quantity=3)
+
+        with CaptureQueriesContext(connection) as context:
+            list_products({'search': 'espresso'})
+
+        page = next(query['sql'] for query in context.captured_queries if 'search_rank' in query['sql'])
+        tables = page.split(' FROM ', 1)[1].split(' WHERE ', 1)[0]
+        assert tables.count('"store_product_fts"') == 1
+        assert 'bm25' not in page and page.count('SELECT') == 1
+
+    def test_if_search_has_syntax_characters_return_200(self, list_products):
+        baker.make(Product, title='Quoted')
+
+        response = list_products({'search': '"quoted* (+-'})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['count'] == 1
+
+
+@pytest.mark.django_db
+class TestProductPrices:
+
+    def test_if_no_rate_is_configured_return_default_tax(self, list_products):
+        product = baker.make(Product, unit_price=Decimal('9.99'))
+
+        response = list_products(url=f'/store/products/{product.id}/')
+
+        assert response.data['price_with_tax'] == Decimal('10.99')
+
+    def test_if_collection_has_rate_return_collection_tax(self, list_products):
+        collection = baker.make(Collection)
+        TaxRate.objects.create(collection=collection, rate=Decimal('0.2'))
+        taxed = baker.make(Product, unit_price=10, collection=collection)
+        baker.make(Product, unit_price=10)
+
+        response = list_products()
+
+        prices = {product['id']: product['price_with_tax'] for product in response.data['results']}
+        assert prices[taxed.id] == Decimal('12.00')
+        assert sorted(prices.values()) == [Decimal('11.00'), Decimal('12.00')]
+
+    def test_if_region_has_rate_return_region_tax(self, list_products):
+        TaxRate.objects.create(region='CA', rate=Decimal('0.05'))
+        product = baker.make(Product, unit_price=10)
+
+        response = list_products({'region': 'CA'}, url=f'/store/products/{product.id}/')
+
+        assert response.data['price_with_tax'] == Decimal('10.50')
+
+    def test_if_price_is_updated_return_new_price_with_tax(self, api_client, authenticate):
+        authenticate(is_staff=True)
+        product = baker.make(Product, unit_price=10)
+
+        response = api_client.patch(f'/store/products/{product.id}/', {'unit_price': 20})
+
+        assert response.data['price_with_tax'] == Decimal('22.00')
+
+
+@pytest.mark.django_db
+class TestPromotions:
+
+    def test_if_product_has_promotions_return_best_discount(self, list_products):
+        product = baker.make(Product, unit_price=20)
+        product.promotions.add(baker.make(Promotion, discount=0.1), baker.make(Promotion, discount=0.25))
+        baker.make(Product, unit_price=20)
+
+        response = list_products()
+
+        prices = {row['id']: (row['effective_price'], row['price_with_tax']) for row in response.data['results']}
+        assert prices[product.id] == (Decimal('15.00'), Decimal('16.50'))
+        assert sorted(prices.values())[-1] == (Decimal('20.00'), Decimal('22.00'))
+
+    def test_if_promotion_changes_return_new_price(self, list_products):
+        product = baker.make(Product, unit_price=20)
+        promotion = baker.make(Promotion, discount=0.5)
+        product.promotions.add(promotion)
+        list_products(url=f'/store/products/{product.id}/')
+
+        promotion.discount = 0.1
+        promotion.save()
+        response = list_products(url=f'/store/products/{product.id}/')
+
+        assert response.data['effective_price'] == Decimal('18.00')
+
+    @pytest.mark.parametrize('discount, price', [(20, Decimal('0.00')), (-0.5, Decimal('20.00'))])
+    def test_if_discount_is_out_of_range_clamp_it(self, list_products, discount, price):
+        product = baker.make(Product, unit_price=20)
+        product.promotions.add(baker.make(Promotion, discount=discount))
+
+        listed = list_products().data['results'][0]['effective_price']
+
+        assert (listed, effective_price(product.unit_price, product.id)) == (price, price)
+
+    def test_if_discount_is_out_of_range_reject_the_promotion(self):
+        with pytest.raises(ValidationError):
+            Promotion(description='a', discount=20).full_clean()
+
+    def test_if_product_is_created_return_effective_price(self, api_client, authenticate):
+        authenticate(is_staff=True)
+        collection = baker.make(Collection)
+
+        response = api_client.post('/store/products/', {
+            'title': 'a', 'slug': 'a', 'inventory': 1, 'unit_price': 10, 'collection': collection.id})
+
+        assert response.data['effective_price'] == Decimal('10.00')
+
+    def test_if_no_promotion_exists_skip_the_subquery(self, list_products):
+        baker.make(Product)
+
+        with CaptureQueriesContext(connection) as context:
+            list_products()
+
+        # the page query, not the check for any promotion
+        page = [query['sql'] for query in context.captured_queries if 'ORDER BY' in query['sql']]
+        assert page and not any('store_product_promotions' in sql for sql in page)
+
+
+@pytest.mark.django_db
+class TestFastSerialization:
+
+    @pytest.fixture
+    def products(self):
+        collection = baker.make(Collection)
+        products = baker.make(Product, collection=collection, description=None, _quantity=3) \
+            + baker.make(Product, unit_price=Decimal('3.30'), _quantity=12)
+        for product in products[:2]:
+            baker.make('store.ProductImage', product=product, image='store/images/a.jpg', _quantity=2)
+        return products
+
+    def fetch_both(self, api_client, settings, url, params=None):
+        # both responses are built, not read from the response cache
+        settings.STORE_RESPONSE_CACHE = False
+        settings.STORE_FAST_SERIALIZATION = False
+        regular = api_client.get(url, params)
+        settings.STORE_FAST_SERIALIZATION = True
+        fast = api_client.get(url, params)
+        return regular, fast
+
+    @pytest.mark.parametrize('params', [
+        {}, {'page': 2}, {'ordering': '-unit_price'}, {'cursor': '', 'ordering': 'last_update'}])
+    def test_if_products_are_listed_return_identical_bytes(self, api_client, settings, products, params):
+        regular, fast = self.fetch_both(api_client, settings, '/store/products/', params)
+
+        assert fast.status_code == status.HTTP_200_OK
+        assert fast.content == regular.content
+
+    @pytest.mark.parametrize('ordering', [
+        'title', '-title', 'unit_price', '-unit_price', 'last_update', '-last_update',
+        'avg_rating', '-avg_rating', 'review_count', '-review_count'])
+    def test_if_fields_omit_the_ordering_return_identical_cursor_pages(
+            self, api_client, settings, products, ordering):
+        params = {'cursor': '', 'fields': 'id', 'ordering': ordering}
+        regular, fast = self.fetch_both(api_client, settings, '/store/products/', params)
+        regular_next, fast_next = self.fetch_both(api_client, settings, fast.data['next'])
+
+        assert fast.status_code == status.HTTP_200_OK
+        assert fast.content == regular.content
+        assert fast_next.content == regular_next.content
+
+    def test_if_product_is_retrieved_return_identical_bytes(self, api_client, settings, products):
+        regular, fast = self.fetch_both(api_client, settings, f'/store/products/{products[0].id}/')
+
+        assert fast.content == regular.content
+
+    def test_if_product_does_not_exist_return_404(self, api_client, settings):
+        settings.STORE_FAST_SERIALIZATION = True
+
+        response = api_client.get('/store/products/0/')
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_if_collections_are_listed_return_identical_bytes(self, api_client, settings, products):
+        regular, fast = self.fetch_both(api_client, settings, '/store/collections/')
+
+        assert fast.content == regular.content
+
+
+@pytest.mark.django_db
+class TestConditionalGet:
+
+    def test_if_etag_matches_return_304(self, api_client):
+        baker.make(Product, _quantity=3)
+        response = api_client.get('/store/products/')
+
+        response = api_client.get('/store/products/', HTTP_IF_NONE_MATCH=response['ETag'])
+
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    def test_if_params_differ_return_different_etag(self, api_client):
+        baker.make(Product, _quantity=3)
+
+        first = api_client.get('/store/products/', {'ordering': 'unit_price'})
+        second = api_client.get('/store/products/', {'ordering': '-unit_price'})
+
+        assert first['ETag'] != second['ETag']
+
+    def test_if_product_changes_return_200(self, api_client):
+        product = baker.make(Product)
+        response = api_client.get(f'/store/products/{product.id}/')
+        product.title = 'Changed'
+        product.save()
+
+        response = api_client.get(
+            f'/store/products/{product.id}/', HTTP_IF_NONE_MATCH=response['ETag'])
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['title'] == 'Changed'
+
+    def test_if_only_modified_since_is_sent_return_200(self, api_client):
+        product = baker.make(Product)
+        response = api_client.get(f'/store/products/{product.id}/')
+
+        assert 'Last-Modified' not in response
+        response = api_client.get(
+            f'/store/products/{product.id}/', HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_if_product_is_deleted_return_200(self, api_client):
+        first, second = baker.make(Product, _quantity=2)
+        response = api_client.get('/store/products/')
+        # the newest product is left, the max of last_update doesn't move
+        first.delete()
+
+        response = api_client.get('/store/products/', HTTP_IF_NONE_MATCH=response['ETag'])
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [product['id'] for product in response.data['results']] == [second.id]
+
+    def test_if_promotion_changes_return_200(self, api_client):
+        product = baker.make(Product, unit_price=10)
+        response = api_client.get(f'/store/products/{product.id}/')
+        product.promotions.add(baker.make(Promotion, discount=0.5))
+
+        response = api_client.get(
+            f'/store/products/{product.id}/', HTTP_IF_NONE_MATCH=response['ETag'])
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['effective_price'] == Decimal('5.00')
+
+    def test_if_collection_gets_a_product_return_200(self, api_client):
+        collection = baker.make(Collection)
+        response = api_client.get('/store/collections/')
+        baker.make(Product, collection=collection)
+
+        response = api_client.get('/store/collections/', HTTP_IF_NONE_MATCH=response['ETag'])
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data[0]['products_count'] == 1
+
+
+@pytest.mark.django_db
+class TestResponseCache:
+
+    def test_if_list_is_requested_twice_return_cached_response(
+            self, list_products, django_assert_max_num_queries):
+        baker.make(Product, _quantity=3)
+        first = list_products({'ordering': 'unit_price'})
+
+        # only the ETag aggregate, the response comes from the cache
+        with django_assert_max_num_queries(1):
+            second = list_products({'ordering': 'unit_price'})
+
+        assert second.content == first.content
+
+    def test_if_image_is_added_return_new_image(self, list_products):
+        product = baker.make(Product)
+        list_products(url=f'/store/products/{product.id}/')
+
+        baker.make('store.ProductImage', product=product, image='store/images/a.jpg')
+        response = list_products(url=f'/store/products/{product.id}/')
+
+        assert len(response.data['images']) == 1
+
+    def test_if_product_moves_return_new_products_count(self, list_products):
+        source, target = baker.make(Collection, _quantity=2)
+        product = baker.make(Product, collection=source)
+        list_products(url=f'/store/collections/{target.id}/')
+
+        product.collection = target
+        product.save()
+        response = list_products(url=f'/store/collections/{target.id}/')
+
+        assert response.data['products_count'] == 1
+
+    def test_if_tax_rate_changes_return_new_price(self, list_products):
+        product = baker.make(Product, unit_price=10)
+        list_products()
+
+        TaxRate.objects.create(rate=Decimal('0.5'))
+        response = list_products()
+
+        assert response.data['results'][0]['price_with_tax'] == Decimal('15.00')
+
+
+@pytest.mark.django_db
+class TestSparseFieldsets:
+
+    @pytest.mark.parametrize('fast', [False, True])
+    def test_if_fields_are_requested_return_only_those(self, list_products, settings, fast):
+        settings.STORE_FAST_SERIALIZATION = fast
+        baker.make(Product)
+
+        response = list_products({'fields': 'id,title,unit_price'})
+
+        assert list(response.data['results'][0]) == ['id', 'title', 'unit_price']
+
+    @pytest.mark.parametrize('fast', [False, True])
+    def test_if_fields_are_omitted_return_the_others(self, list_products, settings, fast):
+        settings.STORE_FAST_SERIALIZATION = fast
+        product = baker.make(Product)
+
+        response = list_products({'omit': 'description,images'}, url=f'/store/products/{product.id}/')
+
+        assert 'description' not in response.data
+        assert 'images' not in response.data
+        assert 'price_with_tax' in response.data
+
+    def test_if_images_are_not_requested_return_without_prefetch(
+            self, list_products, django_assert_num_queries):
+        baker.make(Product, _quantity=3)
+
+        # ETag aggregate, page count, page
+        with django_assert_num_queries(3) as captured:
+            list_products({'fields': 'id,title'})
+
+        page = captured.captured_queries[-1]['sql']
+        assert 'description' not in page
+        assert 'store_productimage' not in page
+
+
+@pytest.mark.django_db
+class TestFacets:
+
+    @pytest.fixture
+    def catalog(self):
+        first, second = baker.make(Collection, _quantity=2)
+        baker.make(Product, collection=first, unit_price=5, _quantity=2)
+        baker.make(Product, collection=first, unit_price=30)
+        baker.make(Product, collection=second, unit_price=200)
+        return first, second
+
+    def test_if_facets_are_requested_return_counts_in_one_query(
+            self, api_client, catalog, settings, django_assert_num_queries):
+        first, second = catalog
+        settings.STORE_FACETS_CACHE = False
+        settings.STORE_RESPONSE_CACHE = False
+        api_client.get('/store/products/')
+
+        with django_assert_num_queries(5):
+            # etag + count + page + images for the list, one query for the facets
+            response = api_client.get('/store/products/', {'facets': 'collection,price'})
+
+        facets = response.data['facets']
+        assert [(row['id'], row['count']) for row in facets['collection']] == [(first.id, 3), (second.id, 1)]
+        assert [row['count'] for row in facets['price']] == [2, 0, 1, 0, 1]
+
+    def test_if_list_is_filtered_count_filtered_products(self, api_client, catalog):
+        response = api_client.get('/store/products/', {'facets': 'price', 'unit_price__lt': 50})
+
+        assert [row['count'] for row in response.data['facets']['price']] == [2, 0, 1, 0, 0]
+        assert 'collection' not in response.data['facets']
+
+    def test_if_facet_is_unknown_return_400(self, api_client):
+        response = api_client.get('/store/products/', {'facets': 'color'})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_if_other_page_is_requested_return_cached_facets(
+            self, api_client, catalog, settings, django_assert_num_queries):
+        settings.STORE_RESPONSE_CACHE = False
+        api_client.get('/store/products/', {'facets': 'price', 'ordering': 'title'})
+
+        with django_assert_num_queries(4):
+            # etag + count + page + images, no query for the facets
+            response = api_client.get('/store/products/', {'facets': 'price', 'ordering': '-unit_price'})
+
+        assert sum(row['count'] for row in response.data['facets']['price']) == 4
@@ -0,0 +1,166 @@
+import pytest
+from urllib.parse import parse_qs, urlparse
+from django.db import connection
+from store.models import Collection, Product, Review
+from rest_framework import status
+from model_bakery import baker
+
+#################################################################################
+# Query plan regression suite
+# - every query of an endpoint is run again with EXPLAIN, a full table scan (or a
+#   sort which can't use an index, where one is expected) fails the test
+# - the page query of a deep keyset cursor must seek : a walk of a whole index fails
+#   it as well
+# - SQLite : EXPLAIN QUERY PLAN, "SCAN <table>" without an index, "SCAN <table>
+#   USING [COVERING] INDEX" for a whole index
+# - MySQL  : EXPLAIN, type = ALL / type = index / "Using filesort"
+#################################################################################
+
+# tables which are read whole on purpose (e.g. cached by store.pricing)
+FULL_SCAN_ALLOWED = ['store_taxrate']
+
+
+# the rating orderings sort on Coalesce(rating__..., 0) over a LEFT JOIN of the
+# aggregates (store.counters.with_ratings), which no index covers
+RATING_ORDERING_SCANS = pytest.mark.xfail(
+    strict=True, reason='rating orderings sort on a coalesced LEFT JOIN column')
+
+
+def explain(sql, params):
+    # with the parameters bound like the query ran : the planner of SQLite derives
+    # index bounds from literals it can't derive from placeholders
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+        cursor.execute('EXPLAIN ' + sql, params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def get_full_scans(plan):
+    if connection.vendor == 'sqlite':
+        return [step.split()[1] for step in plan
+                if step.startswith('SCAN ') and ' USING ' not in step]
+    return [step['table'] for step in plan if step['type'] == 'ALL']
+
+
+def get_full_index_scans(plan):
+    if connection.vendor == 'sqlite':
+        return [step.split()[1] for step in plan
+                if step.startswith('SCAN ') and ' USING ' in step and 'INDEX' in step]
+    return [step['table'] for step in plan if step['type'] == 'index']
+
+
+def uses_filesort(plan):
+    if connection.vendor == 'sqlite':
+        return any('USE TEMP B-TREE FOR ORDER BY' in step for step in plan)
+    return any('Using filesort' in (step['Extra'] or '') for step in plan)
+
+#################################################################################
+#  Fixtures specific to this test module
+#################################################################################
+
+@pytest.fixture(autouse=True)
+def explainable_database(settings):
+    if connection.vendor not in ('sqlite', 'mysql'):
+        pytest.skip(f'No query plan parser for {connection.vendor}')
+    # the responses have to come from the database
+    settings.STORE_RESPONSE_CACHE = False
+
+@pytest.fixture
+def catalog():
+    collection = baker.make(Collection)
+    products = baker.make(Product, collection=collection, _quantity=3)
+    baker.make(Review, product=products[0], _quantity=3)
+    return collection, products
+
+@pytest.fixture
+def get_plans(api_client):
+    def do_get_plans(path, params=None):
+        queries = []
+
+        def record(execute, sql, sql_params, many, context):
+            queries.append((sql, sql_params))
+            return execute(sql, sql_params, many, context)
+
+        with connection.execute_wrapper(record):
+            response = api_client.get(path, params)
+        assert response.status_code == status.HTTP_200_OK
+        return [
+            (sql, explain(sql, sql_params))
+            for sql, sql_params in queries
+            if sql.startswith('SELECT')
+        ]
+    return do_get_plans
+
+#################################################################################
+
+
+@pytest.mark.django_db
+class TestQueryPlans:
+
+    @pytest.mark.parametrize('path, params', [
+        ('/store/products/', {}),
+        ('/store/products/', {'cursor': ''}),
+        ('/store/products/', {'collection_id': '{collection}'}),
+        ('/store/products/', {'collection_id': '{collection}', 'unit_price__gt': 10, 'unit_price__lt': 50}),
+        ('/store/products/', {'ordering': 'unit_price'}),
+        ('/store/products/', {'ordering': '-last_update', 'cursor': ''}),
+        ('/store/products/{product}/', {}),
+        ('/store/products/{product}/reviews/', {}),
+        ('/store/products/{product}/related/', {}),
+        ('/store/collections/', {}),
+        ('/store/home/', {}),
+    ])
+    def test_if_endpoint_is_called_no_query_scans_a_whole_table(self, get_plans, catalog, path, params):
+        collection, products = catalog
+        ids = {'collection': collection.id, 'product': products[0].id}
+        params = {key: str(value).format(**ids) for key, value in params.items()}
+
+        for sql, plan in get_plans(path.format(**ids), params):
+            scans = [table for table in get_full_scans(plan) if table not in FULL_SCAN_ALLOWED]
+            assert not scans, f'{sql}\n{plan}'
+
+    @pytest.mark.parametrize('params', [
+        {},
+        {'ordering': 'unit_price'},
+        {'ordering': '-last_update'},
+        {'collection_id': '{collection}'},
+        {'collection_id': '{collection}', 'ordering': 'unit_price'},
+        {'collection_id': '{collection}', 'ordering': 'last_update'},
+        {'collection_id': '{collection}', 'ordering': '-last_update'},
+    ])
+    def test_if_products_are_ordered_page_query_uses_an_index(self, get_plans, catalog, params):
+        collection, _ = catalog
+        params = {key: str(value).format(collection=collection.id) for key, value in params.items()}
+
+        table = 'FROM ' + connection.ops.quote_name('store_product')
+        page = [(sql, plan) for sql, plan in get_plans('/store/products/', params)
+                if 'ORDER BY' in sql and 'LIMIT' in sql and table in sql]
+
+        assert page
+        for sql, plan in page:
+            assert not uses_filesort(plan), f'{sql}\n{plan}'
+
+    @pytest.mark.parametrize('ordering', [
+        'title', '-title', 'unit_price', '-unit_price', 'last_update', '-last_update',
+        *(pytest.param(ordering, marks=RATING_ORDERING_SCANS)
+          for ordering in ('avg_rating', '-avg_rating', 'review_count', '-review_count'))])
+    def test_if_cursor_is_deep_page_query_seeks_the_index(self, api_client, get_plans, ordering):
+        products = baker.make(Product, _quantity=40)
+        for product in products[::3]:
+            baker.make(Review, product=product, rating=4)
+        # the cursor of the third page
+        params = {'cursor': '', 'ordering': ordering}
+        for _ in range(2):
+            next_page = api_client.get('/store/products/', params).data['next']
+            params = {'cursor': parse_qs(urlparse(next_page).query)['cursor'][0], 'ordering': ordering}
+
+        page = [(sql, plan) for sql, plan in get_plans('/store/products/', params)
+                if 'ORDER BY' in sql and 'LIMIT' in sql]
+
+        assert page
+        for sql, plan in page:
+            assert not get_full_scans(plan), f'{sql}\n{plan}'
+            assert not get_full_index_scans(plan), f'{sql}\n{plan}'
@@ -0,0 +1,106 @@
+import pytest
+from core.models import User
+from store.models import Customer, Order, OrderItem, Product, RelatedProduct
+from store import recommendations
+from store.recommendations import compute_related_products
+from rest_framework import status
+from model_bakery import baker
+
+#################################################################################
+#  Fixtures specific to this test module
+#################################################################################
+
+@pytest.fixture
+def place_order():
+    # the customer is created by a signal of the user
+    customer = Customer.objects.get(user=baker.make(User))
+
+    def do_place_order(*products):
+        order = baker.make(Order, customer=customer)
+        for product in products:
+            baker.make(OrderItem, order=order, product=product, quantity=1)
+        return order
+    return do_place_order
+
+@pytest.fixture
+def products():
+    return baker.make(Product, _quantity=4)
+
+#################################################################################
+
+
+@pytest.mark.django_db
+class TestRelatedProducts:
+
+    def test_if_product_is_created_during_the_run_leave_it_out(self, products, place_order, monkeypatch):
+        a, b, _, _ = products
+        place_order(a, b)
+        iterate_order_chunks = recommendations.iterate_order_chunks
+
+        def iterate_with_new_order(*args, **kwargs):
+            # the matrix size was read before
+            place_order(a, baker.make(Product))
+            yield from iterate_order_chunks(*args, **kwargs)
+
+        monkeypatch.setattr(recommendations, 'iterate_order_chunks', iterate_with_new_order)
+
+        assert compute_related_products() == 2
+        assert list(RelatedProduct.objects.filter(product=a).values_list('related_id', flat=True)) == [b.id]
+
+    def test_if_products_are_ordered_together_rank_them_by_orders(self, products, place_order):
+        a, b, c, d = products
+        place_order(a, b, c)
+        place_order(a, b)
+        place_order(a, c, c)
+        place_order(d)
+
+        assert compute_related_products(k=10, chunk_size=2) == 3
+
+        rows = RelatedProduct.objects.filter(product=a).order_by('rank')
+        assert [(row.related_id, row.score) for row in rows] == [(b.id, 2), (c.id, 2)]
+        assert not RelatedProduct.objects.filter(product=d).exists()
+
+    def test_if_k_is_reached_keep_best_neighbours(self, products, place_order):
+        a, b, c, d = products
+        place_order(a, c)
+        place_order(a, c, d)
+
+        compute_related_products(k=1)
+
+        assert list(RelatedProduct.objects.filter(product=a).values_list('related_id', 'rank')) == \
+            [(c.id, 1)]
+
+    def test_if_recomputed_replace_previous_rows(self, products, place_order):
+        a, b, c, d = products
+        place_order(a, b)
+        compute_related_products()
+        OrderItem.objects.all().delete()
+
+        compute_related_products()
+
+        assert not RelatedProduct.objects.exists()
+
+    def test_if_related_are_requested_return_them_in_one_query(
+            self, api_client, products, place_order, django_assert_num_queries):
+        a, b, c, d = products
+        place_order(a, b, c)
+        place_order(a, c)
+        compute_related_products()
+
+        with django_assert_num_queries(1):
+            response = api_client.get(f'/store/products/{a.id}/related/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [product['id'] for product in response.data] == [c.id, b.id]
+
+    def test_if_product_has_no_related_return_empty_list(self, api_client, products):
+        response = api_client.get(f'/store/products/{products[0].id}/related/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data == []
+
+    @pytest.mark.parametrize('pk', [0, 'a'])
+    def test_if_product_does_not_exist_return_404(self, api_client, pk):
+        response = api_client.get(f'/store/products/{pk}/related/')
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
@@ -0,0 +1,225 @@
+import json
+import pytest
+from datetime import date
+from store.counters import reconcile_product_ratings
+from store.models import Product, ProductRating, Review
+from store.write_behind import QUEUE_KEY, flush_pending_reviews
+from rest_framework import status
+from model_bakery import baker
+
+#################################################################################
+#  Fixtures specific to this test module
+#################################################################################
+
+@pytest.fixture
+def product():
+    return baker.make(Product)
+
+@pytest.fixture
+def list_reviews(api_client, product):
+    def do_list_reviews(params=None):
+        return api_client.get(path=f'/store/products/{product.id}/reviews/', data=params)
+    return do_list_reviews
+
+#################################################################################
+
+
+@pytest.mark.django_db
+class TestCachedReviews:
+
+    def test_if_review_is_added_return_new_review(self, api_client, product, list_reviews):
+        list_reviews()
+
+        response = api_client.post(
+            f'/store/products/{product.id}/reviews/', {'name': 'a', 'description': 'b'})
+        reviews = list_reviews()
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert [review['id'] for review in reviews.data['results']] == [response.data['id']]
+
+    def test_if_review_is_deleted_return_no_review(self, product, list_reviews):
+        review = baker.make(Review, product=product)
+        list_reviews()
+
+        review.delete()
+
+        assert list_reviews().data['results'] == []
+
+    def test_if_other_product_is_reviewed_return_cached_response(
+            self, product, list_reviews, django_assert_num_queries):
+        list_reviews()
+        baker.make(Review, product=baker.make(Product))
+
+        with django_assert_num_queries(0):
+            response = list_reviews()
+
+        assert response.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.django_db
+class TestPaginatedReviews:
+
+    def test_if_reviews_are_listed_return_newest_first(self, api_client, product, list_reviews):
+        reviews = baker.make(Review, product=product, _quantity=15)
+
+        first = list_reviews()
+        second = api_client.get(first.data['next'])
+
+        ids = [review['id'] for review in first.data['results'] + second.data['results']]
+        assert len(first.data['results']) == 10
+        assert ids == sorted((review.id for review in reviews), reverse=True)
+        assert second.data['next'] is None
+
+    def test_if_first_page_is_cached_return_it_without_queries(
+            self, product, list_reviews, django_assert_num_queries):
+        baker.make(Review, product=product, _quantity=15)
+        list_reviews()
+
+        with django_assert_num_queries(0):
+            list_reviews()
+
+    def test_if_next_page_is_requested_return_it_from_database(
+            self, api_client, product, list_reviews, django_assert_num_queries):
+        baker.make(Review, product=product, _quantity=15)
+        next_page = list_reviews().data['next']
+        api_client.get(next_page)
+
+        with django_assert_num_queries(1):
+            response = api_client.get(next_page)
+
+        assert len(response.data['results']) == 5
+
+
+@pytest.mark.django_db
+class TestProductRatings:
+
+    def rating(self, product):
+        return ProductRating.objects.get(pk=product.id)
+
+    def test_if_reviews_are_created_aggregates_are_updated(self, product):
+        baker.make(Review, product=product, rating=5)
+        baker.make(Review, product=product, rating=2)
+        baker.make(Review, product=product, rating=None)
+
+        rating = self.rating(product)
+        assert (rating.review_count, rating.rating_count, rating.rating_sum) == (3, 2, 7)
+        assert (rating.rating_2, rating.rating_5, rating.avg_rating) == (1, 1, 3.5)
+
+    def test_if_rating_is_changed_aggregates_are_updated(self, product):
+        review = baker.make(Review, product=product, rating=5)
+
+        review.rating = 1
+        review.save()
+
+        rating = self.rating(product)
+        assert (rating.review_count, rating.rating_1, rating.rating_5, rating.avg_rating) == (1, 1, 0, 1)
+
+    def test_if_review_is_deleted_aggregates_are_updated(self, product):
+        review = baker.make(Review, product=product, rating=4)
+
+        review.delete()
+
+        rating = self.rating(product)
+        assert (rating.review_count, rating.rating_count, rating.avg_rating) == (0, 0, 0)
+
+    def test_if_aggregates_drifted_reconcile_repairs_them(self, product):
+        baker.make(Review, product=product, rating=3, _quantity=2)
+        ProductRating.objects.update(review_count=10, avg_rating=1)
+
+        assert reconcile_product_ratings() == 1
+        rating = self.rating(product)
+        assert (rating.review_count, rating.avg_rating) == (2, 3)
+        assert reconcile_product_ratings() == 0
+
+    def test_if_products_are_ordered_by_avg_rating_return_best_first(self, api_client):
+        products = baker.make(Product, _quantity=3)
+        baker.make(Review, product=products[0], rating=2)
+        baker.make(Review, product=products[1], rating=5)
+
+        response = api_client.get('/store/products/', {'ordering': '-avg_rating'})
+
+        assert [product['id'] for product in response.data['results']] == \
+            [products[1].id, products[0].id, products[2].id]
+        assert [product['avg_rating'] for product in response.data['results']] == [5, 2, 0]
+        assert response.data['results'][0]['review_count'] == 1
+
+    def test_if_cursor_orders_by_review_count_return_every_product_once(self, api_client):
+        products = baker.make(Product, _quantity=15)
+        for count, product in enumerate(products):
+            for _ in range(count % 3):
+                baker.make(Review, product=product)
+
+        first = api_client.get('/store/products/', {'ordering': 'review_count', 'cursor': ''})
+        second = api_client.get(first.data['next'])
+
+        ids = [product['id'] for product in first.data['results'] + second.data['results']]
+        assert sorted(ids) == sorted(product.id for product in products)
+        counts = [product['review_count'] for product in first.data['results'] + second.data['results']]
+        assert counts == sorted(counts)
+
+
+@pytest.mark.django_db
+class TestWriteBehindReviews:
+
+    @pytest.fixture
+    def redis_client(self, monkeypatch):
+        fakeredis = pytest.importorskip('fakeredis')
+        client = fakeredis.FakeRedis()
+        monkeypatch.setattr('store.write_behind.get_client', lambda: client)
+        return client
+
+    @pytest.fixture(autouse=True)
+    def write_behind(self, settings, monkeypatch, redis_client):
+        settings.STORE_REVIEW_WRITE_BEHIND = True
+        jobs = []
+        monkeypatch.setattr('store.views.flush_reviews.apply_async', lambda **kwargs: jobs.append(kwargs))
+        return jobs
+
+    def post_review(self, api_client, product, rating=5):
+        return api_client.post(f'/store/products/{product.id}/reviews/',
+                               {'name': 'a', 'description': 'b', 'rating': rating})
+
+    def test_if_review_is_posted_return_202_and_schedule_one_flush(self, api_client, product, write_behind):
+        first = self.post_review(api_client, product)
+        self.post_review(api_client, product)
+
+        assert first.status_code == status.HTTP_202_ACCEPTED
+        assert first.data == {'name': 'a', 'description': 'b', 'rating': 5}
+        assert not Review.objects.exists()
+        assert len(write_behind) == 1
+
+    def test_if_review_is_invalid_return_400(self, api_client, product):
+        response = self.post_review(api_client, product, rating=6)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_if_reviews_are_flushed_write_them_and_refresh_caches(
+            self, api_client, product, list_reviews):
+        list_reviews()
+        self.post_review(api_client, product, rating=5)
+        self.post_review(api_client, product, rating=2)
+
+        assert flush_pending_reviews() == (2, False)
+
+        assert len(list_reviews().data['results']) == 2
+        rating = ProductRating.objects.get(pk=product.id)
+        assert (rating.review_count, rating.avg_rating) == (2, 3.5)
+        assert flush_pending_reviews() == (0, False)
+
+    def test_if_review_is_flushed_later_keep_its_submission_date(self, api_client, product, redis_client):
+        self.post_review(api_client, product)
+        [row] = redis_client.lrange(QUEUE_KEY, 0, -1)
+        redis_client.lset(QUEUE_KEY, 0, json.dumps({**json.loads(row), 'date': '2020-01-31'}))
+
+        flush_pending_reviews()
+
+        assert Review.objects.get().date == date(2020, 1, 31)
+
+    def test_if_lock_is_lost_stop_without_writing(self, api_client, product, redis_client, monkeypatch):
+        self.post_review(api_client, product)
+        # another flush took the lock over once this one's expired
+        monkeypatch.setattr('store.write_behind.renew_lock', lambda client, token, release=False: False)
+
+        assert flush_pending_reviews() == (0, True)
+        assert not Review.objects.exists()
+        assert redis_client.llen(QUEUE_KEY) == 1
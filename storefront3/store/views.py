@@ -1,41 +1,173 @@
 from store.permissions import FullDjangoModelPermissions, IsAdminOrReadOnly, ViewCustomerHistoryPermission
-from store.pagination import DefaultPagination
-from django.db.models.aggregates import Count
+from store.pagination import DefaultPagination, KeysetPagination
+from django.conf import settings
+from django.db.models import Prefetch
+from django.db.models.aggregates import Count, Max
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.decorators import action, permission_classes
 from rest_framework.filters import SearchFilter, OrderingFilter
-from rest_framework.mixins import CreateModelMixin, DestroyModelMixin, RetrieveModelMixin, UpdateModelMixin
+from rest_framework.parsers import JSONParser
+from rest_framework.mixins import CreateModelMixin, DestroyModelMixin, ListModelMixin, RetrieveModelMixin, UpdateModelMixin
 from rest_framework.permissions import AllowAny, DjangoModelPermissions, DjangoModelPermissionsOrAnonReadOnly, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
 from rest_framework import status
+from .bulk import import_products
+from .carts import get_cart_storage
+from .counters import with_ratings
+from .export import FORMATS, export_rows
+from .facets import FacetsMixin
+from .fast_serializers import FastCollectionSerializer, FastProductSerializer
 from .filters import ProductFilter
-from .models import Cart, CartItem, Collection, Customer, Order, OrderItem, Product, Review, ProductImage
-from .serializers import AddCartItemSerializer, CartItemSerializer, CartSerializer, CollectionSerializer, CreateOrderSerializer, CustomerSerializer, OrderSerializer, ProductSerializer, ReviewSerializer, UpdateCartItemSerializer, UpdateOrderSerializer, ProductImageSerializer
+from .mixins import project_queryset, ConditionalGetMixin, FastReadMixin, ProjectedQuerysetMixin, ResponseCacheMixin, SparseQuerysetMixin
+from .operations import reassign_and_delete_collection
+from .parsers import NDJSONParser
+from .pricing import get_region, with_prices
+from .search import FullTextSearchFilter
+from .tasks import flush_reviews, get_review_flush_delay, reassign_collection
+from .write_behind import enqueue_review, use_write_behind
+from .models import Cart, CartItem, Collection, Customer, Order, OrderItem, Product, RelatedProduct, Review, ProductImage
+from .serializers import get_sparse_fieldset, AddCartItemSerializer, BatchCartItemSerializer, CartItemSerializer, CartSerializer, CollectionSerializer, CreateOrderSerializer, CustomerSerializer, HomeCollectionSerializer, OrderSerializer, ProductSerializer, ReassignCollectionSerializer, ReviewSerializer, SimpleProductSerializer, UpdateCartItemSerializer, UpdateOrderSerializer, ProductImageSerializer
 
 
-class ProductViewSet(ModelViewSet):
+#########################################################################################
+# Cache tags of the catalog endpoints (store.mixins)
+# - 'catalog' is bumped after bulk writes that bypass the signals
+# - the other tags are bumped by the signals of the rows they name
+#########################################################################################
+
+class ProductViewSet(ConditionalGetMixin, ResponseCacheMixin, FacetsMixin, FastReadMixin,
+                     SparseQuerysetMixin, ModelViewSet):
     # added prefetch to remove redundant SQL queries 
     queryset = Product.objects.prefetch_related('images').all()
     serializer_class = ProductSerializer
+    fast_serializer_class = FastProductSerializer
     # -------------------------------------------------------------------------
     # - filtering based on collection_id is handled by the DjangoFilterBackend 
     #   which is one of the filter_backends specified in the viewset.
     # - DjangoFilterBackend is responsible for applying the filters specified 
     #   in the filterset_class based on the query parameters in the URL
     # -------------------------------------------------------------------------
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    # - FullTextSearchFilter replaces SearchFilter, it searches the full-text
+    #   index instead of running ILIKE '%term%' over title and description
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, OrderingFilter]
     filterset_class = ProductFilter
     
     pagination_class = DefaultPagination
     permission_classes = [IsAdminOrReadOnly]
     search_fields = ['title', 'description']
-    ordering_fields = ['unit_price', 'last_update']
+    ordering_fields = ['title', 'unit_price', 'last_update', 'avg_rating', 'review_count']
+    # ?facets=collection,price counts (store.facets)
+    facet_filter_params = [*ProductFilter.base_filters, 'search']
+    facet_cache_tags = ['catalog', 'products', 'collections']
+
+    # -------------------------------------------------------------------------
+    # - ?cursor switches the list to keyset pagination (an empty cursor is the
+    #   first page), deep pages then cost the same as the first one
+    # - without it the list keeps the page number pagination
+    # -------------------------------------------------------------------------
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if KeysetPagination.cursor_query_param in self.request.query_params:
+                self._paginator = KeysetPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_queryset(self):
+        # avg_rating / review_count are read from the stored aggregates (store.counters)
+        queryset = with_ratings(super().get_queryset())
+        # tax inclusive prices are computed by the database, unless omitted
+        if get_sparse_fieldset(self.request, ['effective_price', 'price_with_tax']):
+            queryset = with_prices(queryset, get_region(self.request))
+        return queryset
+
+    def get_cache_tags(self):
+        if self.action == 'retrieve':
+            pk = self.kwargs['pk']
+            return ['catalog', f'product:{pk}', f'reviews:{pk}', 'tax_rates', 'promotions']
+        return ['catalog', 'products', 'tax_rates', 'promotions']
+
+    def get_validator_state(self):
+        # catches the writes which bypass the signals (queryset updates), the version
+        # tokens of the cache tags catch the others
+        products = Product.objects.all()
+        if self.action == 'retrieve':
+            try:
+                return products.filter(pk=self.kwargs['pk']) \
+                    .values_list('last_update', flat=True).first()
+            except (ValueError, TypeError):
+                return None
+
+        # same filters, search and ordering params as the response itself
+        return self.filter_queryset(with_ratings(products)).order_by().aggregate(
+            last_update=Max('last_update'), count=Count('id'))
+
+    def get_facets_queryset(self):
+        # ?ordering= can name the rating annotations
+        return with_ratings(Product.objects.all())
 
     def get_serializer_context(self):
         return {'request': self.request}
 
+    # -------------------------------------------------------------------------
+    # bulk import for catalog syncs : POST /store/products/bulk/
+    # - a json list or ndjson (application/x-ndjson), one product per row
+    # - rows with an id update that product, the others are created
+    # - returns the number of created / updated rows and the errors per row
+    # -------------------------------------------------------------------------
+    @action(detail=False, methods=['POST'], permission_classes=[IsAdminUser],
+            parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request):
+        rows = request.data
+        if not isinstance(rows, list):
+            return Response({'error': 'Expected a list of products.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        result = import_products(rows)
+        if rows and not result['created'] and not result['updated']:
+            return Response(result, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result)
+
+    # -------------------------------------------------------------------------
+    # streaming catalog export : GET /store/products/export/?output=ndjson|csv
+    # - every product with its collection title and image urls
+    # - the rows are streamed chunk by chunk (store.export)
+    # -------------------------------------------------------------------------
+    @action(detail=False, permission_classes=[IsAdminUser])
+    def export(self, request):
+        output = request.query_params.get('output', 'ndjson')
+        if output not in FORMATS:
+            return Response({'error': f'Unknown output, use one of {", ".join(FORMATS)}.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        content_type, lines = FORMATS[output]
+        response = StreamingHttpResponse(lines(export_rows(request)), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="catalog.{output}"'
+        return response
+
+    # -------------------------------------------------------------------------
+    # frequently bought together : GET /store/products/<id>/related/
+    # - computed every night from the orders (store.recommendations), the
+    #   request is one lookup on the (product, rank) index
+    # - 404 for an unknown product, checked only when it has no related rows
+    # -------------------------------------------------------------------------
+    @action(detail=True)
+    def related(self, request, pk):
+        try:
+            related = list(RelatedProduct.objects
+                           .filter(product_id=pk)
+                           .select_related('related')
+                           .order_by('rank'))
+        except (ValueError, TypeError):
+            raise Http404
+        if not related and not Product.objects.filter(pk=pk).exists():
+            raise Http404
+        serializer = SimpleProductSerializer([row.related for row in related], many=True)
+        return Response(serializer.data)
+
     def destroy(self, request, *args, **kwargs):
         if OrderItem.objects.filter(product_id=kwargs['pk']).count() > 0:
             return Response({'error': 'Product cannot be deleted because it is associated with an order item.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
@@ -43,41 +175,145 @@ class ProductViewSet(ModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
 
-class CollectionViewSet(ModelViewSet):
-    queryset = Collection.objects.annotate(
-        products_count=Count('products')).all()
+class CollectionViewSet(ConditionalGetMixin, ResponseCacheMixin, FastReadMixin, ModelViewSet):
+    # products_count is a stored counter (store.counters), no join / group by
+    queryset = Collection.objects.all()
     serializer_class = CollectionSerializer
+    fast_serializer_class = FastCollectionSerializer
     permission_classes = [IsAdminOrReadOnly]
+    cache_tags = ['catalog', 'collections']
 
     def destroy(self, request, *args, **kwargs):
-        if Product.objects.filter(collection_id=kwargs['pk']):
+        if Product.objects.filter(collection_id=kwargs['pk']).exists():
             return Response({'error': 'Collection cannot be deleted because it includes one or more products.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
         return super().destroy(request, *args, **kwargs)
 
+    # -------------------------------------------------------------------------
+    # move every product to another collection and delete this one :
+    # POST /store/collections/<id>/reassign/ {"target": <id>}
+    # - large collections are handled by a background job (202)
+    # -------------------------------------------------------------------------
+    @action(detail=True, methods=['POST'], permission_classes=[IsAdminUser])
+    def reassign(self, request, pk):
+        source = get_object_or_404(Collection, pk=pk)
+        serializer = ReassignCollectionSerializer(
+            data=request.data, context={'collection_id': source.id})
+        serializer.is_valid(raise_exception=True)
+        target_id = serializer.validated_data['target']
+
+        threshold = getattr(settings, 'STORE_BACKGROUND_REASSIGN_THRESHOLD', 10000)
+        if source.products_count > threshold:
+            job = reassign_collection.delay(source.id, target_id)
+            return Response({'task_id': job.id}, status=status.HTTP_202_ACCEPTED)
+
+        moved = reassign_and_delete_collection(source.id, target_id)
+        return Response({'moved': moved})
 
-class ReviewViewSet(ModelViewSet):
+
+#########################################################################################
+# Home screen : GET /store/home/
+# - every collection with its featured product and that product's first image
+# - 2 queries whatever the number of collections : collections joined with their
+#   featured product, then the images of all the featured products
+# - the snapshot is cached until a collection, product or image changes
+#########################################################################################
+
+class HomeViewSet(ResponseCacheMixin, ListModelMixin, GenericViewSet):
+    queryset = Collection.objects \
+        .select_related('featured_product') \
+        .prefetch_related(Prefetch(
+            'featured_product__images', queryset=ProductImage.objects.order_by('id'))) \
+        .order_by('title', 'id')
+    serializer_class = HomeCollectionSerializer
+    pagination_class = None
+    cache_tags = ['catalog', 'collections', 'products']
+
+
+class ReviewViewSet(ResponseCacheMixin, ModelViewSet):
     serializer_class = ReviewSerializer
+    # newest first, the keyset follows the (product_id, date, id) index
+    pagination_class = KeysetPagination
+    ordering = ['-date']
+    ordering_fields = ['date']
 
     def get_queryset(self):
         return Review.objects.filter(product_id=self.kwargs['product_pk'])
 
+    def get_cache_tags(self):
+        return [f'reviews:{self.kwargs["product_pk"]}']
+
+    def use_response_cache(self):
+        # only the first page of the list, the one shown with the product
+        first_page = not self.request.query_params.get(KeysetPagination.cursor_query_param)
+        return super().use_response_cache() and (self.action != 'list' or first_page)
+
     def get_serializer_context(self):
-        return {'product_id': self.kwargs['product_pk']}
+        return {'product_id': self.kwargs['product_pk'], 'request': self.request}
+
+    # -------------------------------------------------------------------------
+    # write-behind (STORE_REVIEW_WRITE_BEHIND) : the review is validated and
+    # buffered, a celery job inserts the buffer in batches (store.write_behind)
+    # -------------------------------------------------------------------------
+    def create(self, request, *args, **kwargs):
+        if not use_write_behind():
+            return super().create(request, *args, **kwargs)
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        review = {**serializer.validated_data, 'product_id': int(self.kwargs['product_pk'])}
+        if enqueue_review(review):
+            flush_reviews.apply_async(countdown=get_review_flush_delay())
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
 
 
-class CartViewSet(CreateModelMixin,
-                  RetrieveModelMixin,
-                  DestroyModelMixin,
-                  GenericViewSet):
-    queryset = Cart.objects.prefetch_related('items__product').all()
+#########################################################################################
+# Carts are read and written through the cart storage (store.carts, STORE_CART_STORAGE)
+#########################################################################################
+
+class CartViewSet(GenericViewSet):
     serializer_class = CartSerializer
 
+    def get_storage(self):
+        return get_cart_storage(CartItemSerializer())
+
+    def create(self, request, *args, **kwargs):
+        cart = self.get_storage().create_cart()
+        return Response(CartSerializer(cart).data, status=status.HTTP_201_CREATED)
+
+    def retrieve(self, request, pk):
+        cart = self.get_storage().get_cart(pk)
+        if cart is None:
+            raise Http404
+        return Response(CartSerializer(cart).data)
+
+    def destroy(self, request, pk):
+        if not self.get_storage().delete_cart(pk):
+            raise Http404
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    # -------------------------------------------------------------------------
+    # the total alone : GET /store/carts/<id>/subtotal/
+    # - the items aren't read, a cached total (STORE_CART_SUBTOTAL_CACHE) costs
+    #   one lookup of the cart version
+    # -------------------------------------------------------------------------
+    @action(detail=True)
+    def subtotal(self, request, pk):
+        total_price = self.get_storage().get_subtotal(pk)
+        if total_price is None:
+            raise Http404
+        return Response({'id': pk, 'total_price': total_price})
 
-class CartItemViewSet(ModelViewSet):
+
+class CartItemViewSet(GenericViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete']
 
+    def get_storage(self):
+        return get_cart_storage(CartItemSerializer())
+
     def get_serializer_class(self):
+        if self.action == 'batch':
+            return BatchCartItemSerializer
         if self.request.method == 'POST':
             return AddCartItemSerializer
         elif self.request.method == 'PATCH':
@@ -87,10 +323,46 @@ class CartItemViewSet(ModelViewSet):
     def get_serializer_context(self):
         return {'cart_id': self.kwargs['cart_pk']}
 
-    def get_queryset(self):
-        return CartItem.objects \
-            .filter(cart_id=self.kwargs['cart_pk']) \
-            .select_related('product')
+    def list(self, request, cart_pk):
+        items = self.get_storage().get_items(cart_pk)
+        return Response(CartItemSerializer(items, many=True).data)
+
+    def retrieve(self, request, cart_pk, pk):
+        item = self.get_storage().get_item(cart_pk, pk)
+        if item is None:
+            raise Http404
+        return Response(CartItemSerializer(item).data)
+
+    def create(self, request, cart_pk):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def partial_update(self, request, cart_pk, pk):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        item = self.get_storage().set_quantity(cart_pk, pk, serializer.validated_data['quantity'])
+        if item is None:
+            raise Http404
+        return Response(UpdateCartItemSerializer(item).data)
+
+    def destroy(self, request, cart_pk, pk):
+        if not self.get_storage().remove_item(cart_pk, pk):
+            raise Http404
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    # -------------------------------------------------------------------------
+    # many changes at once : PATCH /store/carts/<id>/items/batch/
+    # {"operations": [{"op": "add" | "set" | "remove", "product_id": 1, "quantity": 2}]}
+    # - applied in order, in one transaction, returns the cart
+    # -------------------------------------------------------------------------
+    @action(detail=False, methods=['PATCH'])
+    def batch(self, request, cart_pk):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        cart = serializer.save()
+        return Response(CartSerializer(cart).data)
 
 
 class CustomerViewSet(ModelViewSet):
@@ -116,8 +388,9 @@ class CustomerViewSet(ModelViewSet):
             return Response(serializer.data)
 
 
-class OrderViewSet(ModelViewSet):
+class OrderViewSet(ProjectedQuerysetMixin, ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete', 'head', 'options']
+    queryset = Order.objects.all()
 
     def get_permissions(self):
         if self.request.method in ['PATCH', 'DELETE']:
@@ -130,6 +403,7 @@ class OrderViewSet(ModelViewSet):
             context={'user_id': self.request.user.id})
         serializer.is_valid(raise_exception=True)
         order = serializer.save()
+        order = project_queryset(Order.objects.filter(pk=order.pk), OrderSerializer()).get()
         serializer = OrderSerializer(order)
         return Response(serializer.data)
 
@@ -141,14 +415,16 @@ class OrderViewSet(ModelViewSet):
         return OrderSerializer
 
     def get_queryset(self):
+        # the items and their products are loaded in two more queries (store.mixins)
+        queryset = super().get_queryset()
         user = self.request.user
 
         if user.is_staff:
-            return Order.objects.all()
+            return queryset
 
         customer_id = Customer.objects.only(
             'id').get(user_id=user.id)
-        return Order.objects.filter(customer_id=customer_id)
+        return queryset.filter(customer_id=customer_id)
 
 
 #########################################################################################
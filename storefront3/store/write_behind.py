@@ -0,0 +1,98 @@
+import json
+from datetime import date
+from uuid import uuid4
+from django.conf import settings
+from django.db import transaction
+from django_redis import get_redis_connection
+from .caching import bump_version
+from .counters import reconcile_product_ratings
+from .models import Product, Review
+
+#########################################################################################
+# Write-behind review ingestion (STORE_REVIEW_WRITE_BEHIND)
+# - the request validates the review and appends it to a redis list (RPUSH, atomic :
+#   no numbered slots a dead writer or an eviction could leave empty)
+# - a celery task (store.tasks.flush_reviews) is scheduled for the first review of a
+#   burst, it inserts the list with bulk_create in batches : LRANGE, insert, LTRIM
+# - the payload keeps the submission date, not the date of the flush
+# - bulk_create doesn't send the signals : the flush refreshes the rating
+#   aggregates and the cache tags of the products it wrote to
+# - one flush runs at a time : the lock holds a token and is renewed before every
+#   batch, a flush whose lock expired stops instead of writing a batch twice
+#########################################################################################
+
+QUEUE_KEY = 'store:reviews:queue'
+SCHEDULED_KEY = 'store:reviews:scheduled'
+LOCK_KEY = 'store:reviews:lock'
+LOCK_TIMEOUT = 5*60
+
+
+def use_write_behind():
+    return getattr(settings, 'STORE_REVIEW_WRITE_BEHIND', False)
+
+
+def get_client():
+    return get_redis_connection('default')
+
+
+def enqueue_review(review):
+    # returns True when the caller has to schedule a flush
+    client = get_client()
+    client.rpush(QUEUE_KEY, json.dumps({**review, 'date': date.today().isoformat()}))
+    return bool(client.set(SCHEDULED_KEY, 1, nx=True))
+
+
+def acquire_lock(client):
+    token = uuid4().hex
+    return token if client.set(LOCK_KEY, token, nx=True, ex=LOCK_TIMEOUT) else None
+
+
+def renew_lock(client, token, release=False):
+    # returns False when the lock expired and was taken by another flush
+    def renew(pipeline):
+        if pipeline.get(LOCK_KEY) != token.encode():
+            return False
+        pipeline.multi()
+        if release:
+            pipeline.delete(LOCK_KEY)
+        else:
+            pipeline.expire(LOCK_KEY, LOCK_TIMEOUT)
+        return True
+
+    return client.transaction(renew, LOCK_KEY, value_from_callable=True)
+
+
+def flush_pending_reviews(batch_size=500):
+    # returns the number of reviews written and whether reviews are left behind
+    client = get_client()
+    token = acquire_lock(client)
+    if token is None:
+        return 0, True
+    try:
+        # reviews enqueued from now on schedule another flush
+        client.delete(SCHEDULED_KEY)
+        written = 0
+        while renew_lock(client, token):
+            rows = client.lrange(QUEUE_KEY, 0, batch_size - 1)
+            if not rows:
+                return written, False
+            written += write_reviews([json.loads(row) for row in rows])
+            client.ltrim(QUEUE_KEY, len(rows), -1)
+        return written, True
+    finally:
+        renew_lock(client, token, release=True)
+
+
+def write_reviews(reviews):
+    # products deleted since the submission drop their reviews
+    product_ids = {review['product_id'] for review in reviews}
+    product_ids = set(Product.objects.filter(pk__in=product_ids).values_list('id', flat=True))
+
+    with transaction.atomic():
+        created = Review.objects.bulk_create(
+            Review(**{**review, 'date': date.fromisoformat(review['date'])})
+            for review in reviews if review['product_id'] in product_ids)
+        reconcile_product_ratings(product_ids)
+        bump_version('products', *(f'product:{product_id}' for product_id in product_ids),
+                     *(f'reviews:{product_id}' for product_id in product_ids))
+    return len(created)
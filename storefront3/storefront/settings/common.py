@@ -206,7 +206,17 @@ CELERY_BEAT_SCHEDULE = {
         # 'schedule': crontab(minute='*/30'), # every 15 minutes
         'schedule': 5, # seconds
         'args': ['Hello World'],
-    }
+    },
+    # "frequently bought together" (store.recommendations)
+    'refresh_related_products': {
+        'task': 'store.tasks.refresh_related_products',
+        'schedule': crontab(hour=3, minute=0), # every night on 3:00
+    },
+    # abandoned carts (store.carts)
+    'purge_carts': {
+        'task': 'store.tasks.purge_carts',
+        'schedule': crontab(minute=15), # every hour
+    },
 }
 
 #########################################################################################
@@ -225,6 +235,56 @@ CACHES = {
     }
 }
 
+#########################################################################################
+# ADD : store app settings
+#########################################################################################
+
+# tax rate used when no TaxRate matches (store.pricing)
+# STORE_DEFAULT_TAX_RATE = Decimal('0.10')
+# tax region used when the request has no ?region=
+# STORE_TAX_REGION = ''
+
+# full-text search backend, picked from the database vendor when not set (store.search)
+# STORE_SEARCH_BACKEND = 'store.search.MySQLFullTextBackend'
+
+# serve read-only product / collection endpoints with the fast serializers
+# (store.fast_serializers), the output is identical
+STORE_FAST_SERIALIZATION = False
+
+# cache the read-only responses of the catalog / review endpoints (store.mixins),
+# writes invalidate them through cache tags, the timeout only frees old entries
+STORE_RESPONSE_CACHE = True
+STORE_RESPONSE_CACHE_TIMEOUT = 24*60*60
+
+# upper bounds of the price buckets of ?facets=price, and whether the facet counts
+# are cached under the normalized filters (store.facets)
+STORE_PRICE_FACETS = [10, 25, 50, 100]
+STORE_FACETS_CACHE = True
+
+# collections with more products are reassigned by a celery job (store.tasks)
+STORE_BACKGROUND_REASSIGN_THRESHOLD = 10000
+
+# buffer new reviews in a redis list (the default cache) and insert them in batches
+# from a celery job (store.write_behind), the submissions return 202, the flush runs
+# STORE_REVIEW_FLUSH_DELAY seconds after the first review of a burst
+STORE_REVIEW_WRITE_BEHIND = False
+STORE_REVIEW_FLUSH_DELAY = 5
+
+# where the carts live until the checkout (store.carts) : the database or redis hashes
+# (the default cache) which expire STORE_CART_TTL seconds after their last change
+STORE_CART_STORAGE = 'store.carts.DatabaseCartStorage'
+# STORE_CART_STORAGE = 'store.carts.RedisCartStorage'
+STORE_CART_TTL = 7*24*60*60
+# database carts unchanged for STORE_CART_TTL seconds are deleted every hour by a
+# celery job, in transactions of STORE_CART_PURGE_BATCH_SIZE carts (store.tasks)
+STORE_CART_PURGE_BATCH_SIZE = 500
+# cache the totals of the carts per version of the cart, an item change carries the
+# total over to the new version with its difference (store.carts)
+STORE_CART_SUBTOTAL_CACHE = False
+
+# number of related products kept per product, recomputed every night (store.tasks)
+STORE_RELATED_PRODUCTS = 10
+
 #########################################################################################
 # ADD : Logging 
 # Log messages have a severity 